@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from datetime import timedelta
 from pathlib import Path
 
@@ -50,9 +51,11 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'marketplace.routers.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
+    'marketplace.metrics.RequestMetricsMiddleware',
 ]
 
 ROOT_URLCONF = 'farmdirect.urls'
@@ -83,9 +86,45 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        # Writers take the database lock at BEGIN and queue for up to
+        # ``timeout`` seconds, instead of failing when two transactions try
+        # to upgrade a read lock at once (see marketplace/inventory.py).
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # A file rather than in-memory shared cache, whose table locks never
+        # wait, so the concurrent checkout test exercises real queueing.
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+        # Persistent connections, checked before reuse by each request.
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+    },
+    # Read replica (marketplace/routers.py). Locally a copy of db.sqlite3
+    # can stand in for it: FARMDIRECT_REPLICA_DB=db-replica.sqlite3.
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('FARMDIRECT_REPLICA_DB', BASE_DIR / 'db.sqlite3'),
+        'OPTIONS': {
+            'timeout': 20,
+        },
+        'TEST': {
+            'NAME': BASE_DIR / 'test_replica_db.sqlite3',
+        },
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+    },
 }
 
+DATABASE_ROUTERS = ['marketplace.routers.PrimaryReplicaRouter']
+# Aliases safe reads are spread over; empty reads everything from default.
+DATABASE_REPLICAS = ['replica'] if os.environ.get('FARMDIRECT_REPLICA_DB') else []
+# How long a user reads from the primary after writing (replication lag).
+DATABASE_PIN_SECONDS = 10
+DATABASE_PIN_CACHE = 'default'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -106,6 +145,23 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Caches
+# Local memory per process by default. With several worker processes, point
+# these at a shared backend (e.g. django.core.cache.backends.redis.RedisCache)
+# so cache invalidations reach every worker.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'farmdirect',
+    },
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'farmdirect-catalog',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
@@ -123,6 +179,9 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+MEDIA_URL = '/media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -137,7 +196,7 @@ CORS_ALLOW_CREDENTIALS = True
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'marketplace.authentication.ClaimsJWTAuthentication',
     )
 }
 
@@ -145,4 +204,27 @@ SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
     'ROTATE_REFRESH_TOKENS': True,
-}
\ No newline at end of file
+    'TOKEN_OBTAIN_SERIALIZER': 'marketplace.serializers.CustomTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'marketplace.serializers.CustomTokenRefreshSerializer',
+}
+
+# Revoked JWTs (marketplace/authentication.py)
+JWT_REVOCATION_CACHE = 'default'
+
+# Notification fan-out (marketplace/notifications.py)
+NOTIFICATION_FANOUT_BATCH_SIZE = 1000
+NOTIFICATION_FANOUT_EAGER = False
+
+# Notification push channel (marketplace/realtime.py)
+REALTIME_BROKER = 'marketplace.realtime.InMemoryBroker'
+
+# Stock holds on pending orders (marketplace/inventory.py)
+INVENTORY_RESERVATION_MINUTES = 15
+
+# Catalog response cache (marketplace/caching.py)
+CATALOG_CACHE = 'catalog'
+CATALOG_CACHE_TIMEOUT = 60 * 10
+
+# Request metrics and /metrics (marketplace/metrics.py)
+METRICS_SLOW_REQUEST_SECONDS = 1.0
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
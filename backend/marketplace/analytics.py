@@ -0,0 +1,227 @@
+"""Sales rollups backing AnalyticsView.
+
+``FarmerSalesRollup`` rows are never adjusted with +/- deltas: whenever an
+order or order item changes, the affected (day, farmer) buckets are recomputed
+from the order tables once the transaction commits. Rebuilding a bucket only
+touches that day's orders, which keeps the maintenance incremental while
+distinct order/customer counts stay exact.
+"""
+import datetime
+import threading
+
+from django.db import transaction
+from django.db.models import Count, F, Min, Sum
+from django.db.models.functions import TruncMonth, TruncQuarter
+from django.utils import timezone
+
+from .models import FarmerCustomer, FarmerOrderRollup, FarmerSalesRollup, Order, OrderItem
+
+PERIODS = {
+    'month': TruncMonth,
+    'quarter': TruncQuarter,
+}
+
+_pending = threading.local()
+
+
+def day_bounds(day):
+    """Aware datetimes delimiting ``day`` in the current time zone"""
+    start = timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+    return start, start + datetime.timedelta(days=1)
+
+
+def order_day(order):
+    return timezone.localdate(order.created_at)
+
+
+def refresh_day(day, farmer_ids=None):
+    """Recompute the rollup buckets and first-order dates for one day.
+
+    ``farmer_ids`` limits the refresh to those farmers; ``None`` rebuilds the
+    whole day.
+    """
+    start, end = day_bounds(day)
+    items = OrderItem.objects.filter(order__created_at__gte=start, order__created_at__lt=end)
+    rollups = FarmerSalesRollup.objects.filter(day=day)
+    order_rollups = FarmerOrderRollup.objects.filter(day=day)
+    if farmer_ids is not None:
+        items = items.filter(product__farmer_id__in=farmer_ids)
+        rollups = rollups.filter(farmer_id__in=farmer_ids)
+        order_rollups = order_rollups.filter(farmer_id__in=farmer_ids)
+
+    buckets = (
+        items.values('product__farmer_id', 'product__category', 'order__status')
+        .annotate(
+            revenue=Sum(F('price') * F('quantity')),
+            units=Sum('quantity'),
+            orders=Count('order', distinct=True),
+            customers=Count('order__customer', distinct=True),
+        )
+        .order_by()
+    )
+    order_buckets = (
+        items.values('product__farmer_id', 'order__status')
+        .annotate(orders=Count('order', distinct=True))
+        .order_by()
+    )
+
+    with transaction.atomic():
+        rollups.delete()
+        order_rollups.delete()
+        FarmerSalesRollup.objects.bulk_create([
+            FarmerSalesRollup(
+                farmer_id=bucket['product__farmer_id'],
+                day=day,
+                category=bucket['product__category'],
+                status=bucket['order__status'],
+                revenue=bucket['revenue'],
+                units=bucket['units'],
+                orders=bucket['orders'],
+                customers=bucket['customers'],
+            )
+            for bucket in buckets
+        ])
+        FarmerOrderRollup.objects.bulk_create([
+            FarmerOrderRollup(
+                farmer_id=bucket['product__farmer_id'],
+                day=day,
+                status=bucket['order__status'],
+                orders=bucket['orders'],
+            )
+            for bucket in order_buckets
+        ])
+        _refresh_first_orders(day, items, farmer_ids)
+
+
+def _refresh_first_orders(day, items, farmer_ids):
+    # Customers who ordered that day may have become new customers, and those
+    # first seen that day may no longer be (e.g. their order was cancelled).
+    pairs = set(items.values_list('product__farmer_id', 'order__customer_id').distinct())
+    first_seen = FarmerCustomer.objects.filter(first_order_date=day)
+    if farmer_ids is not None:
+        first_seen = first_seen.filter(farmer_id__in=farmer_ids)
+    pairs.update(first_seen.values_list('farmer_id', 'customer_id'))
+    if not pairs:
+        return
+
+    farmers = {farmer_id for farmer_id, _ in pairs}
+    customers = {customer_id for _, customer_id in pairs}
+    firsts = (
+        OrderItem.objects
+        .filter(product__farmer_id__in=farmers, order__customer_id__in=customers)
+        .exclude(order__status=Order.CANCELLED)
+        .values_list('product__farmer_id', 'order__customer_id')
+        .annotate(first_order=Min('order__created_at'))
+        .order_by()
+    )
+    found = {
+        (farmer_id, customer_id): timezone.localdate(first_order)
+        for farmer_id, customer_id, first_order in firsts
+        if (farmer_id, customer_id) in pairs
+    }
+
+    FarmerCustomer.objects.bulk_create(
+        [
+            FarmerCustomer(farmer_id=farmer_id, customer_id=customer_id, first_order_date=first)
+            for (farmer_id, customer_id), first in found.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['farmer', 'customer'],
+        update_fields=['first_order_date'],
+    )
+    for farmer_id in farmers:
+        gone = [customer_id for f, customer_id in pairs - found.keys() if f == farmer_id]
+        if gone:
+            FarmerCustomer.objects.filter(farmer_id=farmer_id, customer_id__in=gone).delete()
+
+
+def rebuild_range(start, end, farmer_ids=None):
+    """Rebuild every day bucket between ``start`` and ``end`` inclusive"""
+    day = start
+    days = 0
+    while day <= end:
+        refresh_day(day, farmer_ids)
+        day += datetime.timedelta(days=1)
+        days += 1
+    return days
+
+
+def schedule_refresh(day, farmer_ids):
+    """Refresh the given buckets once the current transaction commits.
+
+    Buckets are collected per thread so an order saved together with many
+    items is only rolled up once. Buckets left behind by a rolled back
+    transaction are harmlessly refreshed on the next commit.
+    """
+    pending = getattr(_pending, 'buckets', None)
+    if pending is None:
+        pending = _pending.buckets = {}
+    pending.setdefault(day, set()).update(farmer_ids)
+    transaction.on_commit(flush_pending)
+
+
+def flush_pending():
+    pending = getattr(_pending, 'buckets', None)
+    if not pending:
+        return
+    _pending.buckets = {}
+    for day, farmer_ids in pending.items():
+        refresh_day(day, farmer_ids)
+
+
+def sales_analytics(farmer, start, end, period='month'):
+    """Dashboard series for ``farmer`` between two dates, read from rollups"""
+    trunc = PERIODS[period]
+    rollups = FarmerSalesRollup.objects.filter(farmer=farmer, day__gte=start, day__lte=end)
+
+    # An order is on one day, so day buckets of distinct orders add up.
+    order_rollups = FarmerOrderRollup.objects.filter(farmer=farmer, day__gte=start, day__lte=end)
+
+    revenue = (
+        rollups.filter(status=Order.COMPLETED)
+        .annotate(period=trunc('day'))
+        .values('period')
+        .annotate(revenue=Sum('revenue'), units=Sum('units'))
+        .order_by('period')
+    )
+    completed = dict(
+        order_rollups.filter(status=Order.COMPLETED)
+        .annotate(period=trunc('day'))
+        .values('period')
+        .annotate(orders=Sum('orders'))
+        .values_list('period', 'orders')
+        .order_by()
+    )
+    order_status = order_rollups.values('status').annotate(orders=Sum('orders')).order_by('status')
+
+    customers = FarmerCustomer.objects.filter(farmer=farmer)
+    total = customers.filter(first_order_date__lt=start).count()
+    growth = []
+    new_customers = (
+        customers.filter(first_order_date__gte=start, first_order_date__lte=end)
+        .annotate(period=trunc('first_order_date'))
+        .values('period')
+        .annotate(new_customers=Count('id'))
+        .order_by('period')
+    )
+    for row in new_customers:
+        total += row['new_customers']
+        growth.append({
+            'period': row['period'].isoformat(),
+            'new_customers': row['new_customers'],
+            'total_customers': total,
+        })
+
+    return {
+        'monthly_revenue': [
+            {
+                'period': row['period'].isoformat(),
+                'revenue': row['revenue'],
+                'units': row['units'],
+                'orders': completed.get(row['period'], 0),
+            }
+            for row in revenue
+        ],
+        'order_status': list(order_status),
+        'customer_growth': growth,
+    }
@@ -0,0 +1,138 @@
+"""JWT authentication from token claims, without loading the user.
+
+Tokens issued by ``CustomTokenObtainPairSerializer`` carry the user's
+username, staff flags and farmer profile id. ``ClaimsJWTAuthentication``
+builds ``request.user`` from them: a ``User`` whose other fields are
+deferred (loaded on first access) and whose ``farmerprofile`` relation is
+already resolved, so ``hasattr(user, 'farmerprofile')`` and filtering on the
+user or farmer cost no queries.
+
+Since the database is not consulted, revocation goes through the cache
+named by ``settings.JWT_REVOCATION_CACHE``: single tokens are revoked at
+logout, and all tokens issued to a user before a password change or
+deactivation are rejected. When claims change (a farmer profile is created,
+staff flags flip), older tokens are marked stale and fall back to loading
+the user until they are refreshed. Like the catalog cache, use a shared
+backend so that revocations reach every worker process.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from rest_framework_simplejwt.utils import datetime_to_epoch
+
+from .models import FarmerProfile
+
+DEFAULT_CACHE = 'default'
+REVOKED_TOKEN_KEY = 'jwt:revoked:{}'
+REVOKED_BEFORE_KEY = 'jwt:revoked-before:{}'
+STALE_BEFORE_KEY = 'jwt:stale-before:{}'
+FARMER_CLAIM = 'farmer_id'
+USER_CLAIMS = ('username', 'is_staff', 'is_superuser')
+
+
+class PreciseIssuedAtMixin:
+    # Sub-second ``iat`` so a revocation does not also catch tokens issued
+    # later within the same second (a login with the new password).
+    def set_iat(self, claim='iat', at_time=None):
+        at_time = at_time or self.current_time
+        self.payload[claim] = datetime_to_epoch(at_time) + at_time.microsecond / 1e6
+
+
+class ClaimsAccessToken(PreciseIssuedAtMixin, AccessToken):
+    pass
+
+
+class ClaimsRefreshToken(PreciseIssuedAtMixin, RefreshToken):
+    access_token_class = ClaimsAccessToken
+
+
+def issue_token(user):
+    """A refresh token (and through it, access tokens) carrying user claims"""
+    token = ClaimsRefreshToken.for_user(user)
+    for claim in USER_CLAIMS:
+        token[claim] = getattr(user, claim)
+    farmer_id = FarmerProfile.objects.filter(user=user).values_list('pk', flat=True).first()
+    token[FARMER_CLAIM] = farmer_id
+    token['is_farmer'] = farmer_id is not None
+    return token
+
+
+def get_cache():
+    return caches[getattr(settings, 'JWT_REVOCATION_CACHE', DEFAULT_CACHE)]
+
+
+def _lifetime_seconds(name):
+    return int(getattr(api_settings, name).total_seconds())
+
+
+def revoke_token(token):
+    """Reject ``token`` (by its jti) until it expires anyway"""
+    remaining = int(token['exp'] - time.time()) + 1
+    if remaining > 0:
+        get_cache().set(REVOKED_TOKEN_KEY.format(token[api_settings.JTI_CLAIM]), True, remaining)
+
+
+def revoke_user(user_id):
+    """Reject every token issued to the user until now"""
+    get_cache().set(REVOKED_BEFORE_KEY.format(user_id), time.time(), _lifetime_seconds('REFRESH_TOKEN_LIFETIME'))
+
+
+def claims_changed(user_id):
+    """Stop trusting the claims of the user's tokens issued until now"""
+    get_cache().set(STALE_BEFORE_KEY.format(user_id), time.time(), _lifetime_seconds('ACCESS_TOKEN_LIFETIME'))
+
+
+def check(token):
+    """Raise AuthenticationFailed if ``token`` is revoked; returns whether its claims are stale"""
+    user_id = token.get(api_settings.USER_ID_CLAIM)
+    keys = [
+        REVOKED_TOKEN_KEY.format(token.get(api_settings.JTI_CLAIM)),
+        REVOKED_BEFORE_KEY.format(user_id),
+        STALE_BEFORE_KEY.format(user_id),
+    ]
+    found = get_cache().get_many(keys)
+    issued = token.get('iat', 0)
+    if keys[0] in found or issued < found.get(keys[1], 0):
+        raise AuthenticationFailed(_('Token has been revoked'), code='token_revoked')
+    return issued < found.get(keys[2], 0)
+
+
+def claims_user(token):
+    """A ``User`` built from the claims; its other fields load on first access"""
+    values = {
+        'id': int(token[api_settings.USER_ID_CLAIM]),
+        'is_active': True,
+        **{claim: token[claim] for claim in USER_CLAIMS},
+    }
+    fields = [field.attname for field in User._meta.concrete_fields if field.attname in values]
+    # Bound to the write database, so that saving it only writes the
+    # loaded fields instead of fetching every deferred one.
+    user = User.from_db(router.db_for_write(User), fields, [values[name] for name in fields])
+    farmer = None
+    if token[FARMER_CLAIM] is not None:
+        farmer = FarmerProfile.from_db(user._state.db, ['id', 'user_id'], [token[FARMER_CLAIM], user.pk])
+        FarmerProfile.user.field.set_cached_value(farmer, user)
+    User.farmerprofile.related.set_cached_value(user, farmer)
+    return user
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that trusts the user claims of our own tokens.
+
+    Tokens without them (issued elsewhere) or with stale ones load the user
+    as usual.
+    """
+
+    def get_user(self, validated_token):
+        stale = check(validated_token)
+        if stale or FARMER_CLAIM not in validated_token:
+            return super().get_user(validated_token)
+        return claims_user(validated_token)
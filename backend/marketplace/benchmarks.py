@@ -0,0 +1,226 @@
+"""Reproducible latency benchmarks for the hot API endpoints.
+
+``generate`` bulk-loads a synthetic marketplace of a given shape; ``run``
+requests each endpoint in ``ENDPOINTS`` through the full middleware stack
+(JWT auth included) and reports latency percentiles, queries per request,
+response size and peak Python memory. ``compare`` checks a run against a
+stored baseline. ``manage.py benchmark_api`` ties these together and rolls
+the generated data back afterwards.
+"""
+import datetime
+import math
+import random
+import time
+import tracemalloc
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import caching
+from .metrics import QueryRecorder
+from .models import Event, FarmerProfile, Notification, Order, OrderItem, Product
+
+# Counts at scale 1. Per-user counts grow with the scale, so each
+# benchmarked response grows with it too; the number of users does not.
+BASE_SHAPE = {
+    'farmers': 5,
+    'products_per_farmer': 20,
+    'customers': 10,
+    'orders_per_customer': 10,
+    'items_per_order': 3,
+    'notifications_per_customer': 50,
+    'events_per_farmer': 20,
+}
+FIXED = ('farmers', 'customers', 'items_per_order')
+
+# name, url, who requests it, catalog scopes bumped before each cold request
+ENDPOINTS = [
+    ('ProductList', '/api/products/', None, ['products']),
+    ('FarmerOrders', '/api/farmer/orders/', 'farmer', []),
+    ('NotificationViewSet', '/api/notifications/', 'customer', []),
+    ('export_ical', '/api/calendar/export/', 'farmer', []),
+]
+
+
+def scaled_shape(scale, base=None):
+    shape = dict(base or BASE_SHAPE)
+    for key in shape:
+        if key not in FIXED:
+            shape[key] = max(1, round(shape[key] * scale))
+    return shape
+
+
+def generate(shape, seed=0):
+    """Create a synthetic marketplace; returns the users to benchmark as.
+
+    Rows are bulk-created, so signals (search index, rollups, derivatives)
+    do not run; call inside a transaction that is rolled back.
+    """
+    rng = random.Random(seed)
+    tag = time.time_ns()
+    now = timezone.now()
+    today = now.date()
+
+    farmer_users = User.objects.bulk_create([
+        User(username=f'bench-farmer-{tag}-{i}', first_name='Bench', last_name=f'Farmer {i}')
+        for i in range(shape['farmers'])
+    ])
+    farmers = FarmerProfile.objects.bulk_create([
+        FarmerProfile(user=user, farm_name=f'Bench farm {i}', location='Accra', contact_number='0200000000')
+        for i, user in enumerate(farmer_users)
+    ])
+    categories = [code for code, _ in Product.CATEGORY_CHOICES]
+    products = Product.objects.bulk_create([
+        Product(
+            farmer=farmer, name=f'Product {i}-{j}', description='Synthetic benchmark product',
+            price=Decimal(rng.randrange(50, 5000)) / 100, category=rng.choice(categories),
+            quantity=rng.randrange(0, 500), image=f'products/bench-{j}.jpg',
+            harvest_date=today, expiry_date=today + datetime.timedelta(days=30),
+        )
+        for i, farmer in enumerate(farmers)
+        for j in range(shape['products_per_farmer'])
+    ])
+
+    customers = User.objects.bulk_create([
+        User(username=f'bench-customer-{tag}-{i}') for i in range(shape['customers'])
+    ])
+    statuses = [Order.PENDING, Order.COMPLETED, Order.CANCELLED]
+    carts = [
+        (customer, rng.sample(products, min(shape['items_per_order'], len(products))))
+        for customer in customers
+        for _ in range(shape['orders_per_customer'])
+    ]
+    orders = Order.objects.bulk_create([
+        Order(customer=customer, status=rng.choice(statuses), total=sum(p.price * 2 for p in cart))
+        for customer, cart in carts
+    ])
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product=product, quantity=2, price=product.price)
+        for order, (_, cart) in zip(orders, carts)
+        for product in cart
+    ])
+
+    Notification.objects.bulk_create([
+        Notification(
+            user=customer, message=f'Order {order.pk} was updated', notification_type='order',
+            read=rng.random() < 0.5, related_object=order,
+        )
+        for customer in customers
+        for order in rng.choices(orders, k=shape['notifications_per_customer'])
+    ])
+    event_types = [code for code, _ in Event.EVENT_TYPES]
+    events = []
+    for farmer in farmers:
+        for i in range(shape['events_per_farmer']):
+            start = now + datetime.timedelta(hours=rng.randrange(-24 * 14, 24 * 60))
+            events.append(Event(
+                user=farmer.user, title=f'Event {i}', event_type=rng.choice(event_types), start=start,
+                end=start + datetime.timedelta(hours=2), span=datetime.timedelta(hours=2),
+                related_object=rng.choice(products),
+            ))
+    Event.objects.bulk_create(events)
+    return {'farmer': farmer_users[0], 'customer': customers[0]}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an ascending list"""
+    return sorted_values[max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)]
+
+
+def _host():
+    # localhost is only allowed implicitly while DEBUG is on.
+    hosts = [host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*']
+    return hosts[0] if hosts else 'localhost'
+
+
+def _fetch(client, url, headers):
+    response = client.get(url, **headers)
+    body = b''.join(response.streaming_content) if response.streaming else response.content
+    if response.status_code != 200:
+        raise RuntimeError(f'GET {url} returned {response.status_code}: {body[:200]!r}')
+    return len(body)
+
+
+def measure(url, user=None, requests=20, scopes=(), warm_cache=False):
+    """Latency, queries, size and peak memory of ``requests`` GETs of ``url``"""
+    client = Client(HTTP_HOST=_host())
+    headers = {}
+    if user is not None:
+        headers['HTTP_AUTHORIZATION'] = f'Bearer {AccessToken.for_user(user)}'
+
+    def cold():
+        if scopes and not warm_cache:
+            caching.bump(scopes)
+
+    cold()
+    _fetch(client, url, headers)  # warm-up: imports, content types, connection
+
+    timings, queries = [], []
+    for _ in range(requests):
+        cold()
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            started = time.perf_counter()
+            size = _fetch(client, url, headers)
+            timings.append(time.perf_counter() - started)
+        queries.append(recorder.count)
+
+    # tracemalloc slows everything down, so memory gets a pass of its own.
+    cold()
+    tracemalloc.start()
+    try:
+        _fetch(client, url, headers)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'requests': requests,
+        'p50_ms': round(percentile(timings, 50) * 1000, 2),
+        'p95_ms': round(percentile(timings, 95) * 1000, 2),
+        'p99_ms': round(percentile(timings, 99) * 1000, 2),
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 2),
+        'queries': max(queries),
+        'bytes': size,
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def run(shape, requests=20, warm_cache=False, endpoints=None, seed=0):
+    """Generate ``shape`` and benchmark each endpoint; returns result rows"""
+    users = generate(shape, seed=seed)
+    results = []
+    for name, url, who, scopes in ENDPOINTS:
+        if endpoints and name not in endpoints:
+            continue
+        stats = measure(url, users.get(who), requests=requests, scopes=scopes, warm_cache=warm_cache)
+        results.append({'endpoint': name, 'url': url, **stats})
+    return results
+
+
+def compare(baseline, current, threshold=0.2):
+    """Regressions of ``current`` against ``baseline`` results.
+
+    A result regresses when its p95 latency or peak memory grows by more
+    than ``threshold`` (a fraction) or it issues more queries. Results are
+    matched on scale and endpoint; unmatched ones are ignored.
+    """
+    previous = {(row['scale'], row['endpoint']): row for row in baseline['results']}
+    regressions = []
+    for row in current['results']:
+        old = previous.get((row['scale'], row['endpoint']))
+        if old is None:
+            continue
+        where = f"{row['endpoint']} at scale {row['scale']}"
+        for key in ('p95_ms', 'peak_kib'):
+            if old[key] and row[key] > old[key] * (1 + threshold):
+                regressions.append(f'{where}: {key} {old[key]} -> {row[key]} (+{row[key] / old[key] - 1:.0%})')
+        if row['queries'] > old['queries']:
+            regressions.append(f"{where}: queries {old['queries']} -> {row['queries']}")
+    return regressions
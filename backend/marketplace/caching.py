@@ -0,0 +1,172 @@
+"""Versioned response cache for the public catalog endpoints.
+
+A cached response is keyed by the view, the normalized query string and the
+current version of every *scope* the response depends on, e.g. the
+categories a product list is filtered to. Signals bump the versions of the
+scopes a write touches, which makes the old entries unreachable (they age
+out of the cache) without flushing anything unrelated: editing one farmer's
+tomatoes leaves grain listings and other farmers' pages cached.
+
+Versions and responses live in the cache named by ``settings.CATALOG_CACHE``
+(local memory by default; use a shared backend so that invalidations reach
+every worker process).
+"""
+import datetime
+import hashlib
+import math
+import threading
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.response import Response
+from rest_framework.utils.serializer_helpers import ReturnDict, ReturnList
+
+DEFAULT_CACHE = 'default'
+VERSION_KEY = 'catalog:version:{}'
+RESPONSE_KEY = 'catalog:response:{}:{}'
+
+
+class CacheMetrics:
+    """Per-view hit and miss counters"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counts = {}
+
+    def record(self, view, hit):
+        with self.lock:
+            counts = self.counts.setdefault(view, {'hits': 0, 'misses': 0})
+            counts['hits' if hit else 'misses'] += 1
+
+    def snapshot(self):
+        with self.lock:
+            views = {view: dict(counts) for view, counts in self.counts.items()}
+        for counts in views.values():
+            total = counts['hits'] + counts['misses']
+            counts['hit_ratio'] = counts['hits'] / total if total else None
+        return views
+
+
+metrics = CacheMetrics()
+
+
+def get_cache():
+    return caches[getattr(settings, 'CATALOG_CACHE', DEFAULT_CACHE)]
+
+
+def versions(scopes):
+    """Current version of each scope, starting unseen scopes at a fresh value.
+
+    A scope whose version was evicted restarts at the clock rather than at 1,
+    so it can never come back to a version that old entries were stored under.
+    """
+    cache = get_cache()
+    keys = [VERSION_KEY.format(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, time.time_ns(), None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def bump(scopes):
+    """Invalidate every cached response that depends on one of ``scopes``"""
+    cache = get_cache()
+    for scope in set(scopes):
+        key = VERSION_KEY.format(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+
+def bump_on_commit(scopes):
+    # Bumping before commit would let a concurrent request re-cache the old
+    # rows under the new version.
+    scopes = set(scopes)
+    transaction.on_commit(lambda: bump(scopes))
+
+
+def product_scopes(product_id, category, farmer_id):
+    return ['products', f'product:{product_id}', f'category:{category}', f'farmer-products:{farmer_id}']
+
+
+def farmer_scopes(farmer_id):
+    return ['farmers', f'farmer:{farmer_id}']
+
+
+def seconds_until_tomorrow():
+    """Seconds left in the current local day"""
+    now = timezone.localtime()
+    tomorrow = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time(), tzinfo=now.tzinfo)
+    return max(math.ceil((tomorrow - now).total_seconds()), 1)
+
+
+def normalized_query(params):
+    """The query string with keys and repeated values in a stable order"""
+    return urlencode(sorted((key, value) for key in params for value in params.getlist(key)))
+
+
+def _plain(data):
+    # Serializer output carries a reference back to its serializer; cache
+    # just the data.
+    if isinstance(data, ReturnList):
+        return [_plain(item) for item in data]
+    if isinstance(data, (ReturnDict, dict)):
+        return {key: _plain(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [_plain(item) for item in data]
+    return data
+
+
+class CachedResponseMixin:
+    """Serve GETs of a catalog view from the versioned cache.
+
+    Views list the scopes a response depends on in ``cache_scopes``.
+    Responses carry ``X-Cache: HIT`` or ``MISS``.
+    """
+    cache_timeout = None
+    # A miss read from a lagging replica would be cached under the scope
+    # versions its write already bumped; misses read the primary instead.
+    replica_reads = False
+
+    def cache_scopes(self, request, *args, **kwargs):
+        raise NotImplementedError
+
+    def get_cache_timeout(self, request, *args, **kwargs):
+        timeout = self.cache_timeout or getattr(settings, 'CATALOG_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+        return get_cache().default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def get(self, request, *args, **kwargs):
+        view = type(self).__name__
+        scopes = self.cache_scopes(request, *args, **kwargs)
+        # Serialized URLs are absolute, so the host is part of the key.
+        raw = '|'.join([
+            request.build_absolute_uri(request.path),
+            normalized_query(request.query_params),
+            ','.join(f'{scope}={version}' for scope, version in zip(scopes, versions(scopes))),
+        ])
+        key = RESPONSE_KEY.format(view, hashlib.sha256(raw.encode()).hexdigest())
+        cache = get_cache()
+
+        cached = cache.get(key)
+        if cached is not None:
+            metrics.record(view, hit=True)
+            return Response(cached, headers={'X-Cache': 'HIT'})
+
+        metrics.record(view, hit=False)
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, _plain(response.data), self.get_cache_timeout(request, *args, **kwargs))
+        response['X-Cache'] = 'MISS'
+        return response
@@ -0,0 +1,61 @@
+"""Streaming export helpers.
+
+Exports are produced as generators so the response body is written while
+rows are read from the database; nothing is ever materialized in full.
+"""
+import csv
+import zlib
+
+ORDER_EXPORT_HEADER = [
+    'Order ID', 'Date', 'Status', 'Customer', 'Order Total',
+    'Product ID', 'Product', 'Quantity', 'Unit Price', 'Line Total',
+]
+
+
+class Echo:
+    """File-like object whose write() hands the value back to csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def order_item_rows(items, chunk_size=2000):
+    """Yield one CSV row per order item, reading ``chunk_size`` rows at a time"""
+    items = items.select_related('order', 'order__customer', 'product').order_by('order_id', 'id')
+    for item in items.iterator(chunk_size=chunk_size):
+        order = item.order
+        yield [
+            order.id,
+            order.created_at.isoformat(),
+            order.status,
+            order.customer.username,
+            order.total,
+            item.product_id,
+            item.product.name,
+            item.quantity,
+            item.price,
+            item.price * item.quantity,
+        ]
+
+
+def csv_stream(header, rows, rows_per_chunk=500):
+    """Encode rows as CSV, yielding a bytes chunk every ``rows_per_chunk`` rows"""
+    writer = csv.writer(Echo())
+    buffer = [writer.writerow(header)]
+    for row in rows:
+        buffer.append(writer.writerow(row))
+        if len(buffer) >= rows_per_chunk:
+            yield ''.join(buffer).encode('utf-8')
+            buffer = []
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+def gzip_stream(chunks, level=6):
+    """Gzip-compress a stream of bytes chunks incrementally"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,202 @@
+"""Read-only fast path for the hot list endpoints.
+
+Once the queries are fixed, most of a large list response goes on DRF's
+per-row field machinery: building a model instance per row, then walking
+every field's ``get_attribute``/``to_representation`` per row. The
+serializers here produce the same JSON from ``.values()`` rows instead.
+
+Each ``ValuesSerializer`` wraps one of the regular serializers. Plain model
+fields reuse that serializer's own field objects, so formatting (decimals,
+datetimes, URLs) is identical; they are resolved once per list into a
+``(name, column, to_representation)`` mapper. Computed fields are supplied
+by the subclass, usually from lookups batched over the whole page in
+``prepare``. A field that is neither raises ImproperlyConfigured, so adding
+a field to a serializer without teaching its fast path fails loudly.
+"""
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.response import Response
+
+from .images import ImageUrls
+from .models import OrderItem
+from .reviews import STARS
+from .serializers import EventSerializer, OrderItemSerializer, OrderSerializer, ProductSerializer, humanize_duration
+
+
+def _identity(value):
+    return value
+
+
+class ValuesSerializer:
+    serializer_class = None
+    # Columns needed by computed fields on top of the plain ones.
+    extra_columns = ()
+    # Output names produced by ``compute``.
+    computed = ()
+
+    def __init__(self, context=None):
+        self.context = context or {}
+        self.request = self.context.get('request')
+        serializer = self.serializer_class(context=self.context)
+        model = serializer.Meta.model
+        self.mappers = []
+        columns = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if name in self.computed:
+                self.mappers.append((name, None, None))
+                continue
+            if isinstance(field, (serializers.SerializerMethodField, serializers.BaseSerializer)):
+                raise ImproperlyConfigured(f'{type(self).__name__} does not compute {name!r}')
+            column = field.source
+            if isinstance(field, PrimaryKeyRelatedField):
+                # values() returns foreign keys as bare ids.
+                mapper = _identity
+            elif isinstance(field, serializers.FileField):
+                mapper = self.file_mapper(model._meta.get_field(column).storage)
+            else:
+                mapper = field.to_representation
+            self.mappers.append((name, column, mapper))
+            columns.append(column)
+        self.columns = list(dict.fromkeys([*columns, *self.extra_columns]))
+
+    def file_mapper(self, storage):
+        build = self.request.build_absolute_uri if self.request is not None else _identity
+
+        def to_representation(name):
+            return build(storage.url(name)) if name else None
+        return to_representation
+
+    def rows(self, queryset):
+        """The queryset as ``.values()`` rows carrying every needed column"""
+        return queryset.prefetch_related(None).values(*self.columns)
+
+    def prepare(self, rows):
+        """Batch any lookups the computed fields need for these rows"""
+
+    def compute(self, row):
+        """``{name: value}`` for the computed fields of one row"""
+        return {}
+
+    def serialize(self, rows):
+        rows = list(rows)
+        self.prepare(rows)
+        data = []
+        for row in rows:
+            computed = self.compute(row)
+            item = {}
+            for name, column, mapper in self.mappers:
+                if mapper is None:
+                    item[name] = computed[name]
+                else:
+                    value = row[column]
+                    item[name] = None if value is None else mapper(value)
+            data.append(item)
+        return data
+
+
+class ProductValues(ValuesSerializer):
+    serializer_class = ProductSerializer
+    extra_columns = ('image_hash', 'image_source', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5')
+    computed = ('images', 'rating_histogram')
+
+    def prepare(self, rows):
+        self.image_urls = ImageUrls(self.request)
+
+    def compute(self, row):
+        return {
+            'images': self.image_urls(row['id'], row['image'], row['image_hash'], row['image_source']),
+            'rating_histogram': {str(star): row[f'rating_{star}'] for star in STARS},
+        }
+
+
+class OrderItemValues(ValuesSerializer):
+    serializer_class = OrderItemSerializer
+    extra_columns = ('order_id',)
+
+
+class OrderValues(ValuesSerializer):
+    serializer_class = OrderSerializer
+    computed = ('items',)
+
+    def prepare(self, rows):
+        """Load every order's items (and products, if expanded) in one query"""
+        items = OrderItemValues(self.context)
+        item_rows = OrderItem.objects.filter(order_id__in=[row['id'] for row in rows]).order_by('id')
+        expand = self.context.get('expand_product')
+        product_columns = ('product__name', 'product__category', 'product__price', 'product__farmer_id')
+        item_rows = list(item_rows.values(*items.columns, *(product_columns if expand else ())))
+        self.items = {row['id']: [] for row in rows}
+        for item_row, item in zip(item_rows, items.serialize(item_rows)):
+            if expand:
+                item['product_summary'] = {
+                    'id': item_row['product_id'],
+                    'name': item_row['product__name'],
+                    'category': item_row['product__category'],
+                    'price': str(item_row['product__price']),
+                    'farmer': item_row['product__farmer_id'],
+                }
+            self.items[item_row['order_id']].append(item)
+
+    def compute(self, row):
+        return {'items': self.items[row['id']]}
+
+
+class EventValues(ValuesSerializer):
+    serializer_class = EventSerializer
+    extra_columns = ('user__username', 'user__first_name', 'user__last_name', 'user__email')
+    computed = ('user_details', 'related_object_details', 'duration', 'is_past')
+
+    def prepare(self, rows):
+        """Resolve related objects with one ``IN`` query per target model"""
+        ids_by_type = {}
+        for row in rows:
+            if row['related_content_type'] is not None and row['related_object_id'] is not None:
+                ids_by_type.setdefault(row['related_content_type'], set()).add(row['related_object_id'])
+        self.related = {}
+        for content_type_id, object_ids in ids_by_type.items():
+            content_type = ContentType.objects.get_for_id(content_type_id)
+            for pk, obj in content_type.model_class()._base_manager.in_bulk(object_ids).items():
+                self.related[content_type_id, pk] = (content_type, obj)
+        self.now = timezone.now()
+
+    def compute(self, row):
+        full_name = f"{row['user__first_name']} {row['user__last_name']}".strip()
+        related = self.related.get((row['related_content_type'], row['related_object_id']))
+        return {
+            'user_details': {
+                'id': row['user'],
+                'name': full_name or row['user__username'],
+                'email': row['user__email'],
+            },
+            'related_object_details': related and {
+                'id': related[1].id,
+                'type': related[0].model,
+                'display_name': str(related[1]),
+            },
+            'duration': humanize_duration(row['end'] - row['start']),
+            'is_past': row['end'] < self.now,
+        }
+
+
+class FastListMixin:
+    """Serve ``GET`` lists through ``values_serializer_class``.
+
+    The response matches the regular serializer's; set the attribute to
+    None to fall back to it.
+    """
+    values_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        if self.values_serializer_class is None:
+            return super().list(request, *args, **kwargs)
+        fast = self.values_serializer_class(self.get_serializer_context())
+        rows = fast.rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(fast.serialize(page))
+        return Response(fast.serialize(rows))
@@ -0,0 +1,216 @@
+import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework import serializers
+
+from . import geo
+from .models import Event, Product
+
+TRUE_VALUES = {'1', 'true', 'yes', 'on'}
+FALSE_VALUES = {'0', 'false', 'no', 'off'}
+
+
+def _flag(params, name):
+    return params.get(name, '').lower() in TRUE_VALUES
+
+
+def _decimal(params, name):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise serializers.ValidationError({name: 'A valid number is required.'})
+
+
+def _integer(params, name):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise serializers.ValidationError({name: 'A valid integer is required.'})
+
+
+def filter_products(queryset, params):
+    """Apply the catalog query-string filters to a Product queryset.
+
+    Supported parameters:
+      category   -- one or more category codes, comma separated (``VG,FR``)
+      min_price  -- inclusive lower price bound
+      max_price  -- inclusive upper price bound
+      farmer     -- FarmerProfile id
+      in_stock   -- only products with quantity > 0
+      fresh      -- hide stock whose expiry_date is in the past (the
+                    default; ``fresh=0`` lists it too)
+      min_rating -- only reviewed products averaging at least this (1-5)
+      sort       -- ``newest`` (the default) or ``rating``: reviewed
+                    products only, best average first
+    """
+    categories = product_categories(params)
+    if categories:
+        if len(categories) == 1:
+            queryset = queryset.filter(category=categories[0])
+        else:
+            queryset = queryset.filter(category__in=categories)
+
+    min_price = _decimal(params, 'min_price')
+    if min_price is not None:
+        queryset = queryset.filter(price__gte=min_price)
+
+    max_price = _decimal(params, 'max_price')
+    if max_price is not None:
+        queryset = queryset.filter(price__lte=max_price)
+
+    farmer = product_farmer(params)
+    if farmer is not None:
+        queryset = queryset.filter(farmer_id=farmer)
+
+    if _flag(params, 'in_stock'):
+        queryset = queryset.filter(quantity__gt=0)
+
+    if fresh_only(params):
+        queryset = queryset.filter(expiry_date__gte=timezone.localdate())
+
+    # Both only cover reviewed products, which is what product_top_rated_idx
+    # indexes.
+    min_rating = _float(params, 'min_rating', 1, 5)
+    if min_rating is not None:
+        queryset = queryset.filter(rating_count__gt=0, rating_average__gte=min_rating)
+
+    if params.get('sort'):
+        ordering = product_ordering(params)
+        if params['sort'] == 'rating':
+            queryset = queryset.filter(rating_count__gt=0)
+        queryset = queryset.order_by(*ordering)
+
+    return queryset
+
+
+def product_categories(params):
+    """The validated category codes in ``category``"""
+    categories = [c for c in params.get('category', '').split(',') if c]
+    valid = {code for code, _ in Product.CATEGORY_CHOICES}
+    unknown = set(categories) - valid
+    if unknown:
+        raise serializers.ValidationError({'category': f"Unknown category: {', '.join(sorted(unknown))}"})
+    return categories
+
+
+def product_farmer(params):
+    return _integer(params, 'farmer')
+
+
+def fresh_only(params):
+    """Whether expired stock is hidden, which it is unless ``fresh`` is false"""
+    return params.get('fresh', '').lower() not in FALSE_VALUES
+
+
+PRODUCT_ORDERINGS = {
+    'newest': ('-created_at', '-id'),
+    # Equal averages go to the most reviewed product.
+    'rating': ('-rating_average', '-rating_count', '-id'),
+}
+
+
+def product_ordering(params):
+    sort = params.get('sort') or 'newest'
+    if sort not in PRODUCT_ORDERINGS:
+        raise serializers.ValidationError({'sort': f"Unknown sort: {sort}. Use {' or '.join(PRODUCT_ORDERINGS)}."})
+    return PRODUCT_ORDERINGS[sort]
+
+
+DEFAULT_RADIUS_KM = 25
+MAX_RADIUS_KM = 500
+
+
+def _float(params, name, low, high):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        raise serializers.ValidationError({name: 'A valid number is required.'})
+    if not low <= number <= high:
+        raise serializers.ValidationError({name: f'Must be between {low} and {high}.'})
+    return number
+
+
+def search_point(params):
+    """``(latitude, longitude, radius_km)`` of a nearby search.
+
+    The point is ``lat`` and ``lon``, or a place name from the gazetteer in
+    ``near``; ``radius`` is in km.
+    """
+    latitude, longitude = _float(params, 'lat', -90, 90), _float(params, 'lon', -180, 180)
+    if latitude is None or longitude is None:
+        if not params.get('near'):
+            raise serializers.ValidationError({'lat': 'lat and lon (or near) are required.'})
+        point = geo.geocode(params['near'])
+        if point is None:
+            raise serializers.ValidationError({'near': f"Unknown place: {params['near']}"})
+        latitude, longitude = point
+    radius = _float(params, 'radius', 0, MAX_RADIUS_KM)
+    return latitude, longitude, DEFAULT_RADIUS_KM if radius is None else radius
+
+
+def filter_related(queryset, params):
+    """Narrow a notification/event queryset to rows about one object.
+
+    ``related_type`` is a marketplace model name (``order``, ``product``...)
+    and ``related_id`` its primary key.
+    """
+    related_type = params.get('related_type')
+    if not related_type:
+        return queryset
+    try:
+        content_type = ContentType.objects.get_by_natural_key('marketplace', related_type.lower())
+    except ContentType.DoesNotExist:
+        raise serializers.ValidationError({'related_type': f'Unknown type: {related_type}'})
+    related_id = _integer(params, 'related_id')
+    if related_id is None:
+        raise serializers.ValidationError({'related_id': 'Required with related_type.'})
+    return queryset.related_to(content_type, [related_id])
+
+
+def _moment(params, name):
+    """Parse an ISO datetime or date (taken as local midnight) parameter"""
+    value = params.get(name, '')
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            moment = day and datetime.datetime.combine(day, datetime.time.min)
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise serializers.ValidationError({name: 'An ISO 8601 date or datetime is required.'})
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def calendar_range(params):
+    """``(start, end)`` from the query string, or None outside range mode"""
+    if 'start' not in params and 'end' not in params:
+        return None
+    start, end = _moment(params, 'start'), _moment(params, 'end')
+    if end <= start:
+        raise serializers.ValidationError({'end': 'End must be after start.'})
+    return start, end
+
+
+def filter_event_types(queryset, params):
+    event_types = [t for t in params.get('event_type', '').split(',') if t]
+    if event_types:
+        unknown = set(event_types) - {code for code, _ in Event.EVENT_TYPES}
+        if unknown:
+            raise serializers.ValidationError({'event_type': f"Unknown event type: {', '.join(sorted(unknown))}"})
+        queryset = queryset.filter(event_type__in=event_types)
+    return queryset
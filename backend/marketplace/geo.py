@@ -0,0 +1,153 @@
+"""Farm locations: offline geocoding and geohash-indexed radius search.
+
+Farmers type a free-text ``location``; ``geocode`` resolves it against the
+bundled gazetteer (or ``settings.GAZETTEER_PATH``), never a live service.
+Coordinates are stored with their geohash, a base32 string whose prefixes
+are nested grid cells. A radius search turns into a few indexed range scans
+over the cells covering the search box, an exact latitude/longitude box
+filter, and haversine ranking of whatever is left.
+"""
+import csv
+import functools
+import math
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import Q
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# Nine characters is a cell of about 5 x 5 m, finer than any search needs.
+GEOHASH_LENGTH = 9
+# Sorts after every geohash character, so ``prefix + END`` bounds a prefix.
+END = '{'
+EARTH_RADIUS_KM = 6371.0088
+MAX_CELLS = 16
+DEFAULT_GAZETTEER = Path(__file__).resolve().parent / 'data' / 'gazetteer.csv'
+
+
+def encode(latitude, longitude, length=GEOHASH_LENGTH):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < length:
+        interval, value = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits, bit_count = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(length):
+    """(height, width) in degrees of a geohash cell of ``length`` characters"""
+    bits = 5 * length
+    return 180 / 2 ** (bits // 2), 360 / 2 ** ((bits + 1) // 2)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """(min_lat, max_lat, min_lon, max_lon) enclosing the circle, clamped to the globe"""
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    cos_lat = math.cos(math.radians(latitude))
+    dlon = 180.0 if cos_lat < 1e-6 else min(180.0, dlat / cos_lat)
+    return (
+        max(-90.0, latitude - dlat), min(90.0, latitude + dlat),
+        max(-180.0, longitude - dlon), min(180.0, longitude + dlon),
+    )
+
+
+def covering_cells(box, max_cells=MAX_CELLS):
+    """The finest geohash cells, at most ``max_cells`` of them, covering ``box``"""
+    min_lat, max_lat, min_lon, max_lon = box
+    for length in range(GEOHASH_LENGTH, 0, -1):
+        height, width = cell_size(length)
+        first_row, last_row = math.floor((min_lat + 90) / height), math.floor((max_lat + 90) / height)
+        first_col, last_col = math.floor((min_lon + 180) / width), math.floor((max_lon + 180) / width)
+        if (last_row - first_row + 1) * (last_col - first_col + 1) <= max_cells or length == 1:
+            break
+    return sorted({
+        encode(min(89.999999, (row + 0.5) * height - 90), min(179.999999, (col + 0.5) * width - 180), length)
+        for row in range(first_row, last_row + 1)
+        for col in range(first_col, last_col + 1)
+    })
+
+
+def within_box(queryset, latitude, longitude, radius_km):
+    """Rows inside the circle's bounding box, found through the geohash index"""
+    box = bounding_box(latitude, longitude, radius_km)
+    cells = Q()
+    for cell in covering_cells(box):
+        cells |= Q(geohash__gte=cell, geohash__lt=cell + END)
+    return queryset.filter(
+        cells, latitude__range=box[:2], longitude__range=box[2:],
+    )
+
+
+def nearest(queryset, latitude, longitude, radius_km):
+    """``[(pk, distance_km), ...]`` of rows within the radius, nearest first"""
+    rows = within_box(queryset, latitude, longitude, radius_km).values_list('pk', 'latitude', 'longitude')
+    ranked = []
+    for pk, lat, lon in rows:
+        distance = haversine_km(latitude, longitude, lat, lon)
+        if distance <= radius_km:
+            ranked.append((distance, pk))
+    ranked.sort()
+    return [(pk, distance) for distance, pk in ranked]
+
+
+def normalize(name):
+    return ' '.join(re.findall(r'[\w-]+', name.lower()))
+
+
+@functools.lru_cache(maxsize=4)
+def load_gazetteer(path):
+    """``{normalized place name: (latitude, longitude)}`` from a CSV gazetteer.
+
+    Rows need ``name``, ``latitude`` and ``longitude``; a ``region`` column
+    also makes "Town, Region" resolve.
+    """
+    places = {}
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            point = (float(row['latitude']), float(row['longitude']))
+            name = normalize(row['name'])
+            places.setdefault(name, point)
+            if row.get('region'):
+                places.setdefault(f"{name} {normalize(row['region'])}", point)
+    return places
+
+
+def geocode(location):
+    """Coordinates of a free-text place name, or None if it is not known.
+
+    The whole text is tried first, then each comma-separated part, so
+    "Ejisu, near Kumasi" resolves to Ejisu.
+    """
+    if not location:
+        return None
+    places = load_gazetteer(str(getattr(settings, 'GAZETTEER_PATH', DEFAULT_GAZETTEER)))
+    for candidate in [location, *location.split(',')]:
+        point = places.get(normalize(candidate))
+        if point is not None:
+            return point
+    return None
+
+
+def locate(farmer, moved=False):
+    """Fill in a farmer's coordinates (geocoding them unless given) and geohash"""
+    if moved or farmer.latitude is None or farmer.longitude is None:
+        farmer.latitude, farmer.longitude = geocode(farmer.location) or (None, None)
+    farmer.geohash = encode(farmer.latitude, farmer.longitude) if farmer.latitude is not None else ''
@@ -0,0 +1,140 @@
+"""iCalendar feed rendering.
+
+Calendar clients poll the feed every few minutes, so each event's VEVENT
+block is cached under a key that includes ``Event.updated_at``: an edit
+changes the key, and an unchanged event is never re-serialized. The feed
+body is streamed block by block around a hand-written VCALENDAR envelope.
+"""
+import datetime
+
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare, salted_hmac
+from icalendar import Event as ICalEvent, vRecur
+
+FEED_SALT = 'marketplace.calendar-feed'
+FEED_TOKEN_MAX_AGE = datetime.timedelta(days=365)
+VEVENT_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+DEFAULT_PAST_DAYS = 30
+DEFAULT_FUTURE_DAYS = 365
+
+CALENDAR_HEADER = (
+    b'BEGIN:VCALENDAR\r\n'
+    b'VERSION:2.0\r\n'
+    b'PRODID:-//FarmDirect//Farm Calendar//EN\r\n'
+    b'CALSCALE:GREGORIAN\r\n'
+    b'X-WR-CALNAME:FarmDirect\r\n'
+)
+CALENDAR_FOOTER = b'END:VCALENDAR\r\n'
+
+
+def _password_stamp(password):
+    return salted_hmac(FEED_SALT, password).hexdigest()[:16]
+
+
+def feed_token(user):
+    """Opaque token identifying ``user``'s subscription URL.
+
+    Signed along with a digest of the password hash, so changing the
+    password revokes every URL handed out before; tokens also expire after
+    ``FEED_TOKEN_MAX_AGE``.
+    """
+    return signing.dumps([user.pk, _password_stamp(user.password)], salt=FEED_SALT)
+
+
+def user_id_for_token(token):
+    """The user id a feed token was issued for, or None if it is invalid,
+    expired or revoked"""
+    try:
+        user_id, stamp = signing.loads(token, salt=FEED_SALT, max_age=FEED_TOKEN_MAX_AGE)
+    except (signing.BadSignature, TypeError, ValueError):
+        return None
+    password = User.objects.filter(pk=user_id, is_active=True).values_list('password', flat=True).first()
+    if password is None or not constant_time_compare(stamp, _password_stamp(password)):
+        return None
+    return user_id
+
+
+def feed_window(past_days=DEFAULT_PAST_DAYS, future_days=DEFAULT_FUTURE_DAYS):
+    now = timezone.now()
+    return now - datetime.timedelta(days=past_days), now + datetime.timedelta(days=future_days)
+
+
+def events_in_window(events, start, end):
+    """Events overlapping [start, end), counting series that recur into it"""
+    return events.in_window(start, end)
+
+
+def feed_fingerprint(events):
+    """Cheap summary of a feed's contents for its ETag.
+
+    The count and id sum catch deletions and events entering or leaving the
+    window, max(updated_at) catches edits. No Last-Modified is derived from
+    it: that timestamp does not move when an event is deleted or an older
+    one slides into the window.
+    """
+    summary = events.order_by().aggregate(count=Count('id'), ids=Sum('id'), last_modified=Max('updated_at'))
+    return f"{summary['count']}-{summary['ids'] or 0}-{summary['last_modified'].timestamp() if summary['last_modified'] else 0}"
+
+
+def vevent_cache_key(event):
+    return f'ical:vevent:{event.pk}:{event.updated_at.timestamp()}'
+
+
+def render_vevent(event):
+    component = ICalEvent()
+    component.add('uid', f'event-{event.pk}@farmdirect')
+    component.add('dtstamp', event.updated_at)
+    component.add('summary', event.title)
+    if event.all_day:
+        component.add('dtstart', timezone.localdate(event.start))
+        component.add('dtend', timezone.localdate(event.end))
+    else:
+        component.add('dtstart', event.start)
+        component.add('dtend', event.end)
+    if event.recurrence:
+        # Series are emitted once with a native RRULE; clients expand them.
+        component.add('rrule', vRecur.from_ical(event.recurrence.removeprefix('RRULE:')))
+        excluded = sorted(event.excluded_starts())
+        if excluded:
+            component.add('exdate', excluded)
+    if event.location:
+        component.add('location', event.location)
+    if event.description:
+        component.add('description', event.description)
+    component.add('categories', [event.get_event_type_display()])
+    return component.to_ical()
+
+
+def vevent_blocks(events, chunk_size=500):
+    """Yield serialized VEVENTs, reading the cache one chunk at a time"""
+    chunk = []
+    for event in events.iterator(chunk_size=chunk_size):
+        chunk.append(event)
+        if len(chunk) >= chunk_size:
+            yield from _render_chunk(chunk)
+            chunk = []
+    if chunk:
+        yield from _render_chunk(chunk)
+
+
+def _render_chunk(events):
+    keys = {event.pk: vevent_cache_key(event) for event in events}
+    cached = cache.get_many(keys.values())
+    missing = {}
+    for event in events:
+        block = cached.get(keys[event.pk])
+        if block is None:
+            block = missing[keys[event.pk]] = render_vevent(event)
+        yield block
+    if missing:
+        cache.set_many(missing, VEVENT_CACHE_TIMEOUT)
+
+
+def calendar_stream(events):
+    yield CALENDAR_HEADER
+    yield from vevent_blocks(events)
+    yield CALENDAR_FOOTER
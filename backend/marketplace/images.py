@@ -0,0 +1,138 @@
+"""Resized derivatives of product photos.
+
+Every upload is rendered at a few fixed sizes, each as JPEG and WebP, under
+``derivatives/<content hash>/`` in the default storage. The hash is of the
+original's bytes, so a derivative's URL never changes meaning and can be
+served with far-future cache headers; a new photo gets new URLs.
+
+Derivatives are built when a product's image changes (once the transaction
+commits) or, for products saved before this existed, on the first request
+for one of them (``product_image``); ``generate_product_images`` backfills.
+"""
+import hashlib
+import io
+import logging
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from PIL import Image, ImageOps
+
+from .caching import bump_on_commit, product_scopes
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_ROOT = 'derivatives'
+# Longest edge in pixels; images are scaled to fit, never upscaled.
+VARIANTS = {
+    'thumbnail': 150,
+    'card': 480,
+    'detail': 1200,
+}
+FORMATS = {
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+}
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def derivative_name(image_hash, variant, ext):
+    return f'{DERIVATIVE_ROOT}/{image_hash}/{variant}.{ext}'
+
+
+class ImageUrls:
+    """Builds ``{variant: {ext: url}}`` maps of product images.
+
+    Create one per response: route prefixes and the host are resolved once
+    instead of reversing six URLs per product. Until a product's derivatives
+    exist its URLs point at ``product_image``, which builds them on first
+    request and redirects to the hashed file. With a ``request`` the URLs
+    are absolute.
+    """
+
+    def __init__(self, request=None):
+        self.host = request.build_absolute_uri('/').rstrip('/') if request is not None else ''
+        self.lazy = {
+            (variant, ext): reverse('product-image', args=[0, variant, ext]).split('/0/', 1)
+            for variant in VARIANTS
+            for ext in FORMATS
+        }
+
+    def absolute(self, url):
+        return self.host + url if url.startswith('/') else url
+
+    def for_product(self, product):
+        return self(product.pk, product.image.name, product.image_hash, product.image_source)
+
+    def __call__(self, product_id, name, image_hash, image_source):
+        """URLs from bare column values (see fast.py); None without an image"""
+        if not name:
+            return None
+        if image_hash and image_source == name:
+            def url(variant, ext):
+                return default_storage.url(derivative_name(image_hash, variant, ext))
+        else:
+            def url(variant, ext):
+                before, after = self.lazy[variant, ext]
+                return f'{before}/{product_id}/{after}'
+        return {variant: {ext: self.absolute(url(variant, ext)) for ext in FORMATS} for variant in VARIANTS}
+
+
+def render(source, size, fmt, options):
+    image = source.copy()
+    image.thumbnail((size, size), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, **options)
+    return buffer.getvalue()
+
+
+def generate(field_file):
+    """Write any missing derivatives of an image file; returns its hash"""
+    with field_file.open('rb') as f:
+        data = f.read()
+    image_hash = content_hash(data)
+    missing = [
+        (variant, ext)
+        for variant in VARIANTS
+        for ext in FORMATS
+        if not default_storage.exists(derivative_name(image_hash, variant, ext))
+    ]
+    if missing:
+        with Image.open(io.BytesIO(data)) as original:
+            # Phone photos are stored sideways with an EXIF rotation flag.
+            source = ImageOps.exif_transpose(original).convert('RGB')
+        for variant, ext in missing:
+            fmt, options = FORMATS[ext]
+            default_storage.save(
+                derivative_name(image_hash, variant, ext),
+                ContentFile(render(source, VARIANTS[variant], fmt, options)),
+            )
+    return image_hash
+
+
+def needs_derivatives(product):
+    return bool(product.image) and product.image_source != product.image.name
+
+
+def refresh_product_images(product):
+    """Build a product's derivatives if its image changed; returns the hash.
+
+    Missing or unreadable uploads are logged and left without derivatives
+    (the original is served instead).
+    """
+    if not needs_derivatives(product):
+        return product.image_hash or None
+    try:
+        image_hash = generate(product.image)
+    except OSError as exc:
+        logger.warning('could not build derivatives for product %s (%s): %s', product.pk, product.image.name, exc)
+        return None
+    product.image_hash, product.image_source = image_hash, product.image.name
+    Product.objects.filter(pk=product.pk).update(image_hash=image_hash, image_source=product.image.name)
+    bump_on_commit(product_scopes(product.pk, product.category, product.farmer_id))
+    return image_hash
@@ -0,0 +1,177 @@
+"""Stock reservation for order placement.
+
+Placing an order takes its stock with one conditional UPDATE per product
+(``quantity = quantity - n WHERE quantity >= n``). The database applies each
+decrement atomically, so concurrent checkouts of a hot product can never
+oversell, and no row lock is held while Python code runs: a buyer who loses
+the race simply finds the UPDATE matched no row and the whole placement rolls
+back. Products are decremented in id order so two carts never take the same
+row locks in opposite orders.
+
+A placed order is PENDING with ``reserved_until`` set. Completing it keeps
+the stock; cancelling it, or letting the hold lapse (``release_expired``, run
+periodically by the ``release_expired_reservations`` command), puts the
+stock back.
+"""
+import datetime
+from collections import Counter
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .analytics import order_day, schedule_refresh
+from .caching import bump_on_commit, product_scopes
+from .models import Order, OrderItem, Product
+
+DEFAULT_RESERVATION_MINUTES = 15
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_id, requested):
+        self.product_id = product_id
+        self.requested = requested
+        super().__init__(f'Not enough stock for product {product_id} (requested {requested})')
+
+
+def reservation_timeout():
+    minutes = getattr(settings, 'INVENTORY_RESERVATION_MINUTES', DEFAULT_RESERVATION_MINUTES)
+    return datetime.timedelta(minutes=minutes)
+
+
+def take_stock(product_id, quantity):
+    """Decrement stock if at least ``quantity`` is left; returns whether it was"""
+    taken = Product.objects.filter(pk=product_id, quantity__gte=quantity).update(quantity=F('quantity') - quantity)
+    return taken == 1
+
+
+def return_stock(quantities):
+    """Put back ``{product_id: quantity}``, in id order like ``take_stock``"""
+    for product_id, quantity in sorted(quantities.items()):
+        Product.objects.filter(pk=product_id).update(quantity=F('quantity') + quantity)
+    bump_on_commit(
+        scope
+        for product_id, category, farmer_id in Product.objects.filter(pk__in=quantities).values_list(
+            'pk', 'category', 'farmer_id'
+        )
+        for scope in product_scopes(product_id, category, farmer_id)
+    )
+
+
+def place_order(customer, lines):
+    """Create a pending order for ``(product_id, quantity)`` lines, holding its stock"""
+    return place_orders(customer, [lines])[0]
+
+
+def place_orders(customer, carts):
+    """Create one pending order per cart of ``(product_id, quantity)`` lines.
+
+    All carts succeed or none do: InsufficientStock (or Product.DoesNotExist)
+    leaves nothing written. Prices are snapshotted from one ``IN`` query,
+    orders and items are written with ``bulk_create`` and totals computed
+    here, so the cost does not grow with the number of lines.
+    """
+    carts = [list(lines) for lines in carts]
+    quantities = Counter()
+    for lines in carts:
+        for product_id, quantity in lines:
+            if quantity < 1:
+                raise ValueError('Quantities must be positive')
+            quantities[product_id] += quantity
+
+    with transaction.atomic():
+        products = Product.objects.only('price', 'category', 'farmer_id').in_bulk(quantities)
+        for product_id, quantity in sorted(quantities.items()):
+            if product_id not in products:
+                raise Product.DoesNotExist(f'Product {product_id} does not exist')
+            if not take_stock(product_id, quantity):
+                raise InsufficientStock(product_id, quantity)
+        # Stock levels are part of the cached catalog responses.
+        bump_on_commit(
+            scope for product in products.values()
+            for scope in product_scopes(product.pk, product.category, product.farmer_id)
+        )
+
+        reserved_until = timezone.now() + reservation_timeout()
+        orders = Order.objects.bulk_create([
+            Order(
+                customer=customer,
+                status=Order.PENDING,
+                reserved_until=reserved_until,
+                total=sum((products[product_id].price * quantity for product_id, quantity in lines), Decimal(0)),
+            )
+            for lines in carts
+        ])
+        # bulk_create skips the OrderItem signals, so the rollups are
+        # scheduled here and the totals were computed above.
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product_id=product_id, quantity=quantity, price=products[product_id].price)
+            for order, lines in zip(orders, carts)
+            for product_id, quantity in lines
+        ])
+        for order, lines in zip(orders, carts):
+            schedule_refresh(order_day(order), {products[product_id].farmer_id for product_id, _ in lines})
+    return orders
+
+
+def _refresh_rollups(order_id):
+    # Status changes below are conditional UPDATEs, which skip the post_save
+    # rollup signal.
+    order = Order.objects.only('created_at').get(pk=order_id)
+    farmer_ids = set(OrderItem.objects.filter(order_id=order_id).values_list('product__farmer_id', flat=True))
+    if farmer_ids:
+        schedule_refresh(order_day(order), farmer_ids)
+
+
+def complete_order(order):
+    """Mark a pending order completed, keeping its stock.
+
+    Returns False if the order is no longer pending or its hold has lapsed.
+    """
+    with transaction.atomic():
+        completed = Order.objects.filter(
+            Q(reserved_until__isnull=True) | Q(reserved_until__gt=timezone.now()),
+            pk=order.pk,
+            status=Order.PENDING,
+        ).update(status=Order.COMPLETED, reserved_until=None)
+        if completed:
+            order.status, order.reserved_until = Order.COMPLETED, None
+            _refresh_rollups(order.pk)
+    return bool(completed)
+
+
+def _release(order_id, **conditions):
+    """Cancel a pending order that still holds stock and return the stock"""
+    with transaction.atomic():
+        released = Order.objects.filter(
+            pk=order_id, status=Order.PENDING, reserved_until__isnull=False, **conditions
+        ).update(status=Order.CANCELLED, reserved_until=None)
+        if not released:
+            return False
+        quantities = Counter()
+        for product_id, quantity in OrderItem.objects.filter(order_id=order_id).values_list('product_id', 'quantity'):
+            quantities[product_id] += quantity
+        return_stock(quantities)
+        _refresh_rollups(order_id)
+    return True
+
+
+def cancel_order(order):
+    """Cancel a pending order, returning any stock it holds"""
+    if _release(order.pk):
+        order.status, order.reserved_until = Order.CANCELLED, None
+        return True
+    cancelled = Order.objects.filter(pk=order.pk, status=Order.PENDING).update(status=Order.CANCELLED)
+    if cancelled:
+        order.status = Order.CANCELLED
+        _refresh_rollups(order.pk)
+    return bool(cancelled)
+
+
+def release_expired(now=None):
+    """Cancel every pending order whose hold has lapsed; returns how many"""
+    now = now or timezone.now()
+    expired = Order.objects.filter(status=Order.PENDING, reserved_until__lte=now).values_list('pk', flat=True)
+    return sum(_release(order_id, reserved_until__lte=now) for order_id in list(expired))
@@ -0,0 +1,89 @@
+import json
+import platform
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from marketplace.benchmarks import BASE_SHAPE, ENDPOINTS, compare, run, scaled_shape
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the hot API endpoints on synthetic data at several scales '
+            '(the data is generated inside a transaction and rolled back)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='1,10', help='Comma-separated multipliers of the base data shape')
+        parser.add_argument('--requests', type=int, default=20, help='Timed requests per endpoint and scale')
+        parser.add_argument('--endpoint', action='append', choices=[name for name, *_ in ENDPOINTS],
+                            help='Only benchmark this endpoint (repeatable)')
+        parser.add_argument('--warm-cache', action='store_true',
+                            help='Let the catalog cache serve repeated requests instead of measuring cold responses')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--compare', metavar='BASELINE', help='Fail if results regress against this JSON file')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Allowed p95 latency and peak memory growth against the baseline (fraction)')
+        for key, value in BASE_SHAPE.items():
+            parser.add_argument(f"--{key.replace('_', '-')}", type=int, default=value, dest=key,
+                                help=f'At scale 1 (default {value})')
+
+    def handle(self, *args, **options):
+        try:
+            scales = [float(scale) for scale in options['scales'].split(',')]
+        except ValueError:
+            raise CommandError('--scales must be comma-separated numbers')
+        base = {key: options[key] for key in BASE_SHAPE}
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+            },
+            'settings': {'requests': options['requests'], 'warm_cache': options['warm_cache'],
+                         'seed': options['seed'], 'base_shape': base},
+            'results': [],
+        }
+        self.stdout.write(f'{"scale":>6} {"endpoint":<20} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} '
+                          f'{"queries":>7} {"KiB out":>8} {"peak KiB":>9}')
+        for scale in scales:
+            shape = scaled_shape(scale, base)
+            try:
+                with transaction.atomic():
+                    rows = run(shape, requests=options['requests'], warm_cache=options['warm_cache'],
+                               endpoints=options['endpoint'], seed=options['seed'])
+                    raise Rollback
+            except Rollback:
+                pass
+            for row in rows:
+                row = {'scale': scale, 'shape': shape, **row}
+                report['results'].append(row)
+                self.stdout.write(
+                    f"{scale:>6g} {row['endpoint']:<20} {row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} "
+                    f"{row['p99_ms']:>8.1f} {row['queries']:>7} {row['bytes'] / 1024:>8.1f} {row['peak_kib']:>9.1f}"
+                )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as exc:
+                raise CommandError(f"Could not read baseline {options['compare']}: {exc}")
+            regressions = compare(baseline, report, options['threshold'])
+            if regressions:
+                for regression in regressions:
+                    self.stderr.write(regression)
+                raise CommandError(f'{len(regressions)} regression(s) against {options["compare"]}')
+            self.stdout.write(self.style.SUCCESS(f"No regressions against {options['compare']}"))
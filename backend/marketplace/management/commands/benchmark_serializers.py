@@ -0,0 +1,81 @@
+import datetime
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from marketplace.fast import EventValues, OrderValues, ProductValues
+from marketplace.models import Event, FarmerProfile, Order, OrderItem, Product
+from marketplace.serializers import EventSerializer, OrderSerializer, ProductSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare DRF serializers with the .values() fast path, per 1,000 rows (writes are rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=5, help='Best of this many runs')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options['rows'], options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, rows):
+        user = User.objects.create_user(username=f'bench-{time.time_ns()}')
+        farmer = FarmerProfile.objects.create(user=user, farm_name='Bench farm', location='Accra', contact_number='0')
+        today = datetime.date.today()
+        products = Product.objects.bulk_create([
+            Product(farmer=farmer, name=f'Product {i}', description='Benchmark product', price=Decimal('2.50'),
+                    category='VG', quantity=100, image=f'products/{i}.jpg', harvest_date=today, expiry_date=today)
+            for i in range(rows)
+        ])
+        orders = Order.objects.bulk_create([Order(customer=user, status=Order.PENDING) for _ in range(rows)])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=2, price=product.price)
+            for order, product in zip(orders, products)
+        ])
+        now = timezone.now()
+        Event.objects.bulk_create([
+            Event(user=user, title=f'Event {i}', event_type='market', start=now, end=now + datetime.timedelta(hours=2),
+                  span=datetime.timedelta(hours=2), related_object=products[i])
+            for i in range(rows)
+        ])
+        return user, farmer
+
+    def best(self, repeat, fn):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - started)
+        return min(timings)
+
+    def run(self, rows, repeat):
+        user, farmer = self.seed(rows)
+        request = Request(APIRequestFactory().get('/api/', HTTP_HOST='localhost'))
+        context = {'request': request, 'expand_product': False}
+        cases = [
+            ('products', Product.objects.filter(farmer=farmer), ProductSerializer, ProductValues),
+            ('orders', Order.objects.filter(customer=user).with_items(), OrderSerializer, OrderValues),
+            ('events', Event.objects.filter(user=user).select_related('user').with_related_objects(),
+             EventSerializer, EventValues),
+        ]
+        scale = 1000 / rows
+        self.stdout.write(f'{"endpoint":<10} {"drf ms/1k":>10} {"fast ms/1k":>11} {"speedup":>8}')
+        for name, queryset, serializer_class, values_class in cases:
+            drf = self.best(repeat, lambda: serializer_class(queryset.all(), many=True, context=context).data)
+            fast = self.best(repeat, lambda: values_class(context).serialize(values_class(context).rows(queryset.all())))
+            self.stdout.write(f'{name:<10} {drf * scale * 1000:>10.1f} {fast * scale * 1000:>11.1f} {drf / fast:>7.1f}x')
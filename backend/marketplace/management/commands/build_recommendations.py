@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from marketplace.recommendations import DEFAULT_MIN_TOGETHER, DEFAULT_TOP_K, build, update
+
+
+class Command(BaseCommand):
+    help = 'Precompute "frequently bought together" recommendations from the order history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only fold in the order lines written since the last run')
+        parser.add_argument('--top-k', type=int, default=DEFAULT_TOP_K,
+                            help='Recommendations kept per product')
+        parser.add_argument('--min-together', type=int, default=DEFAULT_MIN_TOGETHER,
+                            help='Orders a pair must share to be recommended')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if options['top_k'] < 1 or options['min_together'] < 1:
+            raise CommandError('--top-k and --min-together must be at least 1')
+        run = update if options['incremental'] else build
+        products = run(options['top_k'], options['min_together'], options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote recommendations for {products} products'))
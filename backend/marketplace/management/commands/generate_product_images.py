@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from marketplace.images import refresh_product_images
+from marketplace.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Build resized image derivatives for products that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Rebuild every product, re-rendering derivatives that are missing on disk')
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').only('image', 'image_hash', 'image_source', 'category', 'farmer_id').order_by('pk')
+        if options['force']:
+            products.update(image_source='')
+        else:
+            products = products.exclude(image_source=F('image'))
+
+        built = failed = 0
+        for product in products.iterator(chunk_size=options['chunk_size']):
+            if refresh_product_images(product):
+                built += 1
+            else:
+                failed += 1
+        self.stdout.write(self.style.SUCCESS(f'Built derivatives for {built} products ({failed} failed)'))
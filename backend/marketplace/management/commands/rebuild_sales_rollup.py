@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from marketplace.analytics import rebuild_range
+from marketplace.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Backfill or rebuild the per-farmer daily sales rollup over a date range'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='First day to rebuild (YYYY-MM-DD), defaults to the first order')
+        parser.add_argument('--end', help='Last day to rebuild (YYYY-MM-DD), defaults to today')
+        parser.add_argument('--farmer', type=int, action='append', dest='farmers',
+                            help='Only rebuild this farmer id (repeatable)')
+
+    def parse_day(self, value, name):
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f'--{name} must be a YYYY-MM-DD date')
+        return day
+
+    def handle(self, *args, **options):
+        if options['start']:
+            start = self.parse_day(options['start'], 'start')
+        else:
+            first = Order.objects.aggregate(first=Min('created_at'))['first']
+            if first is None:
+                self.stdout.write('No orders to roll up')
+                return
+            start = timezone.localdate(first)
+        end = self.parse_day(options['end'], 'end') if options['end'] else timezone.localdate()
+        if end < start:
+            raise CommandError('--end must not be before --start')
+
+        days = rebuild_range(start, end, options['farmers'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {days} days of sales rollups ({start} to {end})'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from marketplace.models import Product
+from marketplace.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Drop and rebuild the product full-text search index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        count = get_search_backend(alias).rebuild(
+            Product.objects.using(alias), chunk_size=options['chunk_size']
+        )
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} products'))
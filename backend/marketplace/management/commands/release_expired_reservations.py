@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from marketplace.inventory import release_expired
+
+
+class Command(BaseCommand):
+    help = 'Cancel pending orders whose stock hold has lapsed and return their stock'
+
+    def handle(self, *args, **options):
+        released = release_expired()
+        self.stdout.write(self.style.SUCCESS(f'Released {released} expired reservations'))
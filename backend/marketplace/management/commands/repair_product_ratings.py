@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from marketplace.reviews import repair
+
+
+class Command(BaseCommand):
+    help = "Recompute products' review counts, rating sums, averages and histograms from their reviews"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        checked, fixed = repair(using=options['database'], chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} products, fixed {fixed}'))
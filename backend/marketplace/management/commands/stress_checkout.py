@@ -0,0 +1,86 @@
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+
+from marketplace.inventory import InsufficientStock, place_order
+from marketplace.models import OrderItem, Product
+
+
+def checkout_stress(product, buyers, quantity=1):
+    """Have ``buyers`` threads check out ``product`` until it sells out.
+
+    Returns the run's statistics; ``oversold`` is the number of units sold
+    beyond the stock the product started with, which must be zero.
+    """
+    product.refresh_from_db()
+    initial = product.quantity
+    customers = [
+        User.objects.get_or_create(username=f'stress-buyer-{i}')[0] for i in range(buyers)
+    ]
+    results = {'checkouts': 0, 'sold_out': 0}
+    lock = threading.Lock()
+    start = threading.Barrier(buyers)
+
+    def buy(customer):
+        counts = {'checkouts': 0, 'sold_out': 0}
+        start.wait()
+        try:
+            while True:
+                try:
+                    place_order(customer, [(product.pk, quantity)])
+                except InsufficientStock:
+                    counts['sold_out'] += 1
+                    break
+                counts['checkouts'] += 1
+        finally:
+            connection.close()
+            with lock:
+                for key, value in counts.items():
+                    results[key] += value
+
+    threads = [threading.Thread(target=buy, args=(customer,)) for customer in customers]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    product.refresh_from_db()
+    sold = OrderItem.objects.filter(product=product).aggregate(units=Sum('quantity'))['units'] or 0
+    results.update({
+        'buyers': buyers,
+        'initial_stock': initial,
+        'remaining_stock': product.quantity,
+        'units_sold': sold,
+        'oversold': max(0, sold - initial),
+        'consistent': sold + product.quantity == initial,
+        'seconds': round(elapsed, 3),
+        'checkouts_per_second': round(results['checkouts'] / elapsed, 1) if elapsed else None,
+    })
+    return results
+
+
+class Command(BaseCommand):
+    help = 'Race parallel buyers for one hot product and report oversell and checkouts/sec'
+
+    def add_arguments(self, parser):
+        parser.add_argument('product', type=int, help='Product id to sell out (its stock is consumed)')
+        parser.add_argument('--buyers', type=int, default=50)
+        parser.add_argument('--quantity', type=int, default=1, help='Units per checkout')
+
+    def handle(self, *args, **options):
+        try:
+            product = Product.objects.get(pk=options['product'])
+        except Product.DoesNotExist:
+            raise CommandError(f"Product {options['product']} does not exist")
+        results = checkout_stress(product, options['buyers'], options['quantity'])
+        for key, value in results.items():
+            self.stdout.write(f'{key}: {value}')
+        if results['oversold'] or not results['consistent']:
+            raise CommandError('Stock accounting is inconsistent')
+        self.stdout.write(self.style.SUCCESS(f"{results['checkouts_per_second']} checkouts/sec, no oversell"))
@@ -0,0 +1,258 @@
+"""Per-route request metrics and the Prometheus text endpoint.
+
+``RequestMetricsMiddleware`` times every request and, through a database
+execute wrapper, counts its SQL queries and their time; it records these with
+the response size under the request's URL route (``api/products/<int:pk>/``,
+not the raw path, so label cardinality stays bounded). Requests slower than
+``METRICS_SLOW_REQUEST_SECONDS`` are logged with their most repeated
+statements, which is how N+1 query patterns show up.
+
+Recording is a dict lookup and a few bisects under a lock, cheap enough to
+leave on in production. Like the other in-process counters (notification
+stream, catalog cache, both folded into ``/metrics``), the numbers are per
+worker process; Prometheus scrapes and sums each worker.
+"""
+import bisect
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+from . import caching, realtime
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SLOW_REQUEST_SECONDS = 1.0
+DEFAULT_ALLOWED_IPS = ('127.0.0.1', '::1')
+UNMATCHED_ROUTE = '<unmatched>'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """Bucketed observations per label set, rendered cumulatively"""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.series = {}
+
+    def observe(self, labels, value):
+        # Callers hold the registry lock.
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self, label_names):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for labels, (counts, total) in sorted(self.series.items()):
+            base = format_labels(zip(label_names, labels))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{base}{"," if base else ""}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{base}}} {total}')
+            lines.append(f'{self.name}_count{{{base}}} {cumulative}')
+        return lines
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(pairs):
+    return ','.join(f'{name}="{escape(value)}"' for name, value in pairs)
+
+
+def counter(name, help_text, samples, kind='counter'):
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+    for labels, value in samples:
+        lines.append(f'{name}{{{format_labels(labels)}}} {value}' if labels else f'{name} {value}')
+    return lines
+
+
+class RequestMetrics:
+    label_names = ('route', 'method')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = Counter()
+            self.db_seconds = Counter()
+            self.latency = Histogram(
+                'http_request_duration_seconds', 'Request latency by route.',
+                (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+            )
+            self.queries = Histogram(
+                'http_request_db_queries', 'SQL queries issued per request by route.',
+                (0, 1, 2, 5, 10, 20, 50, 100, 200),
+            )
+            self.sizes = Histogram(
+                'http_response_size_bytes', 'Response body size by route (streamed bodies excluded).',
+                (100, 1000, 10000, 100000, 1000000, 10000000),
+            )
+
+    def record(self, route, method, status, seconds, queries=None, db_seconds=0.0, size=None):
+        labels = (route, method)
+        with self.lock:
+            self.requests[route, method, status] += 1
+            self.latency.observe(labels, seconds)
+            if queries is not None:
+                self.queries.observe(labels, queries)
+                self.db_seconds[labels] += db_seconds
+            if size is not None:
+                self.sizes.observe(labels, size)
+
+    def render(self):
+        with self.lock:
+            lines = counter(
+                'http_requests_total', 'Requests by route, method and status.',
+                [(zip(('route', 'method', 'status'), key), count) for key, count in sorted(self.requests.items())],
+            )
+            lines += self.latency.render(self.label_names)
+            lines += self.queries.render(self.label_names)
+            lines += counter(
+                'http_request_db_seconds_total', 'Time spent in SQL by route.',
+                [(zip(self.label_names, key), round(total, 6)) for key, total in sorted(self.db_seconds.items())],
+            )
+            lines += self.sizes.render(self.label_names)
+        return lines
+
+
+metrics = RequestMetrics()
+
+
+class QueryRecorder:
+    """Database execute wrapper counting and timing one request's queries"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
+            self.statements[sql] += 1
+
+    def repeated(self, limit=5):
+        return [(count, sql) for sql, count in self.statements.most_common(limit) if count > 1]
+
+
+def route_of(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.route if match is not None and match.route else UNMATCHED_ROUTE
+
+
+def response_size(response):
+    if response.streaming:
+        return None
+    return len(response.content)
+
+
+def log_slow(request, route, seconds, recorder):
+    threshold = getattr(settings, 'METRICS_SLOW_REQUEST_SECONDS', DEFAULT_SLOW_REQUEST_SECONDS)
+    if seconds < threshold:
+        return
+    repeated = recorder.repeated() if recorder else []
+    logger.warning(
+        'slow request %s %s (route %s): %.3fs, %s queries in %.3fs%s',
+        request.method, request.path, route, seconds,
+        recorder.count if recorder else '?', recorder.seconds if recorder else 0.0,
+        ''.join(f'\n  {count}x {sql[:300]}' for count, sql in repeated),
+    )
+
+
+class RequestMetricsMiddleware:
+    """Record latency, SQL and response size per route.
+
+    Under ASGI, async views run their queries in worker threads the wrapper
+    cannot see, so only latency and size are recorded for them.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        self.finish(request, response, time.perf_counter() - started, recorder)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.finish(request, response, time.perf_counter() - started, None)
+        return response
+
+    def finish(self, request, response, seconds, recorder):
+        route = route_of(request)
+        metrics.record(
+            route, request.method, response.status_code, seconds,
+            queries=recorder.count if recorder else None,
+            db_seconds=recorder.seconds if recorder else 0.0,
+            size=response_size(response),
+        )
+        log_slow(request, route, seconds, recorder)
+
+
+def stream_lines():
+    """The notification push channel's counters (realtime.StreamMetrics)"""
+    snapshot = realtime.metrics.snapshot()
+    lines = counter('notification_stream_connections', 'Open notification streams.',
+                    [((), snapshot['active_connections'])], kind='gauge')
+    lines += counter('notification_stream_connections_total', 'Notification streams opened.',
+                     [((), snapshot['total_connections'])])
+    latency = Histogram('notification_stream_delivery_seconds', 'Publish to write latency of pushed notifications.',
+                        realtime.metrics.latency_buckets)
+    latency.series[()] = [
+        [snapshot['latency_buckets'][str(bound)] for bound in latency.buckets] + [snapshot['latency_buckets']['+Inf']],
+        (snapshot['latency_avg'] or 0.0) * snapshot['messages_sent'],
+    ]
+    return lines + latency.render(())
+
+
+def cache_lines():
+    """Catalog response cache hits and misses (caching.CacheMetrics)"""
+    samples = []
+    for view, counts in sorted(caching.metrics.snapshot().items()):
+        samples.append(((('view', view), ('result', 'hit')), counts['hits']))
+        samples.append(((('view', view), ('result', 'miss')), counts['misses']))
+    return counter('catalog_cache_requests_total', 'Catalog response cache lookups.', samples)
+
+
+def render():
+    return '\n'.join(metrics.render() + stream_lines() + cache_lines()) + '\n'
+
+
+def metrics_view(request):
+    """Prometheus text exposition, for scrapers on ``METRICS_ALLOWED_IPS``"""
+    allowed = getattr(settings, 'METRICS_ALLOWED_IPS', DEFAULT_ALLOWED_IPS)
+    if request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,26 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from marketplace.search import get_search_backend
+
+    alias = schema_editor.connection.alias
+    Product = apps.get_model('marketplace', 'Product')
+    get_search_backend(alias).rebuild(Product.objects.using(alias))
+
+
+def drop_search_index(apps, schema_editor):
+    from marketplace.search import get_search_backend
+
+    get_search_backend(schema_editor.connection.alias).drop_index()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0003_event_notification_product_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
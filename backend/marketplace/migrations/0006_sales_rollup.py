@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0005_order_total_related_names'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FarmerCustomer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_order_date', models.DateField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FarmerSalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('category', models.CharField(choices=[('VG', 'Vegetables'), ('FR', 'Fruits'), ('GR', 'Grains'), ('DA', 'Dairy')], max_length=2)),
+                ('status', models.CharField(max_length=20)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('customers', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at'], name='marketplace_created_b4d26a_idx'),
+        ),
+        migrations.AddField(
+            model_name='farmercustomer',
+            name='customer',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='farmercustomer',
+            name='farmer',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='customers', to='marketplace.farmerprofile'),
+        ),
+        migrations.AddField(
+            model_name='farmersalesrollup',
+            name='farmer',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_rollups', to='marketplace.farmerprofile'),
+        ),
+        migrations.AddIndex(
+            model_name='farmercustomer',
+            index=models.Index(fields=['farmer', 'first_order_date'], name='marketplace_farmer__4a3442_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='farmercustomer',
+            constraint=models.UniqueConstraint(fields=('farmer', 'customer'), name='unique_farmer_customer'),
+        ),
+        migrations.AddIndex(
+            model_name='farmersalesrollup',
+            index=models.Index(fields=['day'], name='marketplace_day_262a90_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='farmersalesrollup',
+            constraint=models.UniqueConstraint(fields=('farmer', 'day', 'category', 'status'), name='unique_sales_rollup_bucket'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:20
+
+import django.core.validators
+from django.db import migrations, models
+
+
+def geocode_farms(apps, schema_editor):
+    from marketplace.geo import locate
+
+    alias = schema_editor.connection.alias
+    FarmerProfile = apps.get_model('marketplace', 'FarmerProfile')
+    farmers = list(FarmerProfile.objects.using(alias).only('id', 'location'))
+    for farmer in farmers:
+        farmer.latitude = farmer.longitude = None
+        locate(farmer)
+    FarmerProfile.objects.using(alias).bulk_update(farmers, ['latitude', 'longitude', 'geohash'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0010_product_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='farmerprofile',
+            name='geohash',
+            field=models.CharField(blank=True, editable=False, max_length=12),
+        ),
+        migrations.AddField(
+            model_name='farmerprofile',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-90), django.core.validators.MaxValueValidator(90)]),
+        ),
+        migrations.AddField(
+            model_name='farmerprofile',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-180), django.core.validators.MaxValueValidator(180)]),
+        ),
+        migrations.AddIndex(
+            model_name='farmerprofile',
+            index=models.Index(fields=['geohash', 'latitude', 'longitude'], name='farmer_geohash_idx'),
+        ),
+        migrations.RunPython(geocode_farms, migrations.RunPython.noop),
+    ]
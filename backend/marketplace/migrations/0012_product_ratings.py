@@ -0,0 +1,97 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:28
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef, Q
+
+
+def drop_duplicate_reviews(apps, schema_editor):
+    """Keep only each user's newest review of a product before they become unique"""
+    alias = schema_editor.connection.alias
+    ProductReview = apps.get_model('marketplace', 'ProductReview')
+    reviews = ProductReview.objects.using(alias)
+    newer = reviews.filter(product=OuterRef('product'), user=OuterRef('user')).filter(
+        Q(created_at__gt=OuterRef('created_at')) | Q(created_at=OuterRef('created_at'), pk__gt=OuterRef('pk'))
+    )
+    # Ids first: MySQL cannot delete from a table its subquery reads.
+    stale = list(reviews.filter(Exists(newer)).values_list('pk', flat=True))
+    for start in range(0, len(stale), 1000):
+        reviews.filter(pk__in=stale[start:start + 1000]).delete()
+
+
+def count_ratings(apps, schema_editor):
+    from marketplace.reviews import RATING_FIELDS, aggregates
+
+    alias = schema_editor.connection.alias
+    Product = apps.get_model('marketplace', 'Product')
+    ProductReview = apps.get_model('marketplace', 'ProductReview')
+    products = [
+        Product(pk=product_id, **values)
+        for product_id, values in aggregates(ProductReview.objects.using(alias)).items()
+    ]
+    Product.objects.using(alias).bulk_update(products, RATING_FIELDS, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0011_farmerprofile_location'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_average',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('rating_count__gt', 0)), fields=['-rating_average', '-rating_count', '-id'], name='product_top_rated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productreview',
+            index=models.Index(fields=['product', '-created_at', '-id'], name='marketplace_product_d70252_idx'),
+        ),
+        migrations.RunPython(drop_duplicate_reviews, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='productreview',
+            constraint=models.UniqueConstraint(fields=('product', 'user'), name='one_review_per_user'),
+        ),
+        migrations.RunPython(count_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:43
+
+import django.db.models.deletion
+from collections import Counter
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def count_orders(apps, schema_editor):
+    alias = schema_editor.connection.alias
+    OrderItem = apps.get_model('marketplace', 'OrderItem')
+    FarmerOrderRollup = apps.get_model('marketplace', 'FarmerOrderRollup')
+    buckets = Counter()
+    rows = (
+        OrderItem.objects.using(alias)
+        .values_list('order_id', 'order__created_at', 'order__status', 'product__farmer_id')
+        .distinct().order_by()
+    )
+    for _, created_at, status, farmer_id in rows.iterator():
+        buckets[farmer_id, timezone.localdate(created_at), status] += 1
+    FarmerOrderRollup.objects.using(alias).bulk_create([
+        FarmerOrderRollup(farmer_id=farmer_id, day=day, status=status, orders=orders)
+        for (farmer_id, day, status), orders in buckets.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0013_product_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FarmerOrderRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('status', models.CharField(max_length=20)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('farmer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_rollups', to='marketplace.farmerprofile')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day'], name='marketplace_day_135a7e_idx')],
+                'constraints': [models.UniqueConstraint(fields=('farmer', 'day', 'status'), name='unique_order_rollup_bucket')],
+            },
+        ),
+        migrations.RunPython(count_orders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations, models
+
+
+def fill_spans(apps, schema_editor):
+    alias = schema_editor.connection.alias
+    Event = apps.get_model('marketplace', 'Event')
+    events = list(Event.objects.using(alias).only('id', 'start', 'end'))
+    for event in events:
+        event.span = event.end - event.start
+    Event.objects.using(alias).bulk_update(events, ['span'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0014_order_rollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='span',
+            field=models.DurationField(editable=False, null=True),
+        ),
+        migrations.RunPython(fill_spans, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='event',
+            name='span',
+            field=models.DurationField(editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(condition=models.Q(('recurrence', '')), fields=['user', 'span'], name='event_user_span_idx'),
+        ),
+    ]
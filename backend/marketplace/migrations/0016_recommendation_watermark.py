@@ -0,0 +1,57 @@
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+
+
+def fill_added_at(apps, schema_editor):
+    alias = schema_editor.connection.alias
+    Order = apps.get_model('marketplace', 'Order')
+    OrderItem = apps.get_model('marketplace', 'OrderItem')
+    OrderItem.objects.using(alias).update(
+        added_at=Subquery(Order.objects.using(alias).filter(pk=OuterRef('order_id')).values('created_at')[:1])
+    )
+
+
+def fill_started_at(apps, schema_editor):
+    alias = schema_editor.connection.alias
+    RecommendationBuild = apps.get_model('marketplace', 'RecommendationBuild')
+    RecommendationBuild.objects.using(alias).update(started_at=F('finished_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0015_event_span'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='added_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(fill_added_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='added_at',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['added_at'], name='marketplace_added_a_59406f_idx'),
+        ),
+        migrations.AddField(
+            model_name='recommendationbuild',
+            name='started_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(fill_started_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='recommendationbuild',
+            name='started_at',
+            field=models.DateTimeField(),
+        ),
+        migrations.RemoveField(
+            model_name='recommendationbuild',
+            name='last_order_id',
+        ),
+    ]
@@ -1,5 +1,13 @@
-from datetime import timezone
+import copy
+import datetime
+
+from dateutil.rrule import rrule, rrulestr
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from django.db.models import Count, DecimalField, Exists, F, OuterRef, Prefetch, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
@@ -10,6 +18,42 @@ class FarmerProfile(models.Model):
     location = models.CharField(max_length=100)
     contact_number = models.CharField(max_length=20)
     bio = models.TextField(blank=True)
+    # Geocoded from ``location`` unless given (see geo.py); the geohash
+    # indexes them for radius searches.
+    latitude = models.FloatField(null=True, blank=True, validators=[MinValueValidator(-90), MaxValueValidator(90)])
+    longitude = models.FloatField(null=True, blank=True, validators=[MinValueValidator(-180), MaxValueValidator(180)])
+    geohash = models.CharField(max_length=12, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Covers the radius prefilter (geo.within_box) without table lookups.
+            models.Index(fields=['geohash', 'latitude', 'longitude'], name='farmer_geohash_idx'),
+        ]
+
+    @property
+    def orders(self):
+        """Orders containing at least one of this farmer's products"""
+        return Order.objects.for_farmer(self).order_by('-created_at')
+
+    def sales_summary(self):
+        """Product, order and revenue totals computed in a single query.
+
+        Joining products to their order items yields one row per line item, so
+        the revenue sum is not inflated by the join while the counts use
+        DISTINCT.
+        """
+        line_total = F('products__orderitem__price') * F('products__orderitem__quantity')
+        order = 'products__orderitem__order'
+        return FarmerProfile.objects.filter(pk=self.pk).aggregate(
+            total_products=Count('products', distinct=True),
+            total_orders=Count(order, distinct=True),
+            active_orders=Count(order, distinct=True, filter=Q(**{f'{order}__status': Order.PENDING})),
+            total_revenue=Coalesce(
+                Sum(line_total, filter=Q(**{f'{order}__status': Order.COMPLETED})),
+                Value(0),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+        )
 
 # models.py
 class Product(models.Model):
@@ -20,32 +64,146 @@ class Product(models.Model):
         ('DA', 'Dairy'),
     ]
     
-    farmer = models.ForeignKey(FarmerProfile, on_delete=models.CASCADE)
+    farmer = models.ForeignKey(FarmerProfile, related_name='products', on_delete=models.CASCADE)
     name = models.CharField(max_length=100)
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     category = models.CharField(max_length=2, choices=CATEGORY_CHOICES)
     quantity = models.PositiveIntegerField()
     image = models.ImageField(upload_to='products/')
+    # Content hash naming the image's resized derivatives (see images.py),
+    # and the upload they were built from.
+    image_hash = models.CharField(max_length=32, blank=True, editable=False)
+    image_source = models.CharField(max_length=100, blank=True, editable=False)
     harvest_date = models.DateField()
     expiry_date = models.DateField()
     created_at = models.DateTimeField(auto_now_add=True)
+    # Review aggregates, only ever changed by F() updates (see reviews.py).
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_average = models.FloatField(default=0, editable=False)
+    rating_1 = models.PositiveIntegerField(default=0, editable=False)
+    rating_2 = models.PositiveIntegerField(default=0, editable=False)
+    rating_3 = models.PositiveIntegerField(default=0, editable=False)
+    rating_4 = models.PositiveIntegerField(default=0, editable=False)
+    rating_5 = models.PositiveIntegerField(default=0, editable=False)
+
+    RATING_FIELDS = (
+        'rating_count', 'rating_sum', 'rating_average',
+        'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5',
+    )
+
+    class Meta:
+        indexes = [
+            # Catalog listing filters, each ending in the cursor ordering so a
+            # filtered page is a single index range scan.
+            models.Index(fields=['category', '-created_at', '-id']),
+            models.Index(fields=['farmer', '-created_at', '-id']),
+            models.Index(fields=['category', 'price']),
+            models.Index(fields=['expiry_date', 'category']),
+            models.Index(
+                fields=['-created_at', '-id'],
+                condition=models.Q(quantity__gt=0),
+                name='product_in_stock_recent_idx',
+            ),
+            # Top rated first (``sort=rating``) and ``min_rating``.
+            models.Index(
+                fields=['-rating_average', '-rating_count', '-id'],
+                condition=models.Q(rating_count__gt=0),
+                name='product_top_rated_idx',
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Saving a loaded product must not write back ratings that reviews
+        # have changed since it was read.
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in deferred and field.name not in self.RATING_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+class OrderQuerySet(models.QuerySet):
+    def for_farmer(self, farmer):
+        """Orders containing one of ``farmer``'s products.
+
+        A correlated EXISTS instead of joining through the items and calling
+        distinct(), so each order appears once without de-duplicating rows.
+        """
+        return self.filter(Exists(OrderItem.objects.filter(order=OuterRef('pk'), product__farmer=farmer)))
+
+    def with_items(self, products=False):
+        """Prefetch items (and optionally their products) in one extra query"""
+        items = OrderItem.objects.order_by('id')
+        if products:
+            items = items.select_related('product')
+        return self.prefetch_related(Prefetch('items', queryset=items))
+
 
 # models.py
 class Order(models.Model):
-    customer = models.ForeignKey(User, on_delete=models.CASCADE)
+    PENDING = 'PENDING'
+    COMPLETED = 'COMPLETED'
+    CANCELLED = 'CANCELLED'
+
+    customer = models.ForeignKey(User, related_name='orders', on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=20, choices=[
-        ('PENDING', 'Pending'),
-        ('COMPLETED', 'Completed'),
-        ('CANCELLED', 'Cancelled')
+        (PENDING, 'Pending'),
+        (COMPLETED, 'Completed'),
+        (CANCELLED, 'Cancelled')
     ])
+    # Denormalized sum of price * quantity over the order's items, kept in
+    # sync by the OrderItem signals so listings and stats never re-add items.
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    # Set while a pending order holds stock (see inventory.py); the hold is
+    # released if the order is not completed by then.
+    reserved_until = models.DateTimeField(null=True, blank=True)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at']),
+            models.Index(
+                fields=['reserved_until'],
+                condition=models.Q(reserved_until__isnull=False),
+                name='order_reservation_idx',
+            ),
+        ]
+
+    @classmethod
+    def update_totals(cls, order_ids):
+        """Recompute ``total`` for the given orders with one UPDATE"""
+        line_totals = (
+            OrderItem.objects.filter(order=OuterRef('pk'))
+            .values('order')
+            .annotate(total=Sum(F('price') * F('quantity')))
+            .values('total')
+        )
+        return cls.objects.filter(pk__in=order_ids).update(
+            total=Coalesce(
+                Subquery(line_totals),
+                Value(0),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            )
+        )
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, related_name='items', on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
+    # When the line was written, which is not always when its order was:
+    # incremental recommendation updates pick up new lines by it.
+    added_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['added_at']),
+        ]
 
 # models.py
 class ProductReview(models.Model):
@@ -55,6 +213,157 @@ class ProductReview(models.Model):
     comment = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'user'], name='one_review_per_user'),
+        ]
+        indexes = [
+            models.Index(fields=['product', '-created_at', '-id']),
+        ]
+
+
+class FarmerSalesRollup(models.Model):
+    """Per farmer, day, category and order status sales totals.
+
+    Rebuilt bucket by bucket from the order tables (see ``analytics.py``) so
+    dashboards sum a few hundred of these rows instead of scanning orders.
+    ``orders`` and ``customers`` are distinct counts within the bucket, so an
+    order spanning two categories is counted once in each; order totals come
+    from ``FarmerOrderRollup`` instead.
+    """
+    farmer = models.ForeignKey(FarmerProfile, related_name='sales_rollups', on_delete=models.CASCADE)
+    day = models.DateField()
+    category = models.CharField(max_length=2, choices=Product.CATEGORY_CHOICES)
+    status = models.CharField(max_length=20)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    units = models.PositiveIntegerField(default=0)
+    orders = models.PositiveIntegerField(default=0)
+    customers = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['farmer', 'day', 'category', 'status'], name='unique_sales_rollup_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['day']),
+        ]
+
+
+class FarmerOrderRollup(models.Model):
+    """Distinct orders per farmer, day and order status.
+
+    Kept beside ``FarmerSalesRollup`` without the category dimension, so
+    summing buckets counts an order once however many categories it spans.
+    """
+    farmer = models.ForeignKey(FarmerProfile, related_name='order_rollups', on_delete=models.CASCADE)
+    day = models.DateField()
+    status = models.CharField(max_length=20)
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['farmer', 'day', 'status'], name='unique_order_rollup_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['day']),
+        ]
+
+
+class FarmerCustomer(models.Model):
+    """Date of each customer's first non-cancelled order with a farmer"""
+    farmer = models.ForeignKey(FarmerProfile, related_name='customers', on_delete=models.CASCADE)
+    customer = models.ForeignKey(User, on_delete=models.CASCADE)
+    first_order_date = models.DateField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['farmer', 'customer'], name='unique_farmer_customer'),
+        ]
+        indexes = [
+            models.Index(fields=['farmer', 'first_order_date']),
+        ]
+
+
+class ProductRecommendation(models.Model):
+    """One of a product's "frequently bought together" products.
+
+    Precomputed from the order history by ``manage.py build_recommendations``
+    (see ``recommendations.py``); rank 0 is the strongest.
+    """
+    product = models.ForeignKey(Product, related_name='recommendations', on_delete=models.CASCADE)
+    related = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+    # Orders containing both products.
+    together = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='unique_recommendation_rank'),
+        ]
+
+
+class RecommendationBuild(models.Model):
+    """A run of ``build_recommendations``; the latest one's ``started_at``
+    is where the next incremental update starts"""
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(auto_now_add=True)
+    full = models.BooleanField()
+    products = models.PositiveIntegerField()
+
+
+class RelatedObjectQuerySet(models.QuerySet):
+    """Queryset for models pointing at any object via related_content_type/related_object_id"""
+
+    def with_related_objects(self):
+        """Resolve ``related_object`` for every row up front.
+
+        GenericForeignKey prefetching groups rows by content type and loads
+        each target model with a single ``IN`` query, so a page costs one
+        query per distinct related model instead of one per row.
+        """
+        return self.select_related('related_content_type').prefetch_related('related_object')
+
+    def related_to(self, content_type, object_ids):
+        """Rows pointing at the given objects of one model.
+
+        Filters on (related_content_type, related_object_id) so lookups from
+        the target side use the composite index.
+        """
+        return self.filter(related_content_type=content_type, related_object_id__in=object_ids)
+
+
+class EventQuerySet(RelatedObjectQuerySet):
+    def overlapping(self, user_id, start, end):
+        """The user's events overlapping [start, end).
+
+        An overlap test alone (start < end_bound AND end > start_bound) only
+        bounds ``start`` from above. Events can last at most the user's
+        longest span, so that also bounds ``start`` from below and the query
+        becomes a (user, start) index range scan.
+        """
+        span = Event.longest_span(user_id)
+        return self.filter(
+            user_id=user_id,
+            recurrence='',
+            start__gte=start - span,
+            start__lt=end,
+            end__gt=start,
+        )
+
+    def series_overlapping(self, user_id, start, end):
+        """The user's recurring series with occurrences possibly in [start, end)"""
+        return self.filter(user_id=user_id, start__lt=end).exclude(recurrence='').filter(
+            Q(recurrence_end__isnull=True) | Q(recurrence_end__gt=start)
+        )
+
+    def in_window(self, start, end):
+        """Single events overlapping [start, end) plus series that may recur in it"""
+        return self.filter(start__lt=end).filter(
+            Q(recurrence='', end__gt=start)
+            | (~Q(recurrence='') & (Q(recurrence_end__isnull=True) | Q(recurrence_end__gt=start)))
+        )
+
 
 class Notification(models.Model):
     NOTIFICATION_TYPES = (
@@ -79,6 +388,8 @@ class Notification(models.Model):
     )
     related_object_id = models.PositiveIntegerField(null=True, blank=True)
     related_object = GenericForeignKey('related_content_type', 'related_object_id')
+
+    objects = RelatedObjectQuerySet.as_manager()
     
     class Meta:
         ordering = ['-created_at']
@@ -119,13 +430,43 @@ class Event(models.Model):
     related_object_id = models.PositiveIntegerField(null=True, blank=True)
     related_object = GenericForeignKey('related_content_type', 'related_object_id')
 
+    # Recurring series: an RFC 5545 RRULE body (e.g. "FREQ=WEEKLY;BYDAY=SA")
+    # applied from ``start``, with occurrence starts to skip. A series is one
+    # row however many times it repeats; occurrences are expanded on read.
+    recurrence = models.CharField(max_length=255, blank=True, default='')
+    exception_dates = models.JSONField(default=list, blank=True)
+    # End of the last occurrence, derived on save; null for open-ended series.
+    recurrence_end = models.DateTimeField(null=True, blank=True, editable=False)
+    # ``end - start``, derived on save (set it when bulk creating); bounds
+    # range scans from below (see EventQuerySet.overlapping).
+    span = models.DurationField(editable=False)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = EventQuerySet.as_manager()
+
+    # Series repeat at most daily, so each one is at most one occurrence a
+    # day, and finite ones are short enough to walk on save.
+    SUB_DAILY_PARTS = {'FREQ': {'HOURLY', 'MINUTELY', 'SECONDLY'}, 'BYHOUR': None, 'BYMINUTE': None, 'BYSECOND': None}
+    MAX_RECURRENCE_COUNT = 1000
+    MAX_RECURRENCE_SPAN = datetime.timedelta(days=3660)
+    # More occurrences than any valid finite series has; rules saved before
+    # the limits beyond it are treated as open-ended.
+    MAX_WALKED_OCCURRENCES = 5000
+
     class Meta:
         ordering = ['start']
         indexes = [
+            models.Index(fields=['user', 'start']),
+            models.Index(
+                fields=['user', 'recurrence_end'],
+                condition=~models.Q(recurrence=''),
+                name='event_series_idx',
+            ),
             models.Index(fields=['start', 'end']),
+            # Longest single event per user, read off the end of the index.
+            models.Index(fields=['user', 'span'], condition=models.Q(recurrence=''), name='event_user_span_idx'),
             models.Index(fields=['user', 'event_type']),
             models.Index(fields=['related_content_type', 'related_object_id']),
         ]
@@ -133,6 +474,81 @@ class Event(models.Model):
     def __str__(self):
         return f"{self.title} ({self.get_event_type_display()})"
 
+    def save(self, *args, **kwargs):
+        self.recurrence_end = self.last_occurrence_end()
+        self.span = self.end - self.start
+        super().save(*args, **kwargs)
+
+    def rule(self):
+        """The parsed recurrence rule; raises ValueError if it is invalid"""
+        return rrulestr(self.recurrence, dtstart=self.start)
+
+    def check_recurrence(self):
+        """Raise ValueError unless the rule is valid and within the limits"""
+        rule = self.rule()
+        if not isinstance(rule, rrule):
+            raise ValueError('only a single RRULE is supported')
+        parts = dict(
+            part.split('=', 1)
+            for part in self.recurrence.upper().removeprefix('RRULE:').split(';') if '=' in part
+        )
+        for name, values in self.SUB_DAILY_PARTS.items():
+            if name in parts and (values is None or parts[name] in values):
+                raise ValueError('events can repeat at most daily')
+        if 'COUNT' in parts and int(parts['COUNT']) > self.MAX_RECURRENCE_COUNT:
+            raise ValueError(f'COUNT can be at most {self.MAX_RECURRENCE_COUNT}')
+        # At most one occurrence a day, so this walks a bounded number.
+        if 'UNTIL' in parts and rule.after(self.start + self.MAX_RECURRENCE_SPAN) is not None:
+            raise ValueError(f'UNTIL can be at most {self.MAX_RECURRENCE_SPAN.days} days after the start')
+
+    def excluded_starts(self):
+        excluded = set()
+        for value in self.exception_dates:
+            moment = parse_datetime(value)
+            if moment is not None:
+                excluded.add(timezone.make_aware(moment) if timezone.is_naive(moment) else moment)
+        return excluded
+
+    def last_occurrence_end(self):
+        rule_text = self.recurrence.upper()
+        if 'UNTIL=' not in rule_text and 'COUNT=' not in rule_text:
+            return None
+        last = self.start
+        for walked, last in enumerate(self.rule()):
+            if walked == self.MAX_WALKED_OCCURRENCES:
+                return None
+        return last + (self.end - self.start)
+
+    def occurrences(self, window_start, window_end):
+        """Lazily yield ``(start, end)`` of each occurrence overlapping the window.
+
+        Only the occurrences inside the window are ever computed, however
+        long the series runs.
+        """
+        duration = self.end - self.start
+        if not self.recurrence:
+            if self.start < window_end and self.end > window_start:
+                yield self.start, self.end
+            return
+        excluded = self.excluded_starts()
+        for start in self.rule().xafter(window_start - duration):
+            if start >= window_end:
+                break
+            if start not in excluded:
+                yield start, start + duration
+
+    def as_occurrence(self, start, end):
+        """A shallow copy of the series standing in for one occurrence"""
+        occurrence = copy.copy(self)
+        occurrence.start, occurrence.end = start, end
+        return occurrence
+
+    @classmethod
+    def longest_span(cls, user_id):
+        """Duration of the user's longest single event, one index lookup"""
+        span = cls.objects.filter(user_id=user_id, recurrence='').aggregate(span=models.Max('span'))['span']
+        return span or datetime.timedelta(0)
+
     @property
     def duration(self):
         if not self.end:
@@ -0,0 +1,121 @@
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+
+from .filters import product_ordering
+
+
+def _reverse(ordering):
+    return tuple(field[1:] if field.startswith('-') else f'-{field}' for field in ordering)
+
+
+class KeysetPagination(CursorPagination):
+    """Cursor pagination that seeks on the whole ordering.
+
+    DRF positions its cursors on the first ordering field alone and steps
+    over rows sharing that value with an offset, so a long run of ties (many
+    products with one rating) is rescanned from its start on every page.
+    Here a position holds the last row's value of every ordering field, and
+    a page starts with a comparison on all of them that the matching
+    composite index answers with a seek. Orderings end with the primary
+    key, so positions are unique and the offset stays 0.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        offset, reverse, position = self.cursor or (0, False, None)
+
+        ordering = _reverse(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            try:
+                queryset = queryset.filter(self.after(ordering, position))
+            except (ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        following = self._get_position_from_instance(results[-1], self.ordering) if len(results) > len(self.page) else None
+        started = position is not None or offset > 0
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = started, following is not None
+            self.next_position, self.previous_position = position, following
+        else:
+            self.has_next, self.has_previous = following is not None, started
+            self.next_position, self.previous_position = following, position
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def after(self, ordering, position):
+        """Rows past ``position`` in ``ordering``:
+        ``a < x OR (a = x AND b < y) OR ...``, bounded by ``a <= x`` up front
+        so the index range starts at the cursor"""
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+        fields = [(field.lstrip('-'), 'lt' if field.startswith('-') else 'gt') for field in ordering]
+        condition, equal = Q(), Q()
+        for (name, lookup), value in zip(fields, values):
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        name, lookup = fields[0]
+        return Q(**{f'{name}__{lookup}e': values[0]}) & condition
+
+    def _get_position_from_instance(self, instance, ordering):
+        fields = [field.lstrip('-') for field in ordering]
+        if isinstance(instance, dict):
+            values = [instance[name] for name in fields]
+        else:
+            values = [getattr(instance, name) for name in fields]
+        return json.dumps([str(value) for value in values])
+
+
+class OptionalCursorPagination(KeysetPagination):
+    """Keyset pagination that only kicks in when the client asks for it.
+
+    Plain list requests keep returning a bare array so existing clients are
+    unaffected; passing ``cursor`` or ``page_size`` switches to cursor pages.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+class ProductCursorPagination(KeysetPagination):
+    """Newest listings first, seeking on the (created_at, id) index, or
+    best rated first with ``sort=rating``.
+
+    Always paginated: the catalog is too large to list in one response.
+    """
+    ordering = ('-created_at', '-id')
+
+    def get_ordering(self, request, queryset, view):
+        return product_ordering(request.query_params)
+
+
+class OrderCursorPagination(OptionalCursorPagination):
+    ordering = ('-created_at', '-id')
+
+
+class ReviewCursorPagination(OptionalCursorPagination):
+    ordering = ('-created_at', '-id')
@@ -0,0 +1,186 @@
+"""Server-sent event push for new notifications.
+
+Connected clients hold an async ``text/event-stream`` response (served by the
+ASGI application) and receive each new notification as it is committed, so
+the frontend no longer has to poll ``/notifications/``.
+
+Fan-out goes through a broker chosen by ``settings.REALTIME_BROKER``. The
+default ``InMemoryBroker`` only reaches subscribers in the same process, which
+suits tests and single-process deployments; a multi-process deployment plugs
+in a broker backed by a shared pub/sub service with the same interface.
+"""
+import asyncio
+import bisect
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DEFAULT_BROKER = 'marketplace.realtime.InMemoryBroker'
+HEARTBEAT_SECONDS = 15
+
+
+class StreamMetrics:
+    """Connection counts and publish-to-write latency for the push channel"""
+    latency_buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.active_connections = 0
+            self.total_connections = 0
+            self.messages_sent = 0
+            self.latency_sum = 0.0
+            self.latency_max = 0.0
+            self.latency_counts = [0] * (len(self.latency_buckets) + 1)
+
+    def connected(self):
+        with self.lock:
+            self.active_connections += 1
+            self.total_connections += 1
+
+    def disconnected(self):
+        with self.lock:
+            self.active_connections -= 1
+
+    def delivered(self, latency):
+        with self.lock:
+            self.messages_sent += 1
+            self.latency_sum += latency
+            self.latency_max = max(self.latency_max, latency)
+            self.latency_counts[bisect.bisect_left(self.latency_buckets, latency)] += 1
+
+    def snapshot(self):
+        with self.lock:
+            buckets = {str(bound): count for bound, count in zip(self.latency_buckets, self.latency_counts)}
+            buckets['+Inf'] = self.latency_counts[-1]
+            return {
+                'active_connections': self.active_connections,
+                'total_connections': self.total_connections,
+                'messages_sent': self.messages_sent,
+                'latency_avg': self.latency_sum / self.messages_sent if self.messages_sent else None,
+                'latency_max': self.latency_max,
+                'latency_buckets': buckets,
+            }
+
+
+metrics = StreamMetrics()
+
+
+class BaseBroker:
+    """Delivers per-user messages to every subscription of that user"""
+
+    def publish(self, user_id, message):
+        """Called from synchronous code (signal handlers, worker threads)"""
+        raise NotImplementedError
+
+    def subscribe(self, user_id):
+        """Return a Subscription whose ``get()`` awaits the next message"""
+        raise NotImplementedError
+
+
+class Subscription:
+    def __init__(self, broker, user_id):
+        self.broker = broker
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    async def get(self, timeout=None):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InMemoryBroker(BaseBroker):
+    """Process-local broker; user ids are keyed as strings, as in token claims"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = {}
+
+    def subscribe(self, user_id):
+        subscription = Subscription(self, str(user_id))
+        with self.lock:
+            self.subscriptions.setdefault(subscription.user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.user_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self.subscriptions.pop(subscription.user_id, None)
+
+    def publish(self, user_id, message):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(str(user_id), ()))
+        for subscription in subscriptions:
+            # Subscribers live on the ASGI event loop while publishers are
+            # usually sync threads, so hand the message over thread-safely.
+            subscription.loop.call_soon_threadsafe(subscription.queue.put_nowait, message)
+        return len(subscriptions)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(getattr(settings, 'REALTIME_BROKER', DEFAULT_BROKER))()
+        return _broker
+
+
+def notification_payload(notification):
+    """The JSON pushed for a notification, built without extra queries"""
+    return {
+        'id': notification.id,
+        'message': notification.message,
+        'notification_type': notification.notification_type,
+        'read': notification.read,
+        'created_at': notification.created_at.isoformat(),
+        'related_content_type': notification.related_content_type_id,
+        'related_object_id': notification.related_object_id,
+    }
+
+
+def publish_notification(notification):
+    get_broker().publish(notification.user_id, {
+        'event': 'notification',
+        'data': notification_payload(notification),
+        'published_at': time.monotonic(),
+    })
+
+
+def format_event(message):
+    return f"event: {message['event']}\ndata: {json.dumps(message['data'])}\n\n"
+
+
+async def event_stream(user_id, heartbeat=HEARTBEAT_SECONDS):
+    """Yield SSE frames for ``user_id`` until the client disconnects"""
+    subscription = get_broker().subscribe(user_id)
+    metrics.connected()
+    try:
+        yield 'retry: 5000\n\n'
+        while True:
+            try:
+                message = await subscription.get(timeout=heartbeat)
+            except asyncio.TimeoutError:
+                # Comment frames keep proxies from closing idle connections.
+                yield ': keepalive\n\n'
+                continue
+            frame = format_event(message)
+            metrics.delivered(time.monotonic() - message['published_at'])
+            yield frame
+    finally:
+        subscription.close()
+        metrics.disconnected()
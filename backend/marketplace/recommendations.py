@@ -0,0 +1,169 @@
+"""Offline "frequently bought together" recommendations.
+
+Finding a product's companions per request would mean self-joining the
+order items. Instead ``build`` streams the (order, product) pairs once,
+ordered by order, into a sparse item-item co-occurrence matrix (a Counter
+per product, so only pairs actually bought together take space) and keeps
+each product's top ``k`` neighbours by cosine similarity
+
+    together(a, b) / sqrt(orders(a) * orders(b))
+
+which, unlike the raw count, does not recommend the bestsellers with
+everything. They are stored as ``ProductRecommendation`` rows, which the
+related-products endpoint reads with one index lookup.
+
+``update`` folds in the order lines written since the last run started.
+Their products get their rows recomputed exactly, from every order
+containing them; their neighbours only get the changed pairs merged into
+their stored top ``k``, so an occasional full build keeps those exact.
+Lines are found by ``added_at`` rather than by id, which also catches lines
+added to an order that was already counted, and a margin before the last
+run covers checkouts that committed after it read. Counting a line twice is
+harmless, since touched products are recomputed from scratch. Cancelled
+orders are left out, but one cancelled after it was counted stays counted
+until the next full build.
+"""
+import datetime
+import heapq
+import itertools
+import math
+from collections import Counter, defaultdict
+from operator import itemgetter
+
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef
+from django.utils import timezone
+
+from .models import Order, OrderItem, ProductRecommendation, RecommendationBuild
+
+DEFAULT_TOP_K = 10
+DEFAULT_MIN_TOGETHER = 2
+# Pairs grow with the square of a basket, and a wholesale order says little
+# about which products go together; larger ones only count as orders.
+MAX_BASKET = 50
+# Longer than a checkout transaction stays open: lines it wrote before the
+# last run started but committed after are still picked up.
+RESCAN_MARGIN = datetime.timedelta(minutes=15)
+
+
+def counted_orders():
+    return Order.objects.exclude(status=Order.CANCELLED)
+
+
+def baskets(orders, chunk_size=2000):
+    """Yield the set of product ids in each of ``orders``, streaming their items"""
+    rows = (
+        OrderItem.objects.filter(order__in=orders).order_by('order_id')
+        .values_list('order_id', 'product_id').iterator(chunk_size=chunk_size)
+    )
+    for _, items in itertools.groupby(rows, key=itemgetter(0)):
+        yield {product_id for _, product_id in items}
+
+
+class CoOccurrence:
+    """Sparse counts of orders per product and per pair of products"""
+
+    def __init__(self):
+        self.orders = Counter()
+        self.together = defaultdict(Counter)
+
+    def add(self, basket):
+        self.orders.update(basket)
+        if len(basket) > MAX_BASKET:
+            return
+        for a, b in itertools.combinations(basket, 2):
+            self.together[a][b] += 1
+            self.together[b][a] += 1
+
+
+def similarity(together, orders_a, orders_b):
+    return together / math.sqrt(orders_a * orders_b)
+
+
+def top(candidates, k):
+    """``[(related id, (score, together)), ...]`` best first; ties go to the
+    pair bought together more often, then the lower id"""
+    return heapq.nsmallest(k, candidates.items(), key=lambda item: (-item[1][0], -item[1][1], item[0]))
+
+
+def neighbours(matrix, product_id, k, min_together):
+    orders = matrix.orders
+    return top({
+        related: (similarity(count, orders[product_id], orders[related]), count)
+        for related, count in matrix.together[product_id].items()
+        if count >= min_together
+    }, k)
+
+
+def recommendation_rows(ranked):
+    """ProductRecommendation rows from ``{product id: top(...) result}``"""
+    return [
+        ProductRecommendation(product_id=product_id, related_id=related, rank=rank, score=score, together=together)
+        for product_id, entries in ranked.items()
+        for rank, (related, (score, together)) in enumerate(entries)
+    ]
+
+
+def _save(ranked, started_at, full):
+    with transaction.atomic():
+        stale = ProductRecommendation.objects.all()
+        if not full:
+            stale = stale.filter(product_id__in=list(ranked))
+        stale.delete()
+        ProductRecommendation.objects.bulk_create(recommendation_rows(ranked), batch_size=1000)
+        RecommendationBuild.objects.create(full=full, started_at=started_at, products=len(ranked))
+    return len(ranked)
+
+
+def build(k=DEFAULT_TOP_K, min_together=DEFAULT_MIN_TOGETHER, chunk_size=2000):
+    """Recompute every product's recommendations; returns how many products have some"""
+    started_at = timezone.now()
+    matrix = CoOccurrence()
+    for basket in baskets(counted_orders(), chunk_size):
+        matrix.add(basket)
+    ranked = {product_id: neighbours(matrix, product_id, k, min_together) for product_id in matrix.together}
+    return _save({product_id: entries for product_id, entries in ranked.items() if entries}, started_at, full=True)
+
+
+def update(k=DEFAULT_TOP_K, min_together=DEFAULT_MIN_TOGETHER, chunk_size=2000):
+    """Fold in the order lines written since the last run (a full build if
+    there was none); returns how many products' recommendations were rewritten"""
+    previous = RecommendationBuild.objects.order_by('-pk').first()
+    if previous is None:
+        return build(k, min_together, chunk_size)
+    started_at = timezone.now()
+    orders = counted_orders()
+    new_items = OrderItem.objects.filter(order__in=orders, added_at__gte=previous.started_at - RESCAN_MARGIN)
+    touched = set(new_items.values_list('product_id', flat=True))
+    if not touched:
+        return _save({}, started_at, full=False)
+
+    # Every order containing a touched product: exact rows for those products.
+    matrix = CoOccurrence()
+    history = orders.filter(Exists(OrderItem.objects.filter(order=OuterRef('pk'), product_id__in=touched)))
+    for basket in baskets(history, chunk_size):
+        matrix.add(basket)
+    ranked = {product_id: neighbours(matrix, product_id, k, min_together) for product_id in touched}
+
+    # Their neighbours' order counts are partial in ``matrix``; count them.
+    affected = {
+        related
+        for product_id in touched
+        for related, count in matrix.together[product_id].items()
+        if count >= min_together
+    } - touched
+    order_counts = dict(
+        OrderItem.objects.filter(order__in=orders, product_id__in=affected)
+        .values('product_id').annotate(orders=Count('order', distinct=True)).values_list('product_id', 'orders')
+    )
+    candidates = defaultdict(dict)
+    for row in ProductRecommendation.objects.filter(product_id__in=affected).exclude(related_id__in=touched):
+        candidates[row.product_id][row.related_id] = (row.score, row.together)
+    for product_id in affected:
+        for related in touched:
+            count = matrix.together[related].get(product_id, 0)
+            if count >= min_together:
+                score = similarity(count, order_counts[product_id], matrix.orders[related])
+                candidates[product_id][related] = (score, count)
+        ranked[product_id] = top(candidates[product_id], k)
+    return _save(ranked, started_at, full=False)
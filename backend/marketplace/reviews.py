@@ -0,0 +1,92 @@
+"""Product rating aggregates.
+
+Each product carries ``rating_count``, ``rating_sum``, ``rating_average``
+and a histogram of its reviews (``rating_1`` to ``rating_5``), so listings
+sort and filter by rating on an index instead of aggregating reviews per
+request. The review signals apply every create, edit and delete as a single
+UPDATE of F() deltas in the review's own transaction: concurrent reviews of
+one product add up instead of overwriting each other.
+
+Writes that skip the signals (raw SQL, ``bulk_create``, fixtures) leave the
+columns behind; ``repair`` recomputes them from the reviews.
+"""
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count, F, FloatField, Q, Sum, Value
+from django.db.models.functions import Cast, Coalesce, NullIf
+
+from .models import Product, ProductReview
+
+STARS = range(1, 6)
+RATING_FIELDS = Product.RATING_FIELDS
+
+
+def average(total, count):
+    return Coalesce(Cast(total, FloatField()) / NullIf(count, 0), Value(0.0))
+
+
+def add_rating(product_id, rating, count=1):
+    """Count one ``rating`` into the product's aggregates (``count=-1`` takes it out)"""
+    total = F('rating_sum') + rating * count
+    reviews = F('rating_count') + count
+    return Product.objects.filter(pk=product_id).update(
+        # Assigned first: MySQL evaluates SET left to right on updated values.
+        rating_average=average(total, reviews),
+        rating_count=reviews,
+        rating_sum=total,
+        **{f'rating_{rating}': F(f'rating_{rating}') + count},
+    )
+
+
+def histogram(product):
+    return {str(star): getattr(product, f'rating_{star}') for star in STARS}
+
+
+def aggregates(reviews):
+    """``{product id: {rating column: value}}`` computed from ``reviews``"""
+    rows = reviews.values('product').order_by().annotate(
+        rating_count=Count('id'),
+        rating_sum=Sum('rating'),
+        **{f'rating_{star}': Count('id', filter=Q(rating=star)) for star in STARS},
+    )
+    result = {}
+    for row in rows:
+        product_id = row.pop('product')
+        row['rating_average'] = row['rating_sum'] / row['rating_count']
+        result[product_id] = row
+    return result
+
+
+EMPTY = {name: 0 for name in RATING_FIELDS} | {'rating_average': 0.0}
+
+
+def repair(using=DEFAULT_DB_ALIAS, chunk_size=1000):
+    """Recompute every product's rating columns from its reviews.
+
+    Products are locked and fixed ``chunk_size`` at a time, each chunk in a
+    transaction of its own. A review written meanwhile waits for the lock,
+    and its delta then applies on top of the repaired values. Returns
+    ``(checked, fixed)``.
+    """
+    checked = fixed = 0
+    last_id = 0
+    while True:
+        with transaction.atomic(using=using):
+            products = list(
+                Product.objects.using(using).select_for_update()
+                .filter(pk__gt=last_id).order_by('pk').only('id', *RATING_FIELDS)[:chunk_size]
+            )
+            if not products:
+                break
+            last_id = products[-1].pk
+            actual = aggregates(ProductReview.objects.using(using).filter(product_id__in=[p.pk for p in products]))
+            stale = []
+            for product in products:
+                expected = actual.get(product.pk, EMPTY)
+                if any(getattr(product, name) != expected[name] for name in RATING_FIELDS):
+                    for name in RATING_FIELDS:
+                        setattr(product, name, expected[name])
+                    stale.append(product)
+            Product.objects.using(using).bulk_update(stale, RATING_FIELDS)
+        checked += len(products)
+        fixed += len(stale)
+    return checked, fixed
@@ -0,0 +1,130 @@
+"""Primary/replica database routing.
+
+``ReplicaRoutingMiddleware`` sends the reads of safe (GET/HEAD/OPTIONS)
+requests to DRF views, and of plain views marked with ``replica_reads``,
+to a replica in ``settings.DATABASE_REPLICAS``. Everything else, and every
+read inside a transaction, goes to the primary, so stock is never checked
+against a lagging copy when an order is placed.
+
+A user who has just written is *pinned* to the primary for
+``DATABASE_PIN_SECONDS`` (about the replication lag), so they read their
+own writes. Pins live in the cache named by ``DATABASE_PIN_CACHE``; as for
+the catalog cache, use a shared backend with several worker processes.
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.views import APIView
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+DEFAULT_PIN_SECONDS = 10
+DEFAULT_CACHE = 'default'
+PIN_KEY = 'db:pin:{}'
+
+# The replica this request's reads go to; None reads from the primary.
+read_database = ContextVar('read_database', default=None)
+
+
+def replica_reads(view):
+    """Let a plain (non-DRF) read-only view read from a replica"""
+    view.replica_reads = True
+    return view
+
+
+def get_cache():
+    return caches[getattr(settings, 'DATABASE_PIN_CACHE', DEFAULT_CACHE)]
+
+
+def pin(user_id):
+    """Read from the primary for the user's next requests"""
+    get_cache().set(PIN_KEY.format(user_id), True, getattr(settings, 'DATABASE_PIN_SECONDS', DEFAULT_PIN_SECONDS))
+
+
+def is_pinned(user_id):
+    return get_cache().get(PIN_KEY.format(user_id)) is not None
+
+
+def token_user_id(request):
+    """The user id claimed by the bearer token, unverified.
+
+    Only used to choose a database: a forged token can at worst send its
+    reads to the primary. Authentication proper happens in the view.
+    """
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if not header.startswith('Bearer '):
+        return None
+    try:
+        return AccessToken(header[len('Bearer '):], verify=False).get(jwt_settings.USER_ID_CLAIM)
+    except TokenError:
+        return None
+
+
+def wants_replica(view_func):
+    cls = getattr(view_func, 'cls', None)
+    if cls is not None and issubclass(cls, APIView):
+        return getattr(cls, 'replica_reads', True)
+    return getattr(view_func, 'replica_reads', False)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = read_database.get()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        databases = {DEFAULT_DB_ALIAS, *getattr(settings, 'DATABASE_REPLICAS', ())}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+def _routed(content, alias):
+    # Streamed bodies are generated after the middleware has returned.
+    token = read_database.set(alias)
+    try:
+        yield from content
+    finally:
+        read_database.reset(token)
+
+
+class ReplicaRoutingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = read_database.set(None)
+        try:
+            response = self.get_response(request)
+        finally:
+            read_database.reset(token)
+        alias = getattr(request, 'read_database', None)
+        if alias is not None and response.streaming and not response.is_async:
+            response.streaming_content = _routed(response.streaming_content, alias)
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated:
+                pin(user.pk)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        replicas = getattr(settings, 'DATABASE_REPLICAS', ())
+        if not replicas or request.method not in SAFE_METHODS or not wants_replica(view_func):
+            return None
+        user_id = token_user_id(request)
+        if user_id is not None and is_pinned(user_id):
+            return None
+        request.read_database = random.choice(replicas)
+        read_database.set(request.read_database)
+        return None
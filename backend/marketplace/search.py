@@ -0,0 +1,200 @@
+"""Full-text product search.
+
+Products are mirrored into an inverted index so search requests never scan
+the product table. SQLite uses an FTS5 virtual table, PostgreSQL a side table
+with a GIN-indexed tsvector. The backend is picked from the database vendor,
+or explicitly through ``settings.MARKETPLACE_SEARCH_BACKEND``.
+"""
+import re
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.module_loading import import_string
+
+FTS_TABLE = 'marketplace_product_fts'
+PG_TABLE = 'marketplace_product_search'
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    """Split a user query into lowercase search terms"""
+    return [token.lower() for token in TOKEN_RE.findall(query or '')]
+
+
+class BaseSearchBackend:
+    """Interface every product search backend implements"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def create_index(self):
+        raise NotImplementedError
+
+    def drop_index(self):
+        raise NotImplementedError
+
+    def index_product(self, product):
+        raise NotImplementedError
+
+    def remove_product(self, product_id):
+        raise NotImplementedError
+
+    def search(self, terms, category=None, limit=20, offset=0):
+        """Return ``[(product_id, rank), ...]`` best match first"""
+        raise NotImplementedError
+
+    def facets(self, terms):
+        """Return ``{category: match_count}`` for the query"""
+        raise NotImplementedError
+
+    def rebuild(self, queryset, chunk_size=1000):
+        self.drop_index()
+        self.create_index()
+        count = 0
+        for product in queryset.only('id', 'name', 'description', 'category').iterator(chunk_size=chunk_size):
+            self.index_product(product)
+            count += 1
+        return count
+
+
+class SQLiteFTSBackend(BaseSearchBackend):
+    """FTS5 index keyed by product id, ranked with BM25"""
+    # Column weights for bm25(): a hit in the name counts ten times as much
+    # as one in the description.
+    name_weight = 10.0
+    description_weight = 1.0
+
+    def create_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                "name, description, category UNINDEXED, "
+                "prefix='2 3', tokenize='unicode61 remove_diacritics 2')"
+            )
+
+    def drop_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+    def index_product(self, product):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product.pk])
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, description, category) VALUES (%s, %s, %s, %s)',
+                [product.pk, product.name, product.description, product.category],
+            )
+
+    def remove_product(self, product_id):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+
+    def match_expression(self, terms):
+        # Quote every term so FTS5 operators typed by users are treated as
+        # text, and make each one a prefix query.
+        return ' '.join('"%s"*' % term.replace('"', '""') for term in terms)
+
+    def search(self, terms, category=None, limit=20, offset=0):
+        sql = (
+            f'SELECT rowid, bm25({FTS_TABLE}, %s, %s) AS rank FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s'
+        )
+        params = [self.name_weight, self.description_weight, self.match_expression(terms)]
+        if category:
+            sql += ' AND category = %s'
+            params.append(category)
+        sql += ' ORDER BY rank LIMIT %s OFFSET %s'
+        params += [limit, offset]
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            # bm25() is negative with better matches lower; flip it so higher
+            # is better for API consumers.
+            return [(row[0], -row[1]) for row in cursor.fetchall()]
+
+    def facets(self, terms):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT category, COUNT(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s GROUP BY category',
+                [self.match_expression(terms)],
+            )
+            return dict(cursor.fetchall())
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """tsvector side table with a GIN index, ranked with ts_rank_cd"""
+    config = 'simple'
+
+    def create_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {PG_TABLE} ('
+                'product_id bigint PRIMARY KEY, '
+                'category varchar(2) NOT NULL, '
+                'document tsvector NOT NULL)'
+            )
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {PG_TABLE}_document_idx ON {PG_TABLE} USING GIN (document)')
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {PG_TABLE}_category_idx ON {PG_TABLE} (category)')
+
+    def drop_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {PG_TABLE}')
+
+    def index_product(self, product):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {PG_TABLE} (product_id, category, document) VALUES ('
+                '%s, %s, '
+                'setweight(to_tsvector(%s, %s), \'A\') || setweight(to_tsvector(%s, %s), \'B\')) '
+                'ON CONFLICT (product_id) DO UPDATE SET '
+                'category = EXCLUDED.category, document = EXCLUDED.document',
+                [product.pk, product.category, self.config, product.name, self.config, product.description],
+            )
+
+    def remove_product(self, product_id):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {PG_TABLE} WHERE product_id = %s', [product_id])
+
+    def tsquery(self, terms):
+        return ' & '.join("'%s':*" % term.replace("'", "''") for term in terms)
+
+    def search(self, terms, category=None, limit=20, offset=0):
+        sql = (
+            f'SELECT product_id, ts_rank_cd(document, query) AS rank '
+            f'FROM {PG_TABLE}, to_tsquery(%s, %s) query WHERE document @@ query'
+        )
+        params = [self.config, self.tsquery(terms)]
+        if category:
+            sql += ' AND category = %s'
+            params.append(category)
+        sql += ' ORDER BY rank DESC, product_id LIMIT %s OFFSET %s'
+        params += [limit, offset]
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def facets(self, terms):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT category, COUNT(*) FROM {PG_TABLE} '
+                'WHERE document @@ to_tsquery(%s, %s) GROUP BY category',
+                [self.config, self.tsquery(terms)],
+            )
+            return dict(cursor.fetchall())
+
+
+VENDOR_BACKENDS = {
+    'sqlite': SQLiteFTSBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_search_backend(using=None):
+    """Return the search backend for the given (or default) connection"""
+    conn = connections[using or DEFAULT_DB_ALIAS]
+    backend_path = getattr(settings, 'MARKETPLACE_SEARCH_BACKEND', None)
+    if backend_path:
+        return import_string(backend_path)(conn)
+    try:
+        return VENDOR_BACKENDS[conn.vendor](conn)
+    except KeyError:
+        raise NotImplementedError(f'No product search backend for database vendor {conn.vendor!r}')
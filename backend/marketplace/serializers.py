@@ -1,9 +1,15 @@
 from rest_framework import serializers
-from .models import FarmerProfile, Product
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import Exists, OuterRef, Prefetch, prefetch_related_objects
+from .images import ImageUrls
+from .models import FarmerCustomer, FarmerProfile, Product, ProductReview
+from . import reviews
 from django.contrib.auth.models import User
 from .models import Notification
 from django.contrib.contenttypes.models import ContentType
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.timesince import timesince
 from .models import Event
 
 class UserSerializer(serializers.ModelSerializer):
@@ -30,48 +36,167 @@ class FarmerProfileSerializer(serializers.ModelSerializer):
         return farmer_profile
     
 class ProductSerializer(serializers.ModelSerializer):
+    images = serializers.SerializerMethodField()
+    rating_histogram = serializers.SerializerMethodField()
+
     class Meta:
         model = Product
-        fields = '__all__'
+        exclude = ['image_hash', 'image_source', 'rating_sum', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5']
+
+    def get_images(self, obj):
+        """Resized JPEG/WebP variants of the photo, keyed by size then format"""
+        if not hasattr(self, '_image_urls'):
+            self._image_urls = ImageUrls(self.context.get('request'))
+        return self._image_urls.for_product(obj)
+
+    def get_rating_histogram(self, obj):
+        """Number of reviews per star rating, ``{"1": n, ..., "5": n}``"""
+        return reviews.histogram(obj)
+
+class ProductReviewSerializer(serializers.ModelSerializer):
+    username = serializers.CharField(source='user.username', read_only=True)
+
+    class Meta:
+        model = ProductReview
+        fields = ['id', 'product', 'user', 'username', 'rating', 'comment', 'created_at']
+        read_only_fields = ['product', 'user']
+
+    def validate(self, data):
+        # New reviews are for the ``product`` in the context, by the requester.
+        product, request = self.context.get('product'), self.context.get('request')
+        if self.instance is None and product is not None and request is not None:
+            if product.farmer.user_id == request.user.pk:
+                raise serializers.ValidationError('You cannot review your own product.')
+            if ProductReview.objects.filter(product=product, user=request.user).exists():
+                raise serializers.ValidationError('You have already reviewed this product.')
+        return data
 
 # serializers.py
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.exceptions import AuthenticationFailed as TokenAuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from . import authentication
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     @classmethod
     def get_token(cls, user):
-        token = super().get_token(user)
-        token['is_farmer'] = user.farmerprofile.exists()
-        return token
+        # Carries username, staff flags, is_farmer and farmer_id, read by
+        # ClaimsJWTAuthentication instead of loading the user per request.
+        return authentication.issue_token(user)
+
+class CustomTokenRefreshSerializer(TokenRefreshSerializer):
+    """Re-issue the pair from the current user so refreshed claims are fresh"""
+    token_class = authentication.ClaimsRefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        authentication.check(refresh)
+        try:
+            user = User.objects.get(pk=refresh[jwt_settings.USER_ID_CLAIM], is_active=True)
+        except User.DoesNotExist:
+            raise TokenAuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+        # Without the blacklist app, a rotated refresh token would otherwise
+        # stay usable until it expires.
+        authentication.revoke_token(refresh)
+        token = authentication.issue_token(user)
+        return {'access': str(token.access_token), 'refresh': str(token)}
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'first_name', 'last_name']
 
-# views.py
-from rest_framework_simplejwt.views import TokenObtainPairView
-
-class CustomTokenObtainPairView(TokenObtainPairView):
-    serializer_class = CustomTokenObtainPairSerializer
-
 # marketplace/serializers.py
 from rest_framework import serializers
-from .models import Order, OrderItem
+from . import inventory
+from .models import Order, OrderItem, Product
 
 class OrderItemSerializer(serializers.ModelSerializer):
+    # A plain id rather than a related field: products are looked up in one
+    # query for the whole order by inventory.place_orders, not one per line.
+    product = serializers.IntegerField(source='product_id')
+    quantity = serializers.IntegerField(min_value=1)
+
     class Meta:
         model = OrderItem
         fields = ['id', 'product', 'quantity', 'price']
+        read_only_fields = ['price']
+
+    def to_representation(self, instance):
+        """Inline a product summary when the view asked for ``expand=product``.
+
+        The view must have prefetched items with their products
+        (``Order.objects.with_items(products=True)``) so this adds no queries.
+        """
+        representation = super().to_representation(instance)
+        if self.context.get('expand_product'):
+            product = instance.product
+            representation['product_summary'] = {
+                'id': product.id,
+                'name': product.name,
+                'category': product.category,
+                'price': str(product.price),
+                'farmer': product.farmer_id,
+            }
+        return representation
+
+def _place(customer, carts):
+    lines = [[(item['product_id'], item['quantity']) for item in cart] for cart in carts]
+    try:
+        orders = inventory.place_orders(customer, lines)
+    except inventory.InsufficientStock as e:
+        raise serializers.ValidationError({'items': [f'Not enough stock for product {e.product_id}']})
+    except Product.DoesNotExist as e:
+        raise serializers.ValidationError({'items': [str(e)]})
+    # The response lists the items; load them for every order in one query.
+    prefetch_related_objects(orders, Prefetch('items', queryset=OrderItem.objects.order_by('id')))
+    return orders
+
+
+class OrderListSerializer(serializers.ListSerializer):
+    """Creates a whole list of orders (e.g. an imported purchase order) at once"""
+
+    def create(self, validated_data):
+        if not validated_data:
+            return []
+        return _place(validated_data[0]['customer'], [data['items'] for data in validated_data])
+
 
 class OrderSerializer(serializers.ModelSerializer):
-    items = OrderItemSerializer(many=True, read_only=True)
-    
+    """Orders are created with their items in one call; item prices are
+    snapshotted from the products and stock is held (see inventory.py)"""
+    items = OrderItemSerializer(many=True)
+
     class Meta:
         model = Order
-        fields = ['id', 'customer', 'created_at', 'status', 'items']
+        fields = ['id', 'customer', 'created_at', 'status', 'total', 'items']
+        read_only_fields = ['customer', 'total']
+        extra_kwargs = {'status': {'required': False}}
+        list_serializer_class = OrderListSerializer
+
+    def validate_items(self, items):
+        if not items:
+            raise serializers.ValidationError('An order needs at least one item')
+        return items
+
+    def create(self, validated_data):
+        # New orders always start out pending, holding their stock.
+        return _place(validated_data['customer'], [validated_data['items']])[0]
+
+    def update(self, instance, validated_data):
+        # Items are fixed once placed; status moves go through inventory so
+        # cancelling returns the held stock.
+        validated_data.pop('items', None)
+        new_status = validated_data.pop('status', instance.status)
+        if new_status != instance.status:
+            move = {Order.COMPLETED: inventory.complete_order, Order.CANCELLED: inventory.cancel_order}.get(new_status)
+            if move is None or not move(instance):
+                raise serializers.ValidationError({
+                    'status': f'A {instance.status.lower()} order cannot become {new_status.lower()}'
+                })
+        return super().update(instance, validated_data)
 
 
 
@@ -86,14 +211,17 @@ class NotificationSerializer(serializers.ModelSerializer):
         representation = super().to_representation(instance)
         
         # Add human-readable time
-        representation['time_ago'] = instance.created_at.timesince()
+        representation['time_ago'] = timesince(instance.created_at)
         
-        # Add related object information if available
-        if instance.related_object:
+        # Add related object information if available. List views resolve
+        # related objects in bulk (RelatedObjectQuerySet.with_related_objects),
+        # so this reads from the prefetch cache rather than querying per row.
+        related_object = instance.related_object
+        if related_object:
             representation['related_object'] = {
-                'id': instance.related_object.id,
+                'id': related_object.id,
                 'type': instance.related_content_type.model,
-                'display_name': str(instance.related_object)
+                'display_name': str(related_object)
             }
         
         return representation
@@ -125,6 +253,71 @@ class NotificationCreateSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
     
 
+class NotificationFanOutSerializer(serializers.Serializer):
+    """One message for many recipients; see ``notifications.fan_out``"""
+    AUDIENCES = (
+        ('customers', "All of the farmer's past customers"),
+        ('product_customers', 'Past buyers of one product'),
+        ('users', 'Explicit user ids (staff only)'),
+    )
+
+    message = serializers.CharField()
+    notification_type = serializers.ChoiceField(choices=Notification.NOTIFICATION_TYPES)
+    audience = serializers.ChoiceField(choices=AUDIENCES)
+    product = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all(), required=False)
+    user_ids = serializers.ListField(child=serializers.IntegerField(), required=False)
+    related_content_type = serializers.PrimaryKeyRelatedField(queryset=ContentType.objects.all(), required=False)
+    related_object_id = serializers.IntegerField(required=False)
+    batch_size = serializers.IntegerField(required=False, min_value=1, max_value=10000)
+
+    def validate(self, data):
+        """Resolve the audience to a recipient queryset and the related object once"""
+        user = self.context['request'].user
+        farmer = getattr(user, 'farmerprofile', None)
+        audience = data['audience']
+
+        if audience == 'users':
+            if not user.is_staff:
+                raise serializers.ValidationError({'audience': 'Only staff can notify arbitrary users'})
+            data['recipients'] = User.objects.filter(pk__in=data.get('user_ids', []))
+        elif farmer is None:
+            raise serializers.ValidationError({'audience': 'Only farmers can notify their customers'})
+        elif audience == 'customers':
+            data['recipients'] = User.objects.filter(
+                pk__in=FarmerCustomer.objects.filter(farmer=farmer).values('customer')
+            )
+        else:
+            product = data.get('product')
+            if product is None or product.farmer_id != farmer.pk:
+                raise serializers.ValidationError({'product': 'One of your products is required'})
+            data['recipients'] = User.objects.filter(
+                Exists(OrderItem.objects.filter(order__customer=OuterRef('pk'), product=product))
+            )
+
+        if 'related_object_id' in data and 'related_content_type' in data:
+            try:
+                content_type = data['related_content_type']
+                data['related_object'] = content_type.get_object_for_this_type(pk=data['related_object_id'])
+            except ObjectDoesNotExist:
+                raise serializers.ValidationError({
+                    'related_object': 'Related object not found'
+                })
+        return data
+
+
+def humanize_duration(duration):
+    total_seconds = duration.total_seconds()
+
+    if total_seconds < 60:
+        return f"{int(total_seconds)} seconds"
+    elif total_seconds < 3600:
+        return f"{int(total_seconds // 60)} minutes"
+    elif total_seconds < 86400:
+        return f"{int(total_seconds // 3600)} hours"
+    else:
+        return f"{int(total_seconds // 86400)} days"
+
+
 class EventSerializer(serializers.ModelSerializer):
     user = serializers.PrimaryKeyRelatedField(
         queryset=User.objects.all(), 
@@ -151,12 +344,15 @@ class EventSerializer(serializers.ModelSerializer):
             'related_content_type',
             'related_object_id',
             'related_object_details',
+            'recurrence',
+            'exception_dates',
+            'recurrence_end',
             'duration',
             'is_past',
             'created_at',
             'updated_at'
         ]
-        read_only_fields = ['created_at', 'updated_at']
+        read_only_fields = ['recurrence_end', 'created_at', 'updated_at']
 
     def get_user_details(self, obj):
         return {
@@ -166,28 +362,19 @@ class EventSerializer(serializers.ModelSerializer):
         }
 
     def get_related_object_details(self, obj):
-        if not obj.related_object:
+        related_object = obj.related_object
+        if not related_object:
             return None
         return {
-            'id': obj.related_object.id,
+            'id': related_object.id,
             'type': obj.related_content_type.model,
-            'display_name': str(obj.related_object)
+            'display_name': str(related_object)
         }
 
     def get_duration(self, obj):
         if not obj.end:
             return None
-        duration = obj.end - obj.start
-        total_seconds = duration.total_seconds()
-        
-        if total_seconds < 60:
-            return f"{int(total_seconds)} seconds"
-        elif total_seconds < 3600:
-            return f"{int(total_seconds // 60)} minutes"
-        elif total_seconds < 86400:
-            return f"{int(total_seconds // 3600)} hours"
-        else:
-            return f"{int(total_seconds // 86400)} days"
+        return humanize_duration(obj.end - obj.start)
 
     def get_is_past(self, obj):
         return obj.end < timezone.now()
@@ -200,6 +387,27 @@ class EventSerializer(serializers.ModelSerializer):
                 'end': 'End time must be after start time'
             })
 
+        # Validate the recurrence rule against the (possibly updated) start
+        recurrence = data.get('recurrence', getattr(self.instance, 'recurrence', ''))
+        if recurrence:
+            start = data.get('start', getattr(self.instance, 'start', None))
+            try:
+                Event(start=start, recurrence=recurrence).check_recurrence()
+            except (ValueError, TypeError) as e:
+                raise serializers.ValidationError({'recurrence': f'Invalid recurrence rule: {e}'})
+
+        # Normalize exception dates to aware ISO datetimes
+        if 'exception_dates' in data:
+            exception_dates = []
+            for value in data['exception_dates'] or []:
+                moment = parse_datetime(value) if isinstance(value, str) else None
+                if moment is None:
+                    raise serializers.ValidationError({'exception_dates': f'Invalid datetime: {value}'})
+                if timezone.is_naive(moment):
+                    moment = timezone.make_aware(moment)
+                exception_dates.append(moment.isoformat())
+            data['exception_dates'] = exception_dates
+
         # Validate related object exists if specified
         if 'related_object_id' in data and 'related_content_type' in data:
             try:
@@ -223,6 +431,7 @@ class EventSerializer(serializers.ModelSerializer):
 class EventCalendarSerializer(serializers.ModelSerializer):
     """Simplified serializer for calendar views"""
     color = serializers.SerializerMethodField()
+    recurring = serializers.SerializerMethodField()
 
     class Meta:
         model = Event
@@ -233,9 +442,13 @@ class EventCalendarSerializer(serializers.ModelSerializer):
             'end',
             'all_day',
             'event_type',
-            'color'
+            'color',
+            'recurring'
         ]
 
+    def get_recurring(self, obj):
+        return bool(obj.recurrence)
+
     def get_color(self, obj):
         """Assign colors based on event type"""
         color_map = {
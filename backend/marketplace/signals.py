@@ -0,0 +1,226 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .analytics import order_day, schedule_refresh
+from .authentication import USER_CLAIMS, claims_changed, revoke_user
+from .caching import bump_on_commit, farmer_scopes, product_scopes
+from .geo import locate
+from .images import needs_derivatives, refresh_product_images
+from .models import FarmerProfile, Notification, Order, OrderItem, Product, ProductReview
+from .notifications import adjust_unread, invalidate_unread, notifications_created
+from .realtime import publish_notification
+from .reviews import add_rating
+from .search import get_search_backend
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, using, raw=False, **kwargs):
+    """Keep the full-text index in step with product edits"""
+    if raw:
+        return
+    get_search_backend(using).index_product(instance)
+
+
+@receiver(post_save, sender=Product)
+def build_product_images(sender, instance, raw=False, **kwargs):
+    """Render resized derivatives of a new or replaced photo after commit"""
+    if raw or not needs_derivatives(instance):
+        return
+    transaction.on_commit(lambda: refresh_product_images(instance))
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, using, **kwargs):
+    get_search_backend(using).remove_product(instance.pk)
+
+
+@receiver(pre_save, sender=Product)
+def remember_catalog_scopes(sender, instance, raw=False, **kwargs):
+    """Note where the product was listed before, in case it moves category or farmer"""
+    if raw or instance.pk is None:
+        return
+    instance._previous_scopes = [
+        scope
+        for category, farmer_id in Product.objects.filter(pk=instance.pk).values_list('category', 'farmer_id')
+        for scope in product_scopes(instance.pk, category, farmer_id)
+    ]
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_responses(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    scopes = product_scopes(instance.pk, instance.category, instance.farmer_id)
+    bump_on_commit(scopes + getattr(instance, '_previous_scopes', []))
+
+
+def invalidate_product(product_id):
+    bump_on_commit(
+        scope
+        for category, farmer_id in Product.objects.filter(pk=product_id).values_list('category', 'farmer_id')
+        for scope in product_scopes(product_id, category, farmer_id)
+    )
+
+
+@receiver(pre_save, sender=ProductReview)
+def remember_rating(sender, instance, raw=False, **kwargs):
+    """Note the rating an edit replaces, to take it out of the aggregates"""
+    if raw or instance.pk is None:
+        return
+    instance._previous_rating = ProductReview.objects.filter(pk=instance.pk).values_list('product_id', 'rating').first()
+
+
+@receiver(post_save, sender=ProductReview)
+def count_rating(sender, instance, created, raw=False, **kwargs):
+    """Keep the product's rating aggregates in step with its reviews"""
+    if raw:
+        return
+    previous = None if created else getattr(instance, '_previous_rating', None)
+    current = (instance.product_id, instance.rating)
+    if previous == current:
+        return
+    if previous is not None:
+        add_rating(*previous, count=-1)
+        if previous[0] != instance.product_id:
+            invalidate_product(previous[0])
+    add_rating(*current)
+    invalidate_product(instance.product_id)
+
+
+@receiver(post_delete, sender=ProductReview)
+def uncount_rating(sender, instance, **kwargs):
+    add_rating(instance.product_id, instance.rating, count=-1)
+    invalidate_product(instance.product_id)
+
+
+@receiver(pre_save, sender=FarmerProfile)
+def locate_farm(sender, instance, raw=False, **kwargs):
+    """Geocode the farm unless coordinates were given, and again when it moves"""
+    if raw:
+        return
+    moved = False
+    if instance.pk is not None:
+        previous = FarmerProfile.objects.filter(pk=instance.pk).values_list('location', 'latitude', 'longitude').first()
+        # A new location with the old coordinates means those are stale.
+        moved = (
+            previous is not None and previous[0] != instance.location
+            and previous[1:] == (instance.latitude, instance.longitude)
+        )
+    locate(instance, moved=moved)
+
+
+@receiver(post_save, sender=FarmerProfile)
+@receiver(post_delete, sender=FarmerProfile)
+def invalidate_farmer_responses(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    bump_on_commit(farmer_scopes(instance.pk))
+
+
+@receiver(post_save, sender=User)
+def invalidate_farmer_user(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Farmer responses embed the user's name and email"""
+    if raw or (update_fields and set(update_fields) <= {'last_login', 'password'}):
+        return
+    farmer_ids = FarmerProfile.objects.filter(user=instance).values_list('pk', flat=True)
+    bump_on_commit(scope for farmer_id in farmer_ids for scope in farmer_scopes(farmer_id))
+
+
+@receiver(pre_save, sender=User)
+def revoke_tokens_on_account_change(sender, instance, raw=False, update_fields=None, **kwargs):
+    """A new password or deactivation revokes the user's tokens; new
+    usernames or staff flags make their claims stale"""
+    watched = {'password', 'is_active', *USER_CLAIMS}
+    if update_fields is not None:
+        watched &= set(update_fields)
+    if raw or instance.pk is None or not watched:
+        return
+    previous = User.objects.filter(pk=instance.pk).values(*watched).first()
+    if previous is None:
+        return
+    changed = {name for name in watched if previous[name] != getattr(instance, name)}
+    if 'password' in changed or ('is_active' in changed and not instance.is_active):
+        transaction.on_commit(lambda: revoke_user(instance.pk))
+    elif changed & set(USER_CLAIMS):
+        transaction.on_commit(lambda: claims_changed(instance.pk))
+
+
+@receiver(post_save, sender=FarmerProfile)
+@receiver(post_delete, sender=FarmerProfile)
+def refresh_farmer_claims(sender, instance, raw=False, created=True, **kwargs):
+    """Tokens carry the farmer id; a new or deleted profile makes them stale"""
+    if raw or not created:
+        return
+    user_id = instance.user_id
+    transaction.on_commit(lambda: claims_changed(user_id))
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def update_order_total(sender, instance, raw=False, **kwargs):
+    """Keep Order.total consistent whenever one of its items changes"""
+    if raw:
+        return
+    Order.update_totals([instance.order_id])
+
+
+@receiver(post_save, sender=Order)
+def refresh_order_rollups(sender, instance, created, raw=False, **kwargs):
+    """Status changes move an order's sales between rollup buckets"""
+    if raw or created:
+        return
+    farmer_ids = set(
+        OrderItem.objects.filter(order=instance).values_list('product__farmer_id', flat=True)
+    )
+    if farmer_ids:
+        schedule_refresh(order_day(instance), farmer_ids)
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def refresh_item_rollups(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    try:
+        order, product = instance.order, instance.product
+    except (Order.DoesNotExist, Product.DoesNotExist):
+        # Cascading from a deleted product; nothing left to attribute.
+        return
+    schedule_refresh(order_day(order), {product.farmer_id})
+
+
+@receiver(post_save, sender=Notification)
+def count_new_notification(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    # Counters move on commit: a rolled back write must not reach the badge.
+    if created:
+        def counted():
+            adjust_unread(instance.user_id, 0 if instance.read else 1)
+            publish_notification(instance)
+        transaction.on_commit(counted)
+    else:
+        # The previous read state is unknown here, so recount lazily.
+        transaction.on_commit(lambda: invalidate_unread([instance.user_id]))
+
+
+@receiver(post_delete, sender=Notification)
+def uncount_deleted_notification(sender, instance, **kwargs):
+    if not instance.read:
+        transaction.on_commit(lambda: adjust_unread(instance.user_id, -1))
+
+
+@receiver(notifications_created)
+def count_bulk_notifications(sender, notifications, **kwargs):
+    invalidate_unread(notification.user_id for notification in notifications)
+
+
+@receiver(notifications_created)
+def push_bulk_notifications(sender, notifications, **kwargs):
+    def publish():
+        for notification in notifications:
+            publish_notification(notification)
+    transaction.on_commit(publish)
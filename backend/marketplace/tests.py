@@ -1,3 +1,1491 @@
-from django.test import TestCase
+import copy
+import csv
+import datetime
+import gzip
+import io
+import itertools
+import json
+import random
+import tempfile
+from unittest import mock
+from decimal import Decimal
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.db.models import F, QuerySet
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import authentication, benchmarks, caching, geo, ical, images, inventory, metrics, notifications, realtime, recommendations, reviews, routers
+from .management.commands.stress_checkout import checkout_stress
+from .views import EventViewSet, FarmerOrders, FarmerProducts, OrderViewSet, ProductList
+from .models import Event, FarmerProfile, Notification, Order, OrderItem, Product, ProductRecommendation, ProductReview, RecommendationBuild
+from .pagination import ProductCursorPagination
+
+
+def make_farmer(username, **kwargs):
+    user = User.objects.create_user(username=username, password='pass')
+    defaults = {'farm_name': f'{username} farm', 'location': 'Accra', 'contact_number': '0200000000'}
+    defaults.update(kwargs)
+    return FarmerProfile.objects.create(user=user, **defaults)
+
+
+def make_product(farmer, **kwargs):
+    defaults = {
+        'name': 'Tomatoes',
+        'description': 'Fresh tomatoes',
+        'price': Decimal('2.50'),
+        'category': 'VG',
+        'quantity': 100,
+        'image': 'products/tomatoes.jpg',
+        'harvest_date': datetime.date(2025, 1, 1),
+        'expiry_date': datetime.date(2099, 1, 1),
+    }
+    defaults.update(kwargs)
+    return Product.objects.create(farmer=farmer, **defaults)
+
+
+def make_order(customer, products, status=Order.PENDING):
+    order = Order.objects.create(customer=customer, status=status)
+    for product in products:
+        OrderItem.objects.create(order=order, product=product, quantity=2, price=product.price)
+    return order
+
+
+class QueryCountTests(TestCase):
+    """List endpoints must cost a constant number of queries per page"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.farmer = make_farmer('farmer')
+        cls.other_farmer = make_farmer('other')
+        cls.customer = User.objects.create_user(username='customer', password='pass')
+        products = [make_product(cls.farmer, name=f'Product {i}') for i in range(3)]
+        other = make_product(cls.other_farmer, name='Other product')
+        for _ in range(12):
+            make_order(cls.customer, products + [other])
+
+    def count_queries(self, user, url):
+        client = APIClient()
+        client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(queries)
+
+    def assertConstantQueries(self, user, url):
+        separator = '&' if '?' in url else '?'
+        small = self.count_queries(user, f'{url}{separator}page_size=2')
+        large = self.count_queries(user, f'{url}{separator}page_size=10')
+        self.assertEqual(small, large, f'{url} query count grows with page size')
+        return large
+
+    def test_product_list(self):
+        self.assertConstantQueries(self.customer, '/api/products/')
+
+    def test_order_list(self):
+        self.assertLessEqual(self.assertConstantQueries(self.customer, '/api/orders/'), 2)
+
+    def test_order_list_with_product_summary(self):
+        self.assertLessEqual(self.assertConstantQueries(self.customer, '/api/orders/?expand=product'), 2)
+
+    def test_farmer_orders(self):
+        self.assertLessEqual(self.assertConstantQueries(self.farmer.user, '/api/farmer/orders/'), 3)
+
+    def test_farmer_orders_with_product_summary(self):
+        self.assertLessEqual(
+            self.assertConstantQueries(self.farmer.user, '/api/farmer/orders/?expand=product'), 3
+        )
+
+    def test_recent_orders(self):
+        self.assertLessEqual(self.count_queries(self.customer, '/api/orders/recent/?expand=product'), 3)
+        self.assertLessEqual(self.count_queries(self.farmer.user, '/api/orders/recent/?expand=product'), 3)
+
+    def add_related_rows(self, count):
+        orders, products = list(Order.objects.all()), list(Product.objects.all())
+        now = timezone.now()
+        for i in range(count):
+            target = orders[i % len(orders)] if i % 2 else products[i % len(products)]
+            Notification.objects.create(
+                user=self.customer, message=f'Update {i}', notification_type='order', related_object=target
+            )
+            Event.objects.create(
+                user=self.customer, title=f'Delivery {i}', event_type='delivery', related_object=target,
+                start=now, end=now + datetime.timedelta(hours=1),
+            )
+
+    def test_generic_related_objects_resolved_in_bulk(self):
+        for url in ('/api/notifications/', '/api/calendar/events/'):
+            with self.subTest(url=url):
+                Notification.objects.all().delete()
+                Event.objects.all().delete()
+                self.add_related_rows(4)
+                small = self.count_queries(self.customer, url)
+                self.add_related_rows(40)
+                large = self.count_queries(self.customer, url)
+                self.assertEqual(small, large, f'{url} query count grows with feed size')
+                # The page itself plus one query per related model (order, product).
+                self.assertLessEqual(large, 3)
+
+    def test_related_object_filter(self):
+        self.add_related_rows(10)
+        order = Notification.objects.filter(related_content_type__model='order').first().related_object
+        client = APIClient()
+        client.force_authenticate(self.customer)
+        response = client.get(f'/api/notifications/?related_type=order&related_id={order.pk}')
+        self.assertTrue(response.json())
+        for notification in response.json():
+            self.assertEqual(notification['related_object']['type'], 'order')
+            self.assertEqual(notification['related_object']['id'], order.pk)
+
+    def test_farmer_orders_lists_each_order_once(self):
+        client = APIClient()
+        client.force_authenticate(self.farmer.user)
+        response = client.get('/api/farmer/orders/?expand=product')
+        ids = [order['id'] for order in response.json()]
+        self.assertEqual(len(ids), 12)
+        self.assertEqual(len(set(ids)), 12)
+        summary = response.json()[0]['items'][0]['product_summary']
+        self.assertEqual(set(summary), {'id', 'name', 'category', 'price', 'farmer'})
+
+
+class ProductFilterTests(TestCase):
+    def setUp(self):
+        caches['catalog'].clear()
+        self.farmer = make_farmer('grower')
+        self.other = make_farmer('neighbour')
+        today = timezone.localdate()
+        make_product(self.farmer, name='Tomatoes', category='VG', price=Decimal('2.50'), image='')
+        make_product(self.farmer, name='Mangoes', category='FR', price=Decimal('6.00'), image='')
+        make_product(self.farmer, name='Maize', category='GR', price=Decimal('1.00'), quantity=0, image='')
+        make_product(self.other, name='Milk', category='DA', price=Decimal('4.00'), image='',
+                     expiry_date=today - datetime.timedelta(days=1))
+
+    def names(self, query):
+        response = self.client.get(f'/api/products/?{query}')
+        self.assertEqual(response.status_code, 200, response.content)
+        return sorted(product['name'] for product in response.json()['results'])
+
+    def test_filters(self):
+        self.assertEqual(self.names('category=VG'), ['Tomatoes'])
+        self.assertEqual(self.names('category=VG,FR'), ['Mangoes', 'Tomatoes'])
+        self.assertEqual(self.names('min_price=2.50&max_price=4&fresh=0'), ['Milk', 'Tomatoes'])
+        self.assertEqual(self.names(f'farmer={self.other.pk}&fresh=0'), ['Milk'])
+        self.assertEqual(self.names('in_stock=true&fresh=no'), ['Mangoes', 'Milk', 'Tomatoes'])
+        self.assertEqual(self.names('fresh=1'), ['Maize', 'Mangoes', 'Tomatoes'])
+        self.assertEqual(self.names('in_stock=1&fresh=1&category=VG,GR,DA'), ['Tomatoes'])
+        self.assertEqual(self.names('in_stock=no&fresh=0'), ['Maize', 'Mangoes', 'Milk', 'Tomatoes'])
+
+    def test_expired_stock_is_hidden_by_default(self):
+        self.assertEqual(self.names(''), ['Maize', 'Mangoes', 'Tomatoes'])
+        self.assertEqual(self.names(f'farmer={self.other.pk}'), [])
+
+    def test_plain_list_returns_one_page(self):
+        for i in range(25):
+            make_product(self.other, name=f'Okra {i}', image='')
+        data = self.client.get('/api/products/').json()
+        self.assertEqual(len(data['results']), ProductCursorPagination.page_size)
+        self.assertIsNotNone(data['next'])
+        self.assertIsNone(data['previous'])
+
+    def test_bad_parameters_are_rejected(self):
+        for query, field in [('category=XX', 'category'), ('min_price=cheap', 'min_price'),
+                             ('max_price=1e', 'max_price'), ('farmer=me', 'farmer')]:
+            response = self.client.get(f'/api/products/?{query}')
+            self.assertEqual(response.status_code, 400, query)
+            self.assertIn(field, response.json())
+
+    def test_cursor_pages_are_stable_under_a_filter(self):
+        for i in range(5):
+            make_product(self.other, name=f'Okra {i}', category='VG', image='')
+        expected = list(
+            Product.objects.filter(category='VG').order_by('-created_at', '-id').values_list('name', flat=True)
+        )
+        seen, url = [], '/api/products/?category=VG&page_size=2'
+        while url:
+            page = self.client.get(url).json()
+            seen.extend(product['name'] for product in page['results'])
+            if len(seen) == 2:
+                # A listing added mid-way sorts before the cursor.
+                with self.captureOnCommitCallbacks(execute=True):
+                    make_product(self.farmer, name='Late okra', category='VG', image='')
+            url = page['next']
+        self.assertEqual(seen, expected)
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        farmer = make_farmer('grower')
+        self.tomatoes = make_product(farmer, name='Roma tomatoes', description='Plum variety', image='')
+        self.salsa = make_product(farmer, name='Salsa kit', category='VG', image='',
+                                  description='Peppers, onions and ripe tomatoes')
+        self.juice = make_product(farmer, name='Tomato juice', category='FR', description='Pressed daily', image='')
+        make_product(farmer, name='Mangoes', category='FR', description='Sweet', image='')
+
+    def search(self, query):
+        response = self.client.get(f'/api/products/search/?{query}')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_prefix_matching_ranking_and_facets(self):
+        data = self.search('q=tomat')
+        names = [product['name'] for product in data['results']]
+        # Name hits outrank the description-only one.
+        self.assertEqual(set(names[:2]), {'Roma tomatoes', 'Tomato juice'})
+        self.assertEqual(names[2], 'Salsa kit')
+        self.assertGreater(data['results'][0]['rank'], data['results'][2]['rank'])
+        self.assertEqual((data['count'], data['facets']), (3, {'VG': 2, 'FR': 1}))
+
+        data = self.search('q=tomat&category=FR')
+        self.assertEqual([product['name'] for product in data['results']], ['Tomato juice'])
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(self.search('q=roma tom')['count'], 1)
+        self.assertEqual(self.search('q=')['results'], [])
+        self.assertEqual(self.search('q="OR tomat*')['count'], 0)
+
+    def test_limit_and_offset_are_clamped(self):
+        self.assertEqual(len(self.search('q=tomat&limit=-1')['results']), 1)
+        self.assertEqual(len(self.search('q=tomat&limit=2&offset=-5')['results']), 2)
+        self.assertEqual(len(self.search('q=tomat&limit=2&offset=2')['results']), 1)
+        self.assertEqual(self.client.get('/api/products/search/?q=tomat&limit=all').status_code, 400)
+
+    def test_index_follows_product_saves_and_deletes(self):
+        self.juice.name = 'Mango juice'
+        self.juice.save()
+        self.assertEqual(self.search('q=tomat')['count'], 2)
+        self.assertEqual([p['name'] for p in self.search('q=mango juice')['results']], ['Mango juice'])
+        self.tomatoes.delete()
+        self.assertEqual([p['name'] for p in self.search('q=tomat')['results']], ['Salsa kit'])
+
+
+@override_settings(NOTIFICATION_FANOUT_EAGER=True)
+class NotificationFanOutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.farmer = make_farmer('farmer')
+        cls.product = make_product(cls.farmer)
+        cls.customers = [User.objects.create_user(username=f'customer{i}') for i in range(7)]
+        with cls.captureOnCommitCallbacks(execute=True):
+            for customer in cls.customers:
+                make_order(customer, [cls.product])
+
+    def test_fan_out_to_past_customers_in_batches(self):
+        client = APIClient()
+        client.force_authenticate(self.farmer.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post('/api/notifications/fan-out/', {
+                'message': 'New harvest available',
+                'notification_type': 'product',
+                'audience': 'product_customers',
+                'product': self.product.pk,
+                'related_content_type': ContentType.objects.get_for_model(Product).pk,
+                'related_object_id': self.product.pk,
+                'batch_size': 3,
+            }, format='json')
+        self.assertEqual(response.status_code, 202, response.content)
+        job = response.json()
+        self.assertEqual(job['status'], 'completed')
+        self.assertEqual(job['created'], 7)
+        self.assertEqual([batch['rows'] for batch in job['batches']], [3, 3, 1])
+        # The related product is looked up once, not once per recipient.
+        product_lookups = [q for q in queries if 'FROM "marketplace_product"' in q['sql']]
+        self.assertLessEqual(len(product_lookups), 2)
+        self.assertEqual(
+            Notification.objects.filter(related_object_id=self.product.pk, notification_type='product').count(), 7
+        )
+
+        status_response = client.get(f"/api/notifications/fan-out/{job['id']}/")
+        self.assertEqual(status_response.json()['created'], 7)
+
+    def test_customers_audience_requires_farmer(self):
+        client = APIClient()
+        client.force_authenticate(self.customers[0])
+        response = client.post('/api/notifications/fan-out/', {
+            'message': 'Hi', 'notification_type': 'system', 'audience': 'customers',
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class UnreadCountTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='reader')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.notifications = [
+            Notification.objects.create(user=self.user, message=f'Note {i}', notification_type='system')
+            for i in range(5)
+        ]
+
+    def unread(self):
+        return self.client.get('/api/notifications/unread-count/').json()['unread_count']
+
+    def test_unread_count_is_served_from_cache(self):
+        self.assertEqual(self.unread(), 5)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.unread(), 5)
+        self.assertFalse([q for q in queries if 'marketplace_notification' in q['sql']])
+
+    def test_counter_follows_creates_and_reads(self):
+        self.assertEqual(self.unread(), 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.create(user=self.user, message='New', notification_type='order')
+        self.assertEqual(self.unread(), 6)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/notifications/{self.notifications[0].pk}/', {'read': True})
+        self.assertEqual(self.unread(), 5)
+
+        response = self.client.post('/api/notifications/mark-read/', {
+            'ids': [n.pk for n in self.notifications[:3]],
+        }, format='json')
+        self.assertEqual(response.json(), {'updated': 2, 'unread_count': 3})
+
+        response = self.client.post('/api/notifications/mark-all-read/')
+        self.assertEqual(response.json()['updated'], 3)
+        self.assertEqual(self.unread(), 0)
+        self.assertFalse(Notification.objects.filter(user=self.user, read=False).exists())
+
+    def test_rolled_back_writes_leave_the_counter_alone(self):
+        self.assertEqual(self.unread(), 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    Notification.objects.create(user=self.user, message='Lost', notification_type='order')
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(self.unread(), 5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.notifications[1].delete()
+        self.assertEqual(self.unread(), 4)
+
+    def test_mark_all_read_keeps_a_notification_created_meanwhile(self):
+        self.assertEqual(self.unread(), 5)
+        update = QuerySet.update
+
+        def update_then_notify(queryset, **kwargs):
+            updated = update(queryset, **kwargs)
+            if queryset.model is Notification:
+                Notification.objects.create(user=self.user, message='Late', notification_type='order')
+            return updated
+
+        with mock.patch.object(QuerySet, 'update', update_then_notify):
+            self.assertEqual(notifications.mark_read(self.user), 5)
+        self.assertEqual(self.unread(), 1)
+
+
+class NotificationStreamTests(SimpleTestCase):
+    def setUp(self):
+        realtime.metrics.reset()
+
+    async def test_stream_endpoint(self):
+        async def fake_stream(user_id):
+            yield f'subscribed {user_id}'
+
+        token = AccessToken.for_user(User(pk=42, username='listener'))
+        with mock.patch.object(realtime, 'event_stream', fake_stream):
+            response = await AsyncClient().get(f'/api/notifications/stream/?token={token}')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            self.assertEqual([chunk async for chunk in response.streaming_content], [b'subscribed 42'])
+
+    async def test_stream_pushes_published_notifications(self):
+        stream = realtime.event_stream(42)
+        self.assertIn('retry:', await anext(stream))
+        self.assertEqual(realtime.metrics.snapshot()['active_connections'], 1)
+
+        realtime.publish_notification(Notification(
+            id=7, user_id=42, message='Order shipped', notification_type='order', created_at=timezone.now(),
+        ))
+        realtime.publish_notification(Notification(
+            id=8, user_id=43, message='Not for this user', notification_type='order', created_at=timezone.now(),
+        ))
+        frame = await anext(stream)
+        self.assertTrue(frame.startswith('event: notification\n'))
+        self.assertEqual(json.loads(frame.split('data: ', 1)[1])['id'], 7)
+
+        await stream.aclose()
+        snapshot = realtime.metrics.snapshot()
+        self.assertEqual(snapshot['active_connections'], 0)
+        self.assertEqual(snapshot['messages_sent'], 1)
+
+    async def test_stream_requires_token(self):
+        response = await AsyncClient().get('/api/notifications/stream/?token=bogus')
+        self.assertEqual(response.status_code, 401)
+
+
+class CalendarFeedTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='grower')
+        now = timezone.now()
+        self.event = Event.objects.create(
+            user=self.user, title='Market day', event_type='market', location='Makola',
+            description='Bring crates', start=now + datetime.timedelta(days=1),
+            end=now + datetime.timedelta(days=1, hours=4),
+        )
+        Event.objects.create(
+            user=self.user, title='Old harvest', start=now - datetime.timedelta(days=90),
+            end=now - datetime.timedelta(days=89),
+        )
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.url = client.get('/api/calendar/feed/').json()['url']
+
+    def fetch(self, **headers):
+        response = self.client.get(self.url, headers=headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body.decode()
+
+    def test_feed_contains_window_and_details(self):
+        response, body = self.fetch()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(body.startswith('BEGIN:VCALENDAR'))
+        self.assertIn(f'UID:event-{self.event.pk}@farmdirect', body)
+        self.assertIn('LOCATION:Makola', body)
+        self.assertIn('DESCRIPTION:Bring crates', body)
+        self.assertNotIn('Old harvest', body)
+
+    def test_series_emitted_once_with_rrule(self):
+        start = timezone.now() - datetime.timedelta(days=400)
+        Event.objects.create(
+            user=self.user, title='Weekly pickup', start=start, end=start + datetime.timedelta(hours=1),
+            recurrence='FREQ=WEEKLY;BYDAY=MO', exception_dates=[start.isoformat()],
+        )
+        _, body = self.fetch()
+        self.assertEqual(body.count('Weekly pickup'), 1)
+        self.assertIn('RRULE:FREQ=WEEKLY;BYDAY=MO', body)
+        self.assertIn('EXDATE', body)
+
+    def test_conditional_get(self):
+        response, _ = self.fetch()
+        self.assertEqual(self.fetch(**{'If-None-Match': response['ETag']})[0].status_code, 304)
+        self.assertNotIn('Last-Modified', response)
+
+        self.event.title = 'Market day (moved)'
+        self.event.save()
+        changed, body = self.fetch(**{'If-None-Match': response['ETag']})
+        self.assertEqual(changed.status_code, 200)
+        self.assertIn('Market day (moved)', body)
+
+        self.event.delete()
+        deleted, body = self.fetch(**{'If-None-Match': changed['ETag']})
+        self.assertEqual(deleted.status_code, 200)
+        self.assertNotIn('Market day', body)
+
+    def test_invalid_token(self):
+        self.assertEqual(self.client.get('/api/calendar/feed/bogus.ics').status_code, 404)
+
+    def test_tokens_expire_and_are_revoked_by_a_password_change(self):
+        self.assertEqual(self.fetch()[0].status_code, 200)
+        with mock.patch.object(ical, 'FEED_TOKEN_MAX_AGE', datetime.timedelta(0)):
+            self.assertEqual(self.fetch()[0].status_code, 404)
+        self.user.set_password('new secret')
+        self.user.save()
+        self.assertEqual(self.fetch()[0].status_code, 404)
+
+    def test_export_has_every_event_unless_a_window_is_asked_for(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        def export(query=''):
+            response = client.get(f'/api/calendar/export/{query}')
+            self.assertEqual(response.status_code, 200)
+            return b''.join(response.streaming_content).decode()
+
+        self.assertIn('Old harvest', export())
+        self.assertNotIn('Old harvest', export('?past=30'))
+        self.assertIn('Market day', export('?past=30'))
+
+
+class CalendarRangeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='planner')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add(self, title, start, days=0, hours=1, **kwargs):
+        start = timezone.make_aware(datetime.datetime.fromisoformat(start))
+        return Event.objects.create(
+            user=self.user, title=title, start=start, end=start + datetime.timedelta(days=days, hours=hours), **kwargs
+        )
+
+    def titles(self, query):
+        response = self.client.get(f'/api/calendar/events/?{query}')
+        self.assertEqual(response.status_code, 200, response.content)
+        return [event['title'] for event in response.json()]
+
+    def test_range_returns_overlapping_events_only(self):
+        self.add('Season', '2026-02-20T00:00:00', days=20, event_type='harvest')
+        self.add('Inside', '2026-03-10T09:00:00', event_type='market')
+        self.add('Straddles end', '2026-03-31T23:00:00', hours=3, event_type='delivery')
+        self.add('Before', '2026-02-01T09:00:00')
+        self.add('After', '2026-04-02T09:00:00')
+
+        self.assertEqual(
+            self.titles('start=2026-03-01&end=2026-04-01'), ['Season', 'Inside', 'Straddles end']
+        )
+        self.assertEqual(self.titles('start=2026-03-01&end=2026-04-01&event_type=market,delivery'),
+                         ['Inside', 'Straddles end'])
+
+    def test_longest_span_grows_with_new_events(self):
+        self.add('Short', '2026-03-10T09:00:00')
+        self.assertEqual(self.titles('start=2026-03-20&end=2026-03-21'), [])
+        long = self.add('Long', '2026-03-01T00:00:00', days=30)
+        self.assertEqual(self.titles('start=2026-03-20&end=2026-03-21'), ['Long'])
+        # Read from the database, so every worker sees it, and shrinks again.
+        self.assertEqual(Event.longest_span(self.user.pk), datetime.timedelta(days=30, hours=1))
+        long.delete()
+        self.assertEqual(Event.longest_span(self.user.pk), datetime.timedelta(hours=1))
+
+    def test_range_mode_uses_calendar_serializer(self):
+        self.add('Market', '2026-03-10T09:00:00', event_type='market')
+        response = self.client.get('/api/calendar/events/?start=2026-03-01&end=2026-04-01')
+        self.assertEqual(
+            set(response.json()[0]), {'id', 'title', 'start', 'end', 'all_day', 'event_type', 'color', 'recurring'}
+        )
+        self.assertEqual(self.client.get('/api/calendar/events/?start=2026-03-01&end=nope').status_code, 400)
+
+    def test_series_expand_lazily_within_range(self):
+        exception = timezone.make_aware(datetime.datetime(2026, 3, 11, 9))
+        series = self.add('Standup', '2020-01-01T09:00:00', recurrence='FREQ=DAILY',
+                          exception_dates=[exception.isoformat()])
+        self.add('Finished', '2026-01-05T09:00:00', recurrence='FREQ=WEEKLY;COUNT=3')
+        self.add('Market', '2026-03-10T12:00:00')
+        self.assertIsNone(series.recurrence_end)
+
+        response = self.client.get('/api/calendar/events/?start=2026-03-10&end=2026-03-13')
+        events = response.json()
+        self.assertEqual([event['title'] for event in events], ['Standup', 'Market', 'Standup'])
+        self.assertEqual([event['start'][:10] for event in events], ['2026-03-10', '2026-03-10', '2026-03-12'])
+        self.assertEqual([event['recurring'] for event in events], [True, False, True])
+
+    def test_invalid_recurrence_rejected(self):
+        response = self.client.post('/api/calendar/events/', {
+            'title': 'Broken', 'event_type': 'market', 'start': '2026-03-10T09:00:00Z',
+            'end': '2026-03-10T10:00:00Z', 'recurrence': 'FREQ=SOMETIMES',
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('recurrence', response.json())
+
+    def test_recurrence_limits(self):
+        def post(recurrence):
+            return self.client.post('/api/calendar/events/', {
+                'title': 'Series', 'event_type': 'market', 'start': '2026-03-10T09:00:00Z',
+                'end': '2026-03-10T10:00:00Z', 'recurrence': recurrence,
+            }, format='json').status_code
+
+        for recurrence in ['FREQ=SECONDLY;COUNT=300000', 'FREQ=HOURLY', 'FREQ=DAILY;BYHOUR=9,10',
+                           'FREQ=DAILY;COUNT=1001', 'FREQ=DAILY;UNTIL=20500101T000000Z']:
+            self.assertEqual(post(recurrence), 400, recurrence)
+        self.assertEqual(post('FREQ=WEEKLY;BYDAY=SA;UNTIL=20300101T000000Z'), 201)
+        self.assertEqual(post('FREQ=DAILY;COUNT=1000'), 201)
+
+        # Rules saved before the limits are not walked to the end.
+        legacy = self.add('Legacy', '2026-03-10T09:00:00', recurrence='FREQ=SECONDLY;COUNT=300000')
+        self.assertIsNone(legacy.recurrence_end)
+
+    def test_range_mode_caps_occurrences(self):
+        self.add('Standup', '2026-03-01T09:00:00', recurrence='FREQ=DAILY')
+        self.add('Market', '2026-03-02T12:00:00')
+        with mock.patch.object(EventViewSet, 'max_series_occurrences', 3):
+            response = self.client.get('/api/calendar/events/?start=2026-03-01&end=2026-03-08')
+        self.assertEqual(len(response.json()), 4)
+        self.assertEqual(response['X-Truncated'], 'true')
+        with mock.patch.object(EventViewSet, 'max_calendar_events', 2):
+            response = self.client.get('/api/calendar/events/?start=2026-03-01&end=2026-03-08')
+        self.assertEqual([event['title'] for event in response.json()], ['Standup', 'Standup'])
+        self.assertEqual(response['X-Truncated'], 'true')
+        response = self.client.get('/api/calendar/events/?start=2026-03-01&end=2026-03-08')
+        self.assertEqual(len(response.json()), 8)
+        self.assertNotIn('X-Truncated', response)
+
+
+class InventoryReservationTests(TestCase):
+    def setUp(self):
+        self.farmer = make_farmer('grower')
+        self.customer = User.objects.create_user(username='buyer')
+        self.product = make_product(self.farmer, quantity=5)
+
+    def test_place_order_holds_stock_and_snapshots_price(self):
+        order = inventory.place_order(self.customer, [(self.product.pk, 2), (self.product.pk, 1)])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 2)
+        self.assertEqual(order.status, Order.PENDING)
+        self.assertIsNotNone(order.reserved_until)
+        order.refresh_from_db()
+        self.assertEqual(order.total, Decimal('7.50'))
+
+    def test_short_line_rolls_back_whole_order(self):
+        other = make_product(self.farmer, name='Okra', quantity=1)
+        with self.assertRaises(inventory.InsufficientStock):
+            inventory.place_order(self.customer, [(self.product.pk, 2), (other.pk, 2)])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 5)
+        self.assertFalse(Order.objects.exists())
+
+    def test_expired_holds_are_released_once(self):
+        order = inventory.place_order(self.customer, [(self.product.pk, 4)])
+        kept = inventory.place_order(self.customer, [(self.product.pk, 1)])
+        self.assertTrue(inventory.complete_order(kept))
+
+        later = timezone.now() + inventory.reservation_timeout() + datetime.timedelta(seconds=1)
+        self.assertEqual(inventory.release_expired(later), 1)
+        self.assertEqual(inventory.release_expired(later), 0)
+        order.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertEqual(order.status, Order.CANCELLED)
+        self.assertEqual(self.product.quantity, 4)
+        self.assertFalse(inventory.complete_order(order))
+
+
+class CheckoutConcurrencyTests(TransactionTestCase):
+    def test_parallel_buyers_never_oversell(self):
+        product = make_product(make_farmer('hot'), quantity=200, image='')
+        results = checkout_stress(product, buyers=50)
+        self.assertEqual(results['oversold'], 0)
+        self.assertTrue(results['consistent'])
+        self.assertEqual(results['checkouts'], 200)
+        self.assertEqual(results['remaining_stock'], 0)
+        self.assertEqual(results['sold_out'], 50)
+
+
+class OrderTotalsTests(TestCase):
+    def setUp(self):
+        self.farmer = make_farmer('grower')
+        self.tomatoes = make_product(self.farmer, price=Decimal('2.50'), image='')
+        self.mangoes = make_product(self.farmer, name='Mangoes', category='FR', price=Decimal('6.00'), image='')
+        self.milk = make_product(make_farmer('dairy'), name='Milk', category='DA', price=Decimal('4.00'), image='')
+        self.customer = User.objects.create_user(username='buyer')
+
+    def test_total_follows_item_changes(self):
+        order = make_order(self.customer, [self.tomatoes, self.mangoes])
+        order.refresh_from_db()
+        self.assertEqual(order.total, Decimal('17.00'))
+
+        item = order.items.get(product=self.mangoes)
+        item.quantity = 1
+        item.save()
+        order.refresh_from_db()
+        self.assertEqual(order.total, Decimal('11.00'))
+
+        item.delete()
+        order.refresh_from_db()
+        self.assertEqual(order.total, Decimal('5.00'))
+        order.items.get().delete()
+        order.refresh_from_db()
+        self.assertEqual(order.total, Decimal('0'))
+
+    def test_stats(self):
+        # One completed order with two of the farmer's lines and another
+        # farmer's line, one pending, one cancelled.
+        make_order(self.customer, [self.tomatoes, self.mangoes, self.milk], status=Order.COMPLETED)
+        make_order(self.customer, [self.tomatoes])
+        make_order(self.customer, [self.mangoes], status=Order.CANCELLED)
+        self.assertEqual(self.farmer.sales_summary(), {
+            'total_products': 2, 'total_orders': 3, 'active_orders': 1, 'total_revenue': Decimal('17.00'),
+        })
+
+        client = APIClient()
+        client.force_authenticate(self.farmer.user)
+        self.assertEqual(client.get('/api/farm/stats/').json(),
+                         {'total_products': 2, 'active_orders': 1, 'total_revenue': 17.0})
+        self.assertEqual(client.get('/api/user/stats/').json(),
+                         {'total_orders': 3, 'total_products': 2, 'total_revenue': 17.0})
+        client.force_authenticate(self.customer)
+        self.assertEqual(client.get('/api/user/stats/').json()['total_orders'], 3)
+        self.assertEqual(client.get('/api/farm/stats/').status_code, 403)
+
+
+class OrderExportTests(TestCase):
+    def setUp(self):
+        self.farmer = make_farmer('grower')
+        self.tomatoes = make_product(self.farmer, image='')
+        milk = make_product(make_farmer('dairy'), name='Milk', category='DA', price=Decimal('4.00'), image='')
+        self.customer = User.objects.create_user(username='buyer')
+        self.old = make_order(self.customer, [self.tomatoes, milk], status=Order.COMPLETED)
+        Order.objects.filter(pk=self.old.pk).update(created_at=timezone.make_aware(datetime.datetime(2026, 1, 15, 12)))
+        self.recent = make_order(self.customer, [self.tomatoes])
+        self.client = APIClient()
+
+    def export(self, user, query=''):
+        self.client.force_authenticate(user)
+        response = self.client.get(f'/api/orders/export/{query}')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content), response
+
+    def rows(self, user, query=''):
+        body, _ = self.export(user, query)
+        return list(csv.reader(io.StringIO(body.decode())))
+
+    def test_lines_per_role(self):
+        rows = self.rows(self.farmer.user)
+        self.assertEqual(rows[0][:3], ['Order ID', 'Date', 'Status'])
+        self.assertEqual([(int(row[0]), row[6]) for row in rows[1:]], [(self.old.pk, 'Tomatoes'), (self.recent.pk, 'Tomatoes')])
+        self.assertEqual(rows[1][3:5], ['buyer', '13.00'])
+        self.assertEqual(rows[1][7:], ['2', '2.50', '5.00'])
+        self.assertEqual(len(self.rows(self.customer)), 4)
+
+    def test_filters(self):
+        self.assertEqual([int(row[0]) for row in self.rows(self.farmer.user, '?status=completed')[1:]], [self.old.pk])
+        self.assertEqual([int(row[0]) for row in self.rows(self.customer, '?end=2026-01-15')[1:]], [self.old.pk] * 2)
+        self.assertEqual([int(row[0]) for row in self.rows(self.customer, '?start=2026-01-16')[1:]], [self.recent.pk])
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(self.client.get('/api/orders/export/?start=2026-02-30').status_code, 400)
+
+    def test_gzip(self):
+        body, response = self.export(self.farmer.user, '?compress=gzip')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('orders.csv.gz', response['Content-Disposition'])
+        plain, _ = self.export(self.farmer.user)
+        self.assertEqual(gzip.decompress(body), plain)
+
+
+class SalesAnalyticsTests(TestCase):
+    def setUp(self):
+        self.farmer = make_farmer('grower')
+        self.tomatoes = make_product(self.farmer, category='VG', image='')
+        self.mangoes = make_product(self.farmer, name='Mangoes', category='FR', image='')
+        self.customer = User.objects.create_user(username='buyer')
+
+    def test_orders_spanning_categories_count_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            make_order(self.customer, [self.tomatoes, self.mangoes], status=Order.COMPLETED)
+            make_order(self.customer, [self.tomatoes, self.mangoes])
+        client = APIClient()
+        client.force_authenticate(self.farmer.user)
+        data = client.get('/api/analytics/').json()
+        self.assertEqual(
+            [(row['revenue'], row['units'], row['orders']) for row in data['monthly_revenue']],
+            [(Decimal('10.00'), 4, 1)],
+        )
+        self.assertEqual(data['order_status'], [{'status': 'COMPLETED', 'orders': 1}, {'status': 'PENDING', 'orders': 1}])
+
+        # Rebuilding from the command gives the same counts.
+        call_command('rebuild_sales_rollup', stdout=io.StringIO())
+        self.assertEqual(client.get('/api/analytics/').json()['order_status'], data['order_status'])
+
+
+class OrderCreateTests(TestCase):
+    def setUp(self):
+        farmer = make_farmer('grower')
+        self.products = [make_product(farmer, name=f'Crop {i}', price=Decimal(i + 1), quantity=10) for i in range(20)]
+        self.customer = User.objects.create_user(username='buyer')
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def cart(self, quantity=2):
+        return {'items': [{'product': product.pk, 'quantity': quantity} for product in self.products]}
+
+    def test_nested_create_costs_constant_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/api/orders/', self.cart(), format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 2)
+        self.assertLess(len(ctx.captured_queries), 20 + 10)
+
+        data = response.json()
+        self.assertEqual(data['customer'], self.customer.pk)
+        self.assertEqual(data['status'], Order.PENDING)
+        self.assertEqual(Decimal(data['total']), Decimal(2 * sum(range(1, 21))))
+        self.assertEqual([item['price'] for item in data['items']], [str(p.price) for p in Product.objects.order_by('id')])
+        self.assertEqual(Order.objects.get().total, Decimal(420))
+
+    def test_list_of_orders_is_all_or_nothing(self):
+        response = self.client.post('/api/orders/', [self.cart(3), self.cart(3)], format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(len(response.json()), 2)
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].quantity, 4)
+
+        response = self.client.post('/api/orders/', [self.cart(1), self.cart(4)], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.count(), 2)
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].quantity, 4)
+
+    def test_cancelling_returns_stock(self):
+        order_id = self.client.post('/api/orders/', self.cart(), format='json').json()['id']
+        response = self.client.patch(f'/api/orders/{order_id}/', {'status': Order.CANCELLED}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].quantity, 10)
+        farmer = APIClient()
+        farmer.force_authenticate(self.products[0].farmer.user)
+        response = farmer.patch(f'/api/orders/{order_id}/', {'status': Order.COMPLETED}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_status_changes_are_limited_to_the_participants(self):
+        order_id = self.client.post('/api/orders/', self.cart(), format='json').json()['id']
+        url = f'/api/orders/{order_id}/'
+        stranger = APIClient()
+        stranger.force_authenticate(User.objects.create_user(username='stranger'))
+        self.assertEqual(stranger.get('/api/orders/').json(), [])
+        self.assertEqual(stranger.patch(url, {'status': Order.CANCELLED}, format='json').status_code, 404)
+        self.assertEqual(self.client.patch(url, {'status': Order.COMPLETED}, format='json').status_code, 403)
+        self.assertEqual(self.client.delete(url).status_code, 403)
+        self.assertEqual(Order.objects.get().status, Order.PENDING)
+
+        farmer = APIClient()
+        farmer.force_authenticate(self.products[0].farmer.user)
+        response = farmer.patch(url, {'status': Order.COMPLETED}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(Order.objects.get().status, Order.COMPLETED)
+
+
+class ProductImageTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.farmer = make_farmer('grower')
+
+    def upload(self, size=(2000, 1000)):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, 'green').save(buffer, 'JPEG')
+        return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_upload_builds_hashed_derivatives(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = make_product(self.farmer, image=self.upload())
+        product.refresh_from_db()
+        self.assertEqual(len(product.image_hash), 32)
+
+        data = self.client.get(f'/api/products/{product.pk}/').json()
+        self.assertEqual(set(data['images']), set(images.VARIANTS))
+        url = data['images']['thumbnail']['webp']
+        self.assertIn(f'/media/derivatives/{product.image_hash}/thumbnail.webp', url)
+        self.assertNotIn('image_hash', data)
+
+        response = self.client.get(url)
+        self.assertEqual(response['Cache-Control'], images.CACHE_CONTROL)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        with Image.open(io.BytesIO(b''.join(response.streaming_content))) as thumbnail:
+            self.assertEqual(thumbnail.size, (150, 75))
+
+    def test_missing_derivatives_built_on_first_request(self):
+        product = make_product(self.farmer, image=self.upload())
+        self.assertEqual(Product.objects.get(pk=product.pk).image_hash, '')
+        url = self.client.get(f'/api/products/{product.pk}/').json()['images']['card']['jpg']
+        self.assertIn(f'/products/{product.pk}/image/card.jpg', url)
+
+        response = self.client.get(url)
+        product.refresh_from_db()
+        self.assertRedirects(response, f'/media/derivatives/{product.image_hash}/card.jpg', fetch_redirect_response=False)
+
+    def test_backfill_command_skips_unreadable_images(self):
+        product = make_product(self.farmer, image=self.upload())
+        make_product(self.farmer)
+        out = io.StringIO()
+        with self.assertLogs('marketplace.images', 'WARNING'):
+            call_command('generate_product_images', stdout=out)
+        self.assertIn('Built derivatives for 1 products (1 failed)', out.getvalue())
+        product.refresh_from_db()
+        self.assertTrue(product.image_hash)
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        caches['catalog'].clear()
+        caching.metrics.reset()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.farmer = make_farmer('grower')
+            self.other = make_farmer('neighbour')
+            self.tomatoes = make_product(self.farmer, category='VG', image='')
+            self.mangoes = make_product(self.other, name='Mangoes', category='FR', image='')
+
+    def fetch(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response['X-Cache']
+
+    def test_hits_until_a_write_touches_the_scope(self):
+        self.assertEqual(self.fetch('/api/products/?category=FR'), 'MISS')
+        self.assertEqual(self.fetch('/api/products/?category=FR'), 'HIT')
+        self.assertEqual(self.fetch(f'/api/products/{self.tomatoes.pk}/'), 'MISS')
+        self.assertEqual(self.fetch('/api/products/?category=VG&in_stock=1'), 'MISS')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tomatoes.price = Decimal('3.00')
+            self.tomatoes.save()
+        self.assertEqual(self.fetch('/api/products/?category=FR'), 'HIT')
+        self.assertEqual(self.fetch('/api/products/?in_stock=1&category=VG'), 'MISS')
+        self.assertEqual(self.fetch(f'/api/products/{self.tomatoes.pk}/'), 'MISS')
+        self.assertEqual(caching.metrics.snapshot()['ProductList'], {'hits': 2, 'misses': 3, 'hit_ratio': 0.4})
+
+    def test_moving_category_invalidates_old_listing(self):
+        self.fetch('/api/products/?category=FR')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.mangoes.category = 'VG'
+            self.mangoes.save()
+        self.assertEqual(self.fetch('/api/products/?category=FR'), 'MISS')
+        self.assertEqual(self.client.get('/api/products/?category=FR').json()['results'], [])
+
+    def test_scopes_follow_the_parsed_filters(self):
+        self.assertEqual(self.fetch(f'/api/products/?farmer=0{self.other.pk}'), 'MISS')
+        self.assertEqual(self.fetch('/api/products/?category=FR,FR'), 'MISS')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.mangoes.price = Decimal('7.00')
+            self.mangoes.save()
+        self.assertEqual(self.fetch(f'/api/products/?farmer=0{self.other.pk}'), 'MISS')
+        self.assertEqual(self.fetch('/api/products/?category=FR,FR'), 'MISS')
+
+        for query in ('category=XX', 'category=VG,nope', 'farmer=me'):
+            self.assertEqual(self.client.get(f'/api/products/?{query}').status_code, 400, query)
+        for scope in ('category:XX', 'category:nope', 'farmer-products:me'):
+            self.assertIsNone(caching.get_cache().get(caching.VERSION_KEY.format(scope)), scope)
+
+    def test_fresh_listings_expire_at_midnight(self):
+        cache = caching.get_cache()
+        with mock.patch.object(caching, 'seconds_until_tomorrow', return_value=42), \
+                mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            self.fetch('/api/products/?category=VG')
+            self.fetch('/api/products/?category=FR&fresh=0')
+        self.assertEqual([call.args[2] for call in cache_set.call_args_list], [42, settings.CATALOG_CACHE_TIMEOUT])
+
+    def test_checkout_and_farmer_edits_invalidate(self):
+        self.fetch(f'/api/products/{self.mangoes.pk}/')
+        self.fetch(f'/api/farmers/{self.farmer.pk}/')
+        self.fetch(f'/api/farmers/{self.other.pk}/')
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.place_order(User.objects.create_user(username='buyer'), [(self.mangoes.pk, 3)])
+        response = self.client.get(f'/api/products/{self.mangoes.pk}/')
+        self.assertEqual((response['X-Cache'], response.json()['quantity']), ('MISS', 97))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.farmer.user.email = 'new@example.com'
+            self.farmer.user.save()
+        self.assertEqual(self.fetch(f'/api/farmers/{self.farmer.pk}/'), 'MISS')
+        self.assertEqual(self.fetch(f'/api/farmers/{self.other.pk}/'), 'HIT')
+
+
+class FastListParityTests(TestCase):
+    """The .values() fast path must render exactly what the serializers do"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.farmer = make_farmer('grower', bio='Organic')
+        cls.farmer.user.first_name = 'Ama'
+        cls.farmer.user.save()
+        products = [
+            make_product(cls.farmer, name='Tomatoes', price=Decimal('2.5')),
+            make_product(cls.farmer, name='Yams', category='GR', image='', image_hash='ab' * 16),
+            make_product(cls.farmer, name='Milk', category='DA', image_hash='cd' * 16, image_source='products/tomatoes.jpg'),
+        ]
+        cls.customer = User.objects.create_user(username='buyer')
+        orders = [make_order(cls.customer, products[:i + 1]) for i in range(3)]
+        Order.objects.create(customer=cls.customer, status=Order.CANCELLED)
+        start = timezone.now()
+        for i, related in enumerate([None, orders[0], products[1], cls.customer]):
+            Event.objects.create(
+                user=cls.farmer.user, title=f'Event {i}', event_type='market', start=start - datetime.timedelta(days=i),
+                end=start + datetime.timedelta(minutes=30 * i + 1), exception_dates=[start.isoformat()] if i else [],
+                related_object=related,
+            )
+
+    def compare(self, view, url, user=None):
+        client = APIClient()
+        if user:
+            client.force_authenticate(user)
+        fast = client.get(url)
+        caches['catalog'].clear()
+        with mock.patch.object(view, 'values_serializer_class', None):
+            slow = client.get(url)
+        self.assertEqual(fast.status_code, 200, fast.content)
+        self.assertEqual(fast.content, slow.content)
+        return fast.json()
+
+    def test_products(self):
+        data = self.compare(ProductList, '/api/products/')
+        self.assertEqual(len(data['results']), 3)
+        self.compare(ProductList, '/api/products/?page_size=2&category=VG,GR')
+        self.compare(ProductList, '/api/products/?sort=rating&min_rating=1')
+        self.compare(FarmerProducts, '/api/farmer/products/', self.farmer.user)
+
+    def test_orders(self):
+        self.assertEqual(len(self.compare(OrderViewSet, '/api/orders/', self.customer)), 4)
+        self.compare(OrderViewSet, '/api/orders/?expand=product&page_size=2', self.customer)
+        self.compare(FarmerOrders, '/api/farmer/orders/?expand=product', self.farmer.user)
+
+    def test_events(self):
+        data = self.compare(EventViewSet, '/api/calendar/events/', self.farmer.user)
+        self.assertEqual(len(data), 4)
+        self.compare(EventViewSet, '/api/calendar/events/?event_type=market', self.farmer.user)
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        metrics.metrics.reset()
+        caches['catalog'].clear()
+        self.farmer = make_farmer('grower')
+        self.product = make_product(self.farmer, image='')
+
+    def test_records_per_route_and_exports_prometheus_text(self):
+        for _ in range(2):
+            self.assertEqual(self.client.get(f'/api/products/{self.product.pk}/').status_code, 200)
+        self.client.get('/api/products/0/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        lines = response.content.decode().splitlines()
+        route = 'route="api/products/<int:pk>/",method="GET"'
+        self.assertIn(f'http_requests_total{{{route},status="200"}} 2', lines)
+        self.assertIn(f'http_requests_total{{{route},status="404"}} 1', lines)
+        self.assertIn(f'http_request_duration_seconds_count{{{route}}} 3', lines)
+        self.assertIn(f'http_request_db_queries_count{{{route}}} 3', lines)
+        self.assertIn(f'http_response_size_bytes_bucket{{{route},le="+Inf"}} 3', lines)
+        self.assertIn('notification_stream_connections 0', lines)
+        self.assertIn('catalog_cache_requests_total{view="ProductDetail",result="hit"} 1', lines)
+
+    def test_scrape_is_limited_to_allowed_addresses(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.9').status_code, 403)
+
+    @override_settings(METRICS_SLOW_REQUEST_SECONDS=0)
+    def test_slow_requests_log_repeated_queries(self):
+        for name in ('Yams', 'Okra', 'Maize'):
+            make_product(self.farmer, name=name, image='')
+
+        def n_plus_one(request):
+            names = [product.farmer.farm_name for product in Product.objects.all()]
+            return HttpResponse(', '.join(names))
+
+        middleware = metrics.RequestMetricsMiddleware(n_plus_one)
+        with self.assertLogs('marketplace.metrics', 'WARNING') as logs:
+            middleware(RequestFactory().get('/n-plus-one/'))
+        self.assertIn('slow request GET /n-plus-one/ (route <unmatched>)', logs.output[0])
+        self.assertIn('5 queries', logs.output[0])
+        self.assertIn('4x SELECT', logs.output[0])
+
+
+class BenchmarkSuiteTests(TestCase):
+    tiny = {'farmers': 2, 'products_per_farmer': 3, 'customers': 2, 'orders_per_customer': 2,
+            'items_per_order': 2, 'notifications_per_customer': 3, 'events_per_farmer': 2}
+
+    def test_generates_the_requested_shape(self):
+        shape = benchmarks.scaled_shape(2, self.tiny)
+        self.assertEqual(shape['farmers'], 2)
+        self.assertEqual(shape['products_per_farmer'], 6)
+        users = benchmarks.generate(shape)
+        self.assertEqual(Product.objects.count(), 12)
+        self.assertEqual(Order.objects.count(), 8)
+        self.assertEqual(OrderItem.objects.count(), 16)
+        self.assertEqual(Notification.objects.filter(user=users['customer']).count(), 6)
+        self.assertEqual(Event.objects.filter(user=users['farmer']).count(), 4)
+
+    def test_command_writes_results_and_compares_with_a_baseline(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = f'{tmp}/baseline.json'
+            call_command('benchmark_api', scales='1', requests=3, output=path, stdout=io.StringIO(), **self.tiny)
+            with open(path) as f:
+                report = json.load(f)
+            self.assertEqual([row['endpoint'] for row in report['results']],
+                             ['ProductList', 'FarmerOrders', 'NotificationViewSet', 'export_ical'])
+            for row in report['results']:
+                self.assertLessEqual(row['p50_ms'], row['p95_ms'])
+                self.assertLessEqual(row['p95_ms'], row['p99_ms'])
+                self.assertGreater(row['peak_kib'], 0)
+
+            # A baseline that issued fewer queries and ran much faster.
+            for row in report['results']:
+                row.update(queries=row['queries'] - 1, p95_ms=row['p95_ms'] / 10)
+            with open(path, 'w') as f:
+                json.dump(report, f)
+            with self.assertRaisesMessage(CommandError, '8 regression(s)'):
+                call_command('benchmark_api', scales='1', requests=3, compare=path,
+                             stdout=io.StringIO(), stderr=io.StringIO(), **self.tiny)
+
+
+class ClaimsAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.farmer = make_farmer('grower')
+        self.customer = User.objects.create_user(username='buyer', password='pass')
+        make_order(self.customer, [make_product(self.farmer, image='')])
+
+    def login(self, username, password='pass'):
+        response = self.client.post('/api/token/', {'username': username, 'password': password})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def get(self, url, access):
+        return self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {access}')
+
+    def queries(self, url, access):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get(url, access).status_code, 200)
+        return len(queries)
+
+    def test_tokens_carry_farmer_claims(self):
+        access = AccessToken(self.login('grower')['access'])
+        self.assertEqual((access['is_farmer'], access['farmer_id'], access['username']), (True, self.farmer.pk, 'grower'))
+        access = AccessToken(self.login('buyer')['access'])
+        self.assertEqual((access['is_farmer'], access['farmer_id']), (False, None))
+
+    def test_authenticated_reads_skip_user_and_farmer_lookups(self):
+        claims = self.login('grower')['access']
+        plain = AccessToken.for_user(self.farmer.user)
+        for url in ('/api/farm/stats/', '/api/user/stats/', '/api/orders/recent/', '/api/farmer/orders/'):
+            self.assertLessEqual(self.queries(url, claims) + 2, self.queries(url, plain), url)
+        self.assertEqual(self.get('/api/user/profile/', claims).json()['farm_name'], 'grower farm')
+        self.assertEqual(self.get('/api/user/stats/', self.login('buyer')['access']).json()['total_orders'], 1)
+
+    def test_logout_revokes_access_and_refresh_tokens(self):
+        tokens = self.login('buyer')
+        other = self.login('buyer')
+        response = self.client.post('/api/token/logout/', {'refresh': tokens['refresh']},
+                                    HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get('/api/user/stats/', tokens['access']).status_code, 401)
+        self.assertEqual(self.client.post('/api/token/refresh/', {'refresh': tokens['refresh']}).status_code, 401)
+        self.assertEqual(self.get('/api/user/stats/', other['access']).status_code, 200)
+
+    def test_refresh_rotates_and_password_change_revokes(self):
+        tokens = self.login('buyer')
+        refreshed = self.client.post('/api/token/refresh/', {'refresh': tokens['refresh']}).json()
+        self.assertEqual(self.client.post('/api/token/refresh/', {'refresh': tokens['refresh']}).status_code, 401)
+        self.assertEqual(self.get('/api/user/stats/', refreshed['access']).status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customer.set_password('new-pass')
+            self.customer.save()
+        self.assertEqual(self.get('/api/user/stats/', refreshed['access']).status_code, 401)
+        self.assertEqual(self.client.post('/api/token/refresh/', {'refresh': refreshed['refresh']}).status_code, 401)
+        self.assertEqual(self.get('/api/user/stats/', self.login('buyer', 'new-pass')['access']).status_code, 200)
+
+    def test_stale_claims_fall_back_to_the_database(self):
+        access = self.login('buyer')['access']
+        self.assertEqual(self.get('/api/farm/stats/', access).status_code, 403)
+        with self.captureOnCommitCallbacks(execute=True):
+            FarmerProfile.objects.create(user=self.customer, farm_name='New farm', location='Tamale')
+        self.assertEqual(self.get('/api/farm/stats/', access).status_code, 200)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TransactionTestCase):
+    """A second SQLite database stands in for a lagging replica"""
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        self.farmer = make_farmer('grower')
+        self.product = make_product(self.farmer, quantity=2, image='')
+        self.customer = User.objects.create_user(username='buyer')
+
+    def replicate(self, **stale):
+        """Copy the current rows to the replica, then make the product stale there"""
+        for obj in (self.farmer.user, self.customer, self.farmer):
+            type(obj).objects.using('replica').bulk_create([copy.copy(obj)])
+        Product.objects.using('replica').bulk_create([copy.copy(self.product)])
+        Product.objects.using('replica').filter(pk=self.product.pk).update(**stale)
+
+    def client_for(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {authentication.issue_token(user).access_token}')
+        return client
+
+    def order(self, quantity):
+        return self.client_for(self.customer).post(
+            '/api/orders/', {'items': [{'product': self.product.pk, 'quantity': quantity}]}, format='json'
+        )
+
+    def test_safe_reads_go_to_the_replica(self):
+        self.replicate(quantity=100)
+        farmer = self.client_for(self.farmer.user)
+        self.assertEqual(farmer.get('/api/farmer/products/').json()[0]['quantity'], 100)
+        # Cached catalog views read the primary on a miss.
+        self.assertEqual(self.client.get(f'/api/products/{self.product.pk}/').json()['quantity'], 2)
+
+    def test_orders_check_stock_on_the_primary(self):
+        self.replicate(quantity=100)
+        response = self.order(5)
+        self.assertEqual(response.status_code, 400, response.content)
+
+        Product.objects.filter(pk=self.product.pk).update(quantity=10)
+        Product.objects.using('replica').filter(pk=self.product.pk).update(quantity=0)
+        response = self.order(3)
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).quantity, 7)
+
+    def test_writers_read_their_own_writes(self):
+        self.replicate()
+        self.assertEqual(self.order(1).status_code, 201)
+        client = self.client_for(self.customer)
+        self.assertEqual(len(client.get('/api/orders/').json()), 1)
+        # Once the pin expires the (not yet replicated) order is not visible.
+        cache.delete(routers.PIN_KEY.format(self.customer.pk))
+        self.assertEqual(client.get('/api/orders/').json(), [])
+
+    def test_reads_inside_transactions_use_the_primary(self):
+        router = routers.PrimaryReplicaRouter()
+        token = routers.read_database.set('replica')
+        try:
+            self.assertEqual(router.db_for_read(Product), 'replica')
+            with transaction.atomic():
+                self.assertEqual(router.db_for_read(Product), 'default')
+        finally:
+            routers.read_database.reset(token)
+        self.assertEqual(router.db_for_read(Product), 'default')
+
+
+class NearbySearchTests(TestCase):
+    def setUp(self):
+        caches['catalog'].clear()
+        self.kumasi = make_farmer('kumasi', location='Kumasi')
+        self.ejisu = make_farmer('ejisu', location='Ejisu, near Kumasi')
+        self.tamale = make_farmer('tamale', location='Tamale')
+
+    def test_farms_are_geocoded_offline(self):
+        self.assertEqual(geo.encode(57.64911, 10.40744), 'u4pruydqq')
+        self.assertEqual((self.ejisu.latitude, self.ejisu.longitude), (6.7247, -1.4745))
+        self.assertEqual(self.ejisu.geohash, geo.encode(6.7247, -1.4745))
+        self.assertIsNone(geo.geocode('Atlantis'))
+
+        self.ejisu.location = 'Tamale'
+        self.ejisu.save()
+        self.assertEqual(self.ejisu.latitude, self.tamale.latitude)
+        custom = make_farmer('custom', location='Somewhere', latitude=6.7, longitude=-1.6)
+        self.assertEqual((custom.latitude, custom.longitude, custom.geohash[:5]), (6.7, -1.6, geo.encode(6.7, -1.6)[:5]))
+
+    def test_nearby_farms_are_ranked_by_distance(self):
+        data = self.client.get('/api/farmers/nearby/?near=Kumasi&radius=25').json()
+        self.assertEqual(data['count'], 2)
+        self.assertEqual([farm['id'] for farm in data['results']], [self.kumasi.pk, self.ejisu.pk])
+        self.assertEqual(data['results'][0]['distance_km'], 0)
+        self.assertAlmostEqual(data['results'][1]['distance_km'], 17.04, delta=0.05)
+
+        data = self.client.get('/api/farmers/nearby/?lat=6.69&lon=-1.62&radius=5').json()
+        self.assertEqual([farm['id'] for farm in data['results']], [self.kumasi.pk])
+        self.assertEqual(self.client.get('/api/farmers/nearby/?lat=6.69').status_code, 400)
+        self.assertEqual(self.client.get('/api/farmers/nearby/?near=Kumasi&radius=5000').status_code, 400)
+
+    def test_nearby_products_are_in_stock_and_filtered(self):
+        near = make_product(self.ejisu, name='Yams', category='GR', image='')
+        make_product(self.kumasi, name='Sold out', quantity=0, image='')
+        nearest = make_product(self.kumasi, name='Okra', image='')
+        make_product(self.tamale, name='Far away', image='')
+        data = self.client.get('/api/products/nearby/?near=Kumasi&radius=25').json()
+        self.assertEqual([(p['id'], p['distance_km'] > 0) for p in data['results']], [(nearest.pk, False), (near.pk, True)])
+        data = self.client.get('/api/products/nearby/?near=Kumasi&radius=25&category=GR').json()
+        self.assertEqual((data['count'], data['results'][0]['id']), (1, near.pk))
+
+    def test_cell_prefilter_matches_brute_force(self):
+        rng = random.Random(7)
+        FarmerProfile.objects.bulk_create([
+            FarmerProfile(user=User.objects.create(username=f'farm-{i}'), farm_name='Farm', location='',
+                          contact_number='0', latitude=lat, longitude=lon, geohash=geo.encode(lat, lon))
+            for i, (lat, lon) in enumerate((rng.uniform(5, 8), rng.uniform(-3, 0)) for _ in range(300))
+        ])
+        points = list(FarmerProfile.objects.values_list('pk', 'latitude', 'longitude'))
+        for radius in (1, 10, 40, 150):
+            lat, lon = rng.uniform(5, 8), rng.uniform(-3, 0)
+            expected = sorted(pk for pk, la, lo in points if geo.haversine_km(lat, lon, la, lo) <= radius)
+            found = geo.nearest(FarmerProfile.objects.all(), lat, lon, radius)
+            self.assertEqual(sorted(pk for pk, _ in found), expected, radius)
+            self.assertEqual([d for _, d in found], sorted(d for _, d in found))
+
+
+class ProductReviewTests(TestCase):
+    def setUp(self):
+        caches['catalog'].clear()
+        self.farmer = make_farmer('grower')
+        self.tomatoes = make_product(self.farmer, image='')
+        self.yams = make_product(self.farmer, name='Yams', category='GR', image='')
+        self.okra = make_product(self.farmer, name='Okra', image='')
+        self.customers = [User.objects.create_user(username=f'buyer{i}') for i in range(3)]
+
+    def review(self, product, user, rating, comment=''):
+        client = APIClient()
+        client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            return client.post(f'/api/products/{product.pk}/reviews/', {'rating': rating, 'comment': comment})
+
+    def ratings(self, product):
+        product.refresh_from_db()
+        return product.rating_count, product.rating_sum, product.rating_average, reviews.histogram(product)
+
+    def test_reviews_maintain_the_aggregates(self):
+        for user, rating in zip(self.customers, [5, 4, 4]):
+            response = self.review(self.tomatoes, user, rating, 'Good')
+            self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(self.ratings(self.tomatoes), (3, 13, 13 / 3, {'1': 0, '2': 0, '3': 0, '4': 2, '5': 1}))
+
+        client = APIClient()
+        client.force_authenticate(self.customers[0])
+        review_id = response.json()['id']
+        self.assertEqual(client.patch(f'/api/reviews/{review_id}/', {'rating': 1}).status_code, 404)
+        mine = ProductReview.objects.get(user=self.customers[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(client.patch(f'/api/reviews/{mine.pk}/', {'rating': 2}).status_code, 200)
+        self.assertEqual(self.ratings(self.tomatoes), (3, 10, 10 / 3, {'1': 0, '2': 1, '3': 0, '4': 2, '5': 0}))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(client.delete(f'/api/reviews/{mine.pk}/').status_code, 204)
+        self.assertEqual(self.ratings(self.tomatoes), (2, 8, 4.0, {'1': 0, '2': 0, '3': 0, '4': 2, '5': 0}))
+
+        listed = self.client.get(f'/api/products/{self.tomatoes.pk}/reviews/').json()
+        self.assertEqual([(r['username'], r['rating']) for r in listed], [('buyer2', 4), ('buyer1', 4)])
+        product = self.client.get(f'/api/products/{self.tomatoes.pk}/').json()
+        self.assertEqual((product['rating_count'], product['rating_average']), (2, 4.0))
+
+    def test_one_review_per_customer_and_none_by_the_farmer(self):
+        self.assertEqual(self.review(self.tomatoes, self.customers[0], 5).status_code, 201)
+        self.assertEqual(self.review(self.tomatoes, self.customers[0], 3).status_code, 400)
+        self.assertEqual(self.review(self.tomatoes, self.farmer.user, 5).status_code, 400)
+        self.assertEqual(self.review(self.tomatoes, self.customers[1], 6).status_code, 400)
+        self.assertEqual(self.client.post(f'/api/products/{self.tomatoes.pk}/reviews/', {'rating': 5}).status_code, 401)
+        self.assertEqual(self.ratings(self.tomatoes)[:2], (1, 5))
+
+    def test_saving_a_stale_product_keeps_newer_ratings(self):
+        stale = Product.objects.get(pk=self.tomatoes.pk)
+        self.review(self.tomatoes, self.customers[0], 5)
+        stale.price = Decimal('3.00')
+        stale.save()
+        self.assertEqual(self.ratings(self.tomatoes)[:2], (1, 5))
+        self.assertEqual(self.tomatoes.price, Decimal('3.00'))
+
+    def test_sort_and_filter_by_rating(self):
+        for product, ratings in [(self.tomatoes, [4, 4]), (self.yams, [5]), (self.okra, [3, 5])]:
+            for user, rating in zip(self.customers, ratings):
+                self.review(product, user, rating)
+        make_product(self.farmer, name='Unrated', image='')
+
+        names = [p['name'] for p in self.client.get('/api/products/?sort=rating').json()['results']]
+        self.assertEqual(names, ['Yams', 'Okra', 'Tomatoes'])
+        names = [p['name'] for p in self.client.get('/api/products/?min_rating=4.5').json()['results']]
+        self.assertEqual(names, ['Yams'])
+        page = self.client.get('/api/products/?sort=rating&page_size=2').json()
+        self.assertEqual([p['name'] for p in page['results']], ['Yams', 'Okra'])
+        page = self.client.get(page['next']).json()
+        self.assertEqual([p['name'] for p in page['results']], ['Tomatoes'])
+        self.assertEqual(page['results'][0]['rating_histogram'], {'1': 0, '2': 0, '3': 0, '4': 2, '5': 0})
+        self.assertEqual(self.client.get('/api/products/?sort=cheapest').status_code, 400)
+        self.assertEqual(self.client.get('/api/products/?min_rating=9').status_code, 400)
+
+    def test_rating_pages_seek_past_ties(self):
+        tied = [make_product(self.farmer, name=f'Tied {i}', image='') for i in range(12)]
+        for product in tied:
+            reviews.add_rating(product.pk, 4)
+        reviews.add_rating(self.yams.pk, 5)
+        expected = ['Yams'] + [p.name for p in reversed(tied)]
+
+        seen, pages, url = [], [], '/api/products/?sort=rating&page_size=5'
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                page = self.client.get(url).json()
+            self.assertFalse([q for q in queries if 'OFFSET' in q['sql']])
+            seen.extend(p['name'] for p in page['results'])
+            pages.append(page)
+            url = page['next']
+        self.assertEqual(seen, expected)
+
+        back = self.client.get(pages[-1]['previous']).json()
+        self.assertEqual([p['name'] for p in back['results']], expected[5:10])
+        self.assertEqual(self.client.get('/api/products/?sort=rating&cursor=bogus').status_code, 404)
+
+    def test_repair_recomputes_drifted_aggregates(self):
+        self.review(self.tomatoes, self.customers[0], 2)
+        # bulk_create skips the signals that keep the columns in step.
+        ProductReview.objects.bulk_create([
+            ProductReview(product=self.yams, user=self.customers[0], rating=5),
+            ProductReview(product=self.tomatoes, user=self.customers[1], rating=4),
+        ])
+        Product.objects.filter(pk=self.okra.pk).update(rating_count=1, rating_sum=3, rating_average=3.0, rating_3=1)
+        out = io.StringIO()
+        call_command('repair_product_ratings', '--chunk-size', '2', stdout=out)
+        self.assertIn('Checked 3 products, fixed 3', out.getvalue())
+        self.assertEqual(self.ratings(self.tomatoes), (2, 6, 3.0, {'1': 0, '2': 1, '3': 0, '4': 1, '5': 0}))
+        self.assertEqual(self.ratings(self.yams)[:3], (1, 5, 5.0))
+        self.assertEqual(self.ratings(self.okra), (0, 0, 0.0, {'1': 0, '2': 0, '3': 0, '4': 0, '5': 0}))
+
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        farmer = make_farmer('grower')
+        self.a, self.b, self.c, self.d = [make_product(farmer, name=name, image='') for name in 'ABCD']
+        self.customer = User.objects.create_user(username='buyer')
+        for basket in [[self.a, self.b, self.c], [self.a, self.b], [self.a, self.c], [self.d]]:
+            make_order(self.customer, basket)
+        make_order(self.customer, [self.b, self.c], status=Order.CANCELLED)
+
+    def stored(self):
+        return {
+            product: [(related, round(score, 6), together) for _, related, score, together in rows]
+            for product, rows in itertools.groupby(
+                ProductRecommendation.objects.order_by('product_id', 'rank')
+                .values_list('product_id', 'related_id', 'score', 'together'),
+                key=lambda row: row[0],
+            )
+        }
+
+    def related(self, product):
+        response = self.client.get(f'/api/products/{product.pk}/related/')
+        self.assertEqual(response.status_code, 200, response.content)
+        return [(p['name'], p['score'], p['bought_together']) for p in response.json()['results']]
+
+    def test_build_ranks_by_cosine_similarity(self):
+        out = io.StringIO()
+        call_command('build_recommendations', stdout=out)
+        self.assertIn('Wrote recommendations for 3 products', out.getvalue())
+        # B and C were only bought together once outside the cancelled order.
+        with self.assertNumQueries(1):
+            self.assertEqual(self.related(self.a), [('B', 0.8165, 2), ('C', 0.8165, 2)])
+        self.assertEqual(self.related(self.b), [('A', 0.8165, 2)])
+        self.assertEqual(self.related(self.d), [])
+
+        Product.objects.filter(pk=self.b.pk).update(quantity=0)
+        self.assertEqual(self.related(self.a), [('C', 0.8165, 2)])
+        self.assertEqual(self.client.get('/api/products/999999/related/').status_code, 404)
+
+    def age_history(self):
+        """Move the lines written so far a day back, out of the rescan margin"""
+        OrderItem.objects.update(added_at=F('added_at') - datetime.timedelta(days=1))
+
+    def test_incremental_update_matches_a_full_build(self):
+        recommendations.build()
+        self.age_history()
+        for _ in range(2):
+            make_order(self.customer, [self.b, self.c])
+        out = io.StringIO()
+        call_command('build_recommendations', '--incremental', stdout=out)
+        self.assertIn('Wrote recommendations for 3 products', out.getvalue())
+        self.assertEqual(self.related(self.b), [('C', 0.75, 3), ('A', 0.5774, 2)])
+        incremental = self.stored()
+        recommendations.build()
+        self.assertEqual(self.stored(), incremental)
+
+        call_command('build_recommendations', '--incremental', stdout=io.StringIO())
+        self.assertEqual(self.stored(), incremental)
+
+    def test_incremental_update_picks_up_late_lines(self):
+        recommendations.build()
+        self.age_history()
+        started_at = RecommendationBuild.objects.get().started_at
+
+        # A line added to an order the build already counted...
+        counted = Order.objects.get(items__product=self.d)
+        OrderItem.objects.create(order=counted, product=self.a, quantity=1, price=self.a.price)
+        # ...and a checkout that wrote its lines before the build but
+        # committed after it.
+        late = make_order(self.customer, [self.a, self.d])
+        late.items.update(added_at=started_at - datetime.timedelta(minutes=5))
+
+        recommendations.update()
+        self.assertEqual([name for name, _, _ in self.related(self.d)], ['A'])
+        incremental = self.stored()
+        recommendations.build()
+        self.assertEqual(self.stored(), incremental)
@@ -1,14 +1,39 @@
-from django.urls import path
-from .views import FarmerList, FarmerDetail, ProductList, ProductDetail, FarmerProducts, FarmerOrders, RegisterView, UserProfileView, FarmStatsView
+from django.urls import path, re_path
+from rest_framework.routers import DefaultRouter
+from .views import FarmerList, FarmerDetail, FarmersNearby, ProductList, ProductsNearby, ProductDetail, ProductReviews, RelatedProducts, ProductSearch, FarmerProducts, FarmerOrders, RegisterView, UserProfileView, FarmStatsView, UserStatsView, AnalyticsView, RecentOrdersView, ReviewDetail, OrderViewSet, NotificationViewSet, EventViewSet, NotificationStreamStats, CatalogCacheStats, CalendarFeedURL, calendar_feed, export_ical, export_orders, image_derivative, notification_stream, product_image
+
+router = DefaultRouter()
+router.register('orders', OrderViewSet)
+router.register('notifications', NotificationViewSet, basename='notification')
+router.register('calendar/events', EventViewSet, basename='event')
 
 urlpatterns = [
     path('farmers/', FarmerList.as_view()),
+    path('farmers/nearby/', FarmersNearby.as_view(), name='farmers-nearby'),
     path('farmers/<int:pk>/', FarmerDetail.as_view()),
     path('products/', ProductList.as_view()),
+    path('products/search/', ProductSearch.as_view(), name='product-search'),
+    path('products/nearby/', ProductsNearby.as_view(), name='products-nearby'),
+    path('catalog/cache/stats/', CatalogCacheStats.as_view(), name='catalog-cache-stats'),
     path('register/', RegisterView.as_view(), name='register'),
     path('products/<int:pk>/', ProductDetail.as_view()),
+    path('products/<int:pk>/related/', RelatedProducts.as_view(), name='product-related'),
+    path('products/<int:pk>/reviews/', ProductReviews.as_view(), name='product-reviews'),
+    path('reviews/<int:pk>/', ReviewDetail.as_view(), name='review-detail'),
+    path('products/<int:pk>/image/<str:variant>.<str:ext>', product_image, name='product-image'),
+    re_path(r'^media/derivatives/(?P<image_hash>[0-9a-f]{32})/(?P<variant>[a-z]+)\.(?P<ext>[a-z]+)$',
+            image_derivative, name='image-derivative'),
     path('farmer/products/', FarmerProducts.as_view()),
     path('farmer/orders/', FarmerOrders.as_view()),
+    path('orders/export/', export_orders, name='export-orders'),
+    path('orders/recent/', RecentOrdersView.as_view(), name='recent-orders'),
+    path('calendar/feed/', CalendarFeedURL.as_view(), name='calendar-feed-url'),
+    path('calendar/feed/<str:token>.ics', calendar_feed, name='calendar-feed'),
+    path('calendar/export/', export_ical, name='export-ical'),
+    path('notifications/stream/', notification_stream, name='notification-stream'),
+    path('notifications/stream/stats/', NotificationStreamStats.as_view(), name='notification-stream-stats'),
     path('user/profile/', UserProfileView.as_view(), name='user-profile'),
     path('farm/stats/', FarmStatsView.as_view(), name='farm-stats'),
-]
\ No newline at end of file
+    path('user/stats/', UserStatsView.as_view(), name='user-stats'),
+    path('analytics/', AnalyticsView.as_view(), name='analytics'),
+] + router.urls
\ No newline at end of file
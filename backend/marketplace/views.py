@@ -1,65 +1,404 @@
-from asyncio import Event
-import csv
-from django.http import HttpResponse
+import heapq
+import itertools
+import logging
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q
+from django.http import FileResponse, Http404, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.views.decorators.http import condition
 from rest_framework import generics
-from .models import FarmerProfile, Notification, Order, Product
-from .serializers import EventSerializer, FarmerProfileSerializer, NotificationSerializer, OrderSerializer, ProductSerializer, UserSerializer
+from .caching import CachedResponseMixin
+from .analytics import PERIODS, day_bounds, sales_analytics
+from .exports import ORDER_EXPORT_HEADER, csv_stream, gzip_stream, order_item_rows
+from .fast import EventValues, FastListMixin, OrderValues, ProductValues
+from .filters import calendar_range, filter_event_types, filter_products, filter_related, fresh_only, product_categories, product_farmer, search_point
+from .models import Event, FarmerProfile, Notification, Order, OrderItem, Product, ProductRecommendation, ProductReview
+from . import authentication, caching, geo, ical, images, notifications, realtime
+from .pagination import OrderCursorPagination, ProductCursorPagination, ReviewCursorPagination
+from .routers import replica_reads
+from .search import get_search_backend, tokenize
+from .serializers import CustomTokenObtainPairSerializer, CustomTokenRefreshSerializer, EventCalendarSerializer, EventSerializer, FarmerProfileSerializer, NotificationFanOutSerializer, NotificationSerializer, OrderSerializer, ProductReviewSerializer, ProductSerializer, UserSerializer
 from rest_framework import viewsets, status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.permissions import SAFE_METHODS, IsAdminUser, IsAuthenticated, IsAuthenticatedOrReadOnly
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from icalendar import Calendar, Event as ICalEvent
 
-class FarmerList(generics.ListCreateAPIView):
+logger = logging.getLogger(__name__)
+
+class FarmerList(CachedResponseMixin, generics.ListCreateAPIView):
     queryset = FarmerProfile.objects.all()
     serializer_class = FarmerProfileSerializer
 
-class FarmerDetail(generics.RetrieveUpdateDestroyAPIView):
+    def cache_scopes(self, request):
+        return ['farmers']
+
+class FarmerDetail(CachedResponseMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = FarmerProfile.objects.all()
     serializer_class = FarmerProfileSerializer
 
-class ProductList(generics.ListCreateAPIView):
+    def cache_scopes(self, request, pk):
+        return [f'farmer:{pk}']
+
+class ProductList(CachedResponseMixin, FastListMixin, generics.ListCreateAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    values_serializer_class = ProductValues
+    pagination_class = ProductCursorPagination
+
+    def cache_scopes(self, request):
+        # A filtered list only changes when a product in one of its
+        # categories (or of its farmer) does. The parameters are parsed as
+        # filter_products does, so scopes match the ones signals bump.
+        params = request.query_params
+        categories = product_categories(params)
+        if categories:
+            return [f'category:{category}' for category in sorted(set(categories))]
+        farmer = product_farmer(params)
+        if farmer is not None:
+            return [f'farmer-products:{farmer}']
+        return ['products']
 
-class ProductDetail(generics.RetrieveUpdateDestroyAPIView):
+    def get_cache_timeout(self, request):
+        timeout = super().get_cache_timeout(request)
+        if not fresh_only(request.query_params):
+            return timeout
+        # Stock expires at midnight, and with it the listing.
+        until = caching.seconds_until_tomorrow()
+        return until if timeout is None else min(timeout, until)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method == 'GET':
+            queryset = filter_products(queryset, self.request.query_params)
+        return queryset
+
+class ProductDetail(CachedResponseMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
 
+    def cache_scopes(self, request, pk):
+        return [f'product:{pk}']
+
+
+class RelatedProducts(APIView):
+    """In-stock products frequently bought together with this one, strongest
+    first, from the table ``manage.py build_recommendations`` precomputes"""
+
+    def get(self, request, pk):
+        rows = list(
+            ProductRecommendation.objects.filter(product_id=pk, related__quantity__gt=0)
+            .select_related('related').order_by('rank')
+        )
+        if not rows and not Product.objects.filter(pk=pk).exists():
+            raise Http404('No such product')
+        results = ProductSerializer([row.related for row in rows], many=True, context={'request': request}).data
+        for row, data in zip(rows, results):
+            data['score'] = round(row.score, 4)
+            data['bought_together'] = row.together
+        return Response({'count': len(results), 'results': results})
+
+
+class ProductReviews(generics.ListCreateAPIView):
+    """A product's reviews, newest first; signed-in customers add theirs"""
+    serializer_class = ProductReviewSerializer
+    pagination_class = ReviewCursorPagination
+    permission_classes = [IsAuthenticatedOrReadOnly]
+
+    def get_product(self):
+        if not hasattr(self, '_product'):
+            self._product = get_object_or_404(Product.objects.select_related('farmer'), pk=self.kwargs['pk'])
+        return self._product
+
+    def get_queryset(self):
+        return (
+            ProductReview.objects.filter(product=self.get_product())
+            .select_related('user').order_by('-created_at', '-id')
+        )
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.request.method == 'POST':
+            context['product'] = self.get_product()
+        return context
+
+    def perform_create(self, serializer):
+        # The review and its product's rating aggregates commit together.
+        with transaction.atomic():
+            serializer.save(product=self.get_product(), user=self.request.user)
+
+
+class ReviewDetail(generics.RetrieveUpdateDestroyAPIView):
+    """A review; only its author can change or delete it"""
+    serializer_class = ProductReviewSerializer
+    permission_classes = [IsAuthenticatedOrReadOnly]
+
+    def get_queryset(self):
+        queryset = ProductReview.objects.select_related('user')
+        if self.request.method not in SAFE_METHODS:
+            queryset = queryset.filter(user=self.request.user)
+        return queryset
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            serializer.save()
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+
+
+def product_image(request, pk, variant, ext):
+    """Redirect to a resized product photo, building it on first request"""
+    if variant not in images.VARIANTS or ext not in images.FORMATS:
+        raise Http404('Unknown image variant')
+    product = get_object_or_404(Product.objects.only('image', 'image_hash', 'image_source', 'category', 'farmer_id'), pk=pk)
+    if not product.image:
+        raise Http404('Product has no image')
+    image_hash = images.refresh_product_images(product)
+    if image_hash is None:
+        return HttpResponseRedirect(product.image.url)
+    return HttpResponseRedirect(default_storage.url(images.derivative_name(image_hash, variant, ext)))
+
+
+def image_derivative(request, image_hash, variant, ext):
+    """Serve a derivative; its content-hash URL never changes meaning"""
+    name = images.derivative_name(image_hash, variant, ext)
+    if variant not in images.VARIANTS or ext not in images.FORMATS or not default_storage.exists(name):
+        raise Http404('Unknown image')
+    response = FileResponse(default_storage.open(name), content_type=f'image/{images.FORMATS[ext][0].lower()}')
+    response['Cache-Control'] = images.CACHE_CONTROL
+    return response
+
+
+class ProductSearch(APIView):
+    """Ranked full-text search over product names and descriptions"""
+    default_limit = 20
+    max_limit = 100
+
+    def get(self, request):
+        terms = tokenize(request.query_params.get('q'))
+        category = request.query_params.get('category') or None
+        try:
+            limit = min(max(int(request.query_params.get('limit', self.default_limit)), 1), self.max_limit)
+            offset = max(int(request.query_params.get('offset', 0)), 0)
+        except ValueError:
+            return Response({'error': 'limit and offset must be integers'}, status=status.HTTP_400_BAD_REQUEST)
 
-class OrderViewSet(viewsets.ModelViewSet):
+        if not terms:
+            return Response({'count': 0, 'facets': {}, 'results': []})
+
+        backend = get_search_backend()
+        facets = backend.facets(terms)
+        hits = backend.search(terms, category=category, limit=limit, offset=offset)
+        products = Product.objects.in_bulk([product_id for product_id, _ in hits])
+
+        results = []
+        for product_id, rank in hits:
+            # The index is updated in the same transaction as the product, so
+            # a miss here only happens with a concurrent delete.
+            if product_id not in products:
+                continue
+            data = ProductSerializer(products[product_id], context={'request': request}).data
+            data['rank'] = rank
+            results.append(data)
+
+        count = facets.get(category, 0) if category else sum(facets.values())
+        return Response({'count': count, 'facets': facets, 'results': results})
+
+
+class NearbyView(APIView):
+    """Radius search around ``?lat=&lon=`` (or ``?near=<town>``), nearest first"""
+    default_limit = 20
+    max_limit = 100
+
+    def limit(self, request):
+        try:
+            return min(max(int(request.query_params.get('limit', self.default_limit)), 1), self.max_limit)
+        except ValueError:
+            raise ValidationError({'limit': 'A valid integer is required.'})
+
+    def farms(self, request):
+        """``{farmer_id: distance_km}`` of the farms within the radius"""
+        latitude, longitude, radius = search_point(request.query_params)
+        return dict(geo.nearest(FarmerProfile.objects.all(), latitude, longitude, radius))
+
+
+class FarmersNearby(NearbyView):
+    def get(self, request):
+        farms = self.farms(request)
+        page = list(farms)[:self.limit(request)]
+        found = FarmerProfile.objects.select_related('user').in_bulk(page)
+        serializer = FarmerProfileSerializer([found[pk] for pk in page], many=True, context={'request': request})
+        results = serializer.data
+        for data in results:
+            data['distance_km'] = round(farms[data['id']], 3)
+        return Response({'count': len(farms), 'results': results})
+
+
+class ProductsNearby(NearbyView):
+    """In-stock products of the farms within the radius, nearest farm first.
+
+    Takes the catalog filters (``category``, ``min_price``...) as well.
+    """
+
+    def get(self, request):
+        farms = self.farms(request)
+        limit = self.limit(request)
+        products = filter_products(Product.objects.filter(farmer_id__in=farms, quantity__gt=0), request.query_params)
+        ranked = sorted(products.values_list('farmer_id', 'pk'), key=lambda row: (farms[row[0]], row[1]))
+        page = [pk for _, pk in ranked[:limit]]
+        found = Product.objects.in_bulk(page)
+        serializer = ProductSerializer([found[pk] for pk in page], many=True, context={'request': request})
+        results = serializer.data
+        for data in results:
+            data['distance_km'] = round(farms[data['farmer']], 3)
+        return Response({'count': len(ranked), 'results': results})
+
+
+class OrderListMixin:
+    """Order list plumbing shared by the order views.
+
+    Items are prefetched (with their products when ``?expand=product``) so a
+    page of orders costs the same number of queries whatever its size.
+    """
+    pagination_class = OrderCursorPagination
+
+    def expand_product(self):
+        return 'product' in self.request.query_params.get('expand', '').split(',')
+
+    def with_items(self, queryset):
+        return queryset.with_items(products=self.expand_product())
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['expand_product'] = self.expand_product()
+        return context
+
+
+class OrderViewSet(OrderListMixin, FastListMixin, viewsets.ModelViewSet):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
+    values_serializer_class = OrderValues
     permission_classes = [IsAuthenticated]
 
+    def get_queryset(self):
+        """The requester's own orders; a single order is also open to the
+        farmers selling in it, who complete it"""
+        user = self.request.user
+        queryset = super().get_queryset()
+        if user.is_staff:
+            return self.with_items(queryset)
+        visible = Q(customer=user)
+        if self.action != 'list' and hasattr(user, 'farmerprofile'):
+            visible |= Q(pk__in=Order.objects.for_farmer(user.farmerprofile).values('pk'))
+        return self.with_items(queryset.filter(visible))
+
+    def get_serializer(self, *args, **kwargs):
+        # A JSON list creates several orders in one transaction.
+        if self.action == 'create' and isinstance(kwargs.get('data'), list):
+            kwargs['many'] = True
+        return super().get_serializer(*args, **kwargs)
+
+    def perform_create(self, serializer):
+        serializer.save(customer=self.request.user)
+
+    def perform_update(self, serializer):
+        order = serializer.instance
+        new_status = serializer.validated_data.get('status', order.status)
+        if new_status != order.status and not self.may_set_status(order, new_status):
+            raise PermissionDenied(f'You cannot mark this order {new_status.lower()}')
+        serializer.save()
+
+    def perform_destroy(self, instance):
+        # Deleting would drop the held stock; buyers cancel instead.
+        if not self.request.user.is_staff:
+            raise PermissionDenied('Cancel the order instead of deleting it')
+        instance.delete()
+
+    def may_set_status(self, order, new_status):
+        """Buyers may cancel their order; the farmers selling in it may
+        cancel or complete it; staff may do either"""
+        user = self.request.user
+        if user.is_staff:
+            return True
+        sells = hasattr(user, 'farmerprofile') and order.items.filter(product__farmer=user.farmerprofile).exists()
+        if new_status == Order.CANCELLED:
+            return order.customer_id == user.pk or sells
+        return sells
+
 # Export CSV
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
 def export_orders(request):
-    response = HttpResponse(content_type='text/csv')
-    writer = csv.writer(response)
-    writer.writerow(['Order ID', 'Date', 'Total'])
+    """Stream the caller's order lines as CSV (or gzipped CSV with ?compress=gzip).
 
-from rest_framework.permissions import IsAuthenticated
+    Farmers get every line item for their products, customers the items of
+    their own orders. Optional filters: start, end (YYYY-MM-DD, on the order
+    date) and status.
+    """
+    if hasattr(request.user, 'farmerprofile'):
+        items = OrderItem.objects.filter(product__farmer=request.user.farmerprofile)
+    else:
+        items = OrderItem.objects.filter(order__customer=request.user)
 
-class FarmerProducts(generics.ListAPIView):
+    params = request.query_params
+    try:
+        start = parse_date(params.get('start', ''))
+        end = parse_date(params.get('end', ''))
+    except ValueError:
+        return Response({'error': 'start and end must be YYYY-MM-DD dates'}, status=status.HTTP_400_BAD_REQUEST)
+    if start:
+        items = items.filter(order__created_at__gte=day_bounds(start)[0])
+    if end:
+        items = items.filter(order__created_at__lt=day_bounds(end)[1])
+    if params.get('status'):
+        items = items.filter(order__status=params['status'].upper())
+
+    chunks = csv_stream(ORDER_EXPORT_HEADER, order_item_rows(items))
+    if params.get('compress') == 'gzip':
+        response = StreamingHttpResponse(gzip_stream(chunks), content_type='application/gzip')
+        response['Content-Disposition'] = 'attachment; filename="orders.csv.gz"'
+    else:
+        response = StreamingHttpResponse(chunks, content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="orders.csv"'
+    return response
+
+
+class FarmerProducts(FastListMixin, generics.ListAPIView):
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
         return Product.objects.filter(farmer__user=self.request.user)
     
     serializer_class = ProductSerializer
+    values_serializer_class = ProductValues
 
-class FarmerOrders(generics.ListAPIView):
+class FarmerOrders(OrderListMixin, FastListMixin, generics.ListAPIView):
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        return Order.objects.filter(items__product__farmer__user=self.request.user).distinct()
+        farmer = getattr(self.request.user, 'farmerprofile', None)
+        if farmer is None:
+            return Order.objects.none()
+        return self.with_items(Order.objects.for_farmer(farmer).order_by('-created_at', '-id'))
     
     serializer_class = OrderSerializer
+    values_serializer_class = OrderValues
 
-# views.py - Add these debug prints
 class RegisterView(APIView):
     def post(self, request):
-        print("Received registration data:", request.data)  # Debug print
         data = request.data
         is_farmer = data.get('is_farmer', False)
         
@@ -69,14 +408,11 @@ class RegisterView(APIView):
             'password': data['password']
         })
         
-        print("User serializer data:", user_serializer.initial_data)  # Debug print
-        
         if user_serializer.is_valid():
-            print("User data is valid")  # Debug print
             user = user_serializer.save()
+            logger.info('registered user %s (farmer=%s)', user.pk, bool(is_farmer))
             
             if is_farmer:
-                print("Creating farmer profile")  # Debug print
                 farmer_data = {
                     'user': user.id,
                     'farm_name': data['farm_name'],
@@ -86,21 +422,48 @@ class RegisterView(APIView):
                 farmer_serializer = FarmerProfileSerializer(data=farmer_data)
                 if farmer_serializer.is_valid():
                     farmer_serializer.save()
-                    print("Farmer profile created")  # Debug print
                 else:
-                    print("Farmer profile errors:", farmer_serializer.errors)  # Debug print
+                    logger.warning('farmer profile for user %s not created: %s', user.pk, farmer_serializer.errors)
             
             return Response({'message': 'User registered successfully'}, status=status.HTTP_201_CREATED)
         
-        print("User serializer errors:", user_serializer.errors)  # Debug print
         return Response(user_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
 
+class CustomTokenObtainPairView(TokenObtainPairView):
+    serializer_class = CustomTokenObtainPairSerializer
+
+
+class CustomTokenRefreshView(TokenRefreshView):
+    serializer_class = CustomTokenRefreshSerializer
+
+
+class LogoutView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        """Revoke the access token used and the refresh token, if posted"""
+        tokens = [request.auth]
+        if request.data.get('refresh'):
+            try:
+                refresh = authentication.ClaimsRefreshToken(request.data['refresh'])
+            except TokenError as exc:
+                return Response({'refresh': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+            if refresh[jwt_settings.USER_ID_CLAIM] != request.auth[jwt_settings.USER_ID_CLAIM]:
+                return Response({'refresh': 'Token belongs to another user'}, status=status.HTTP_400_BAD_REQUEST)
+            tokens.append(refresh)
+        for token in tokens:
+            authentication.revoke_token(token)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
 class UserProfileView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        user = request.user
+        # request.user may be built from token claims; read the row (and
+        # farm) once rather than field by field.
+        user = User.objects.select_related('farmerprofile').get(pk=request.user.pk)
         data = {
             'name': user.get_full_name() or user.username,
             'email': user.email,
@@ -121,12 +484,12 @@ class FarmStatsView(APIView):
     def get(self, request):
         if not hasattr(request.user, 'farmerprofile'):
             return Response({'error': 'Not a farmer'}, status=403)
-            
-        farmer = request.user.farmerprofile
+
+        summary = request.user.farmerprofile.sales_summary()
         stats = {
-            'total_products': farmer.products.count(),
-            'active_orders': farmer.orders.filter(status='active').count(),
-            'total_revenue': sum(order.total for order in farmer.orders.all())
+            'total_products': summary['total_products'],
+            'active_orders': summary['active_orders'],
+            'total_revenue': summary['total_revenue'],
         }
         return Response(stats)
     
@@ -141,29 +504,30 @@ class UserStatsView(APIView):
         }
         
         if hasattr(request.user, 'farmerprofile'):
-            farmer = request.user.farmerprofile
-            stats['total_products'] = farmer.products.count()
-            stats['total_orders'] = farmer.orders.count()
-            stats['total_revenue'] = sum(
-                order.total for order in farmer.orders.all() 
-                if order.status == 'completed'
-            )
+            summary = request.user.farmerprofile.sales_summary()
+            stats['total_products'] = summary['total_products']
+            stats['total_orders'] = summary['total_orders']
+            stats['total_revenue'] = summary['total_revenue']
         else:
             stats['total_orders'] = request.user.orders.count()
             
         return Response(stats)
     
 
-class RecentOrdersView(APIView):
+class RecentOrdersView(OrderListMixin, APIView):
     permission_classes = [IsAuthenticated]
+    pagination_class = None
 
     def get(self, request):
         if hasattr(request.user, 'farmerprofile'):
-            orders = request.user.farmerprofile.orders.all()[:5]
+            orders = request.user.farmerprofile.orders
         else:
-            orders = request.user.orders.all()[:5]
+            orders = request.user.orders.order_by('-created_at')
             
-        serializer = OrderSerializer(orders, many=True)
+        serializer = OrderSerializer(self.with_items(orders)[:5], many=True, context={
+            'request': request,
+            'expand_product': self.expand_product(),
+        })
         return Response(serializer.data)
     
 
@@ -172,20 +536,157 @@ class NotificationViewSet(viewsets.ModelViewSet):
     serializer_class = NotificationSerializer
 
     def get_queryset(self):
-        return Notification.objects.filter(user=self.request.user).order_by('-created_at')
+        queryset = Notification.objects.filter(user=self.request.user).order_by('-created_at')
+        return filter_related(queryset, self.request.query_params).with_related_objects()
 
     def partial_update(self, request, pk=None):
         notification = self.get_object()
-        notification.read = True
-        notification.save()
+        if not notification.read:
+            notifications.mark_read(request.user, ids=[notification.pk])
+            notification.read = True
         return Response(NotificationSerializer(notification).data)
+
+    @action(detail=False, methods=['post'], url_path='mark-read')
+    def mark_read(self, request):
+        """Mark the given ``ids`` read with a single UPDATE"""
+        ids = request.data.get('ids')
+        if not isinstance(ids, list) or not all(isinstance(pk, int) for pk in ids):
+            return Response({'ids': 'A list of notification ids is required'}, status=status.HTTP_400_BAD_REQUEST)
+        updated = notifications.mark_read(request.user, ids=ids)
+        return Response({'updated': updated, 'unread_count': notifications.unread_count(request.user.pk)})
+
+    @action(detail=False, methods=['post'], url_path='mark-all-read')
+    def mark_all_read(self, request):
+        updated = notifications.mark_read(request.user)
+        return Response({'updated': updated, 'unread_count': 0})
+
+    @action(detail=False, methods=['get'], url_path='unread-count')
+    def unread_count(self, request):
+        """Badge count, answered from the per-user cached counter"""
+        return Response({'unread_count': notifications.unread_count(request.user.pk)})
+
+    @action(detail=False, methods=['post'], url_path='fan-out')
+    def fan_out(self, request):
+        """Queue one notification per recipient; returns the job to poll"""
+        serializer = NotificationFanOutSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        job = notifications.fan_out(
+            data['recipients'],
+            data['message'],
+            data['notification_type'],
+            related_object=data.get('related_object'),
+            batch_size=data.get('batch_size'),
+        )
+        return Response(job.as_dict(), status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['get'], url_path=r'fan-out/(?P<job_id>[0-9a-f]+)')
+    def fan_out_status(self, request, job_id=None):
+        job = notifications.worker.get(job_id)
+        if job is None:
+            return Response({'error': 'Unknown fan-out job'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(job.as_dict())
     
-class EventViewSet(viewsets.ModelViewSet):
+async def notification_stream(request):
+    """Server-sent events feed of the caller's new notifications.
+
+    Needs the ASGI application (``farmdirect.asgi``). Browsers' EventSource
+    cannot set headers, so the access token may be passed as ``?token=``.
+    The token is verified without touching the database.
+    """
+    token = request.GET.get('token')
+    header = request.headers.get('Authorization', '')
+    if not token and header.startswith('Bearer '):
+        token = header[len('Bearer '):]
+    try:
+        access = AccessToken(token)
+        user_id = access[jwt_settings.USER_ID_CLAIM]
+        authentication.check(access)
+    except (TokenError, KeyError, AuthenticationFailed):
+        return JsonResponse({'error': 'A valid access token is required'}, status=401)
+
+    response = StreamingHttpResponse(realtime.event_stream(user_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+class NotificationStreamStats(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(realtime.metrics.snapshot())
+
+
+class CatalogCacheStats(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(caching.metrics.snapshot())
+
+
+class EventViewSet(FastListMixin, viewsets.ModelViewSet):
+    """Calendar events; ``?start=&end=`` switches lists to calendar range mode.
+
+    Range mode returns only events overlapping the window, via the (user,
+    start) index, serialized with the lightweight EventCalendarSerializer.
+    """
     permission_classes = [IsAuthenticated]
     serializer_class = EventSerializer
+    values_serializer_class = EventValues
+
+    def calendar_range(self):
+        if self.action != 'list':
+            return None
+        if not hasattr(self, '_calendar_range'):
+            self._calendar_range = calendar_range(self.request.query_params)
+        return self._calendar_range
+
+    def get_serializer_class(self):
+        if self.calendar_range():
+            return EventCalendarSerializer
+        return super().get_serializer_class()
+
+    calendar_fields = ('id', 'title', 'start', 'end', 'all_day', 'event_type', 'recurrence', 'exception_dates')
 
     def get_queryset(self):
-        return Event.objects.filter(user=self.request.user)
+        params = self.request.query_params
+        window = self.calendar_range()
+        if window:
+            queryset = Event.objects.overlapping(self.request.user.pk, *window)
+            queryset = queryset.only(*self.calendar_fields)
+            return filter_event_types(queryset, params).order_by('start', 'id')
+        queryset = Event.objects.filter(user=self.request.user).select_related('user')
+        queryset = filter_event_types(queryset, params)
+        return filter_related(queryset, params).with_related_objects()
+
+    # Range mode response limits; a truncated response has X-Truncated: true.
+    max_series_occurrences = 1000
+    max_calendar_events = 2000
+
+    def list(self, request, *args, **kwargs):
+        window = self.calendar_range()
+        if not window:
+            return super().list(request, *args, **kwargs)
+        # Single events come straight off the index; series are expanded
+        # lazily, computing only the occurrences that fall in the window.
+        limit = self.max_calendar_events
+        singles = self.get_queryset()[:limit + 1]
+        series = filter_event_types(
+            Event.objects.series_overlapping(request.user.pk, *window).only(*self.calendar_fields),
+            request.query_params,
+        )
+        occurrences, truncated = [], False
+        for event in series:
+            spans = list(itertools.islice(event.occurrences(*window), self.max_series_occurrences + 1))
+            truncated |= len(spans) > self.max_series_occurrences
+            occurrences.extend(event.as_occurrence(start, end) for start, end in spans[:self.max_series_occurrences])
+        occurrences.sort(key=lambda occurrence: occurrence.start)
+        events = list(itertools.islice(heapq.merge(singles, occurrences, key=lambda event: event.start), limit + 1))
+        response = Response(self.get_serializer(events[:limit], many=True).data)
+        if truncated or len(events) > limit:
+            response['X-Truncated'] = 'true'
+        return response
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -194,37 +695,94 @@ class AnalyticsView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        # Implement your analytics logic here
-        data = {
-            'monthly_revenue': [...],
-            'order_status': [...],
-            'customer_growth': [...]
-        }
+        if not hasattr(request.user, 'farmerprofile'):
+            return Response({'error': 'Not a farmer'}, status=403)
+
+        period = request.query_params.get('period', 'month')
+        if period not in PERIODS:
+            return Response({'error': f"period must be one of: {', '.join(PERIODS)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        today = timezone.localdate()
+        try:
+            end = parse_date(request.query_params.get('end', '')) or today
+            # Default to the current month plus the eleven before it.
+            default_start = (today.replace(day=1) - timedelta(days=335)).replace(day=1)
+            start = parse_date(request.query_params.get('start', '')) or default_start
+        except ValueError:
+            return Response({'error': 'start and end must be YYYY-MM-DD dates'}, status=status.HTTP_400_BAD_REQUEST)
+
+        data = sales_analytics(request.user.farmerprofile, start, end, period)
+        data.update({'start': start, 'end': end, 'period': period})
         return Response(data)
-    
-# notification_data = {
-#     'message': 'Your order has been shipped',
-#     'notification_type': 'order',
-#     'related_object_id': order.id,
-#     'related_content_type': ContentType.objects.get_for_model(Order)
-# }
 
-# serializer = NotificationCreateSerializer(data=notification_data, context={'request': request})
-# if serializer.is_valid():
-#     notification = serializer.save()
 
+def _window_params(request):
+    """past/future day counts for calendar feeds, falling back to defaults"""
+    def days(name, default):
+        try:
+            return max(int(request.GET.get(name, default)), 0)
+        except ValueError:
+            return default
+    return days('past', ical.DEFAULT_PAST_DAYS), days('future', ical.DEFAULT_FUTURE_DAYS)
 
 
+def _feed_events(request, user_id, window=True):
+    """The user's events, limited to the past/future window when ``window``
+    is set or the request asks for one"""
+    events = Event.objects.filter(user_id=user_id)
+    if window or 'past' in request.GET or 'future' in request.GET:
+        start, end = ical.feed_window(*_window_params(request))
+        events = ical.events_in_window(events, start, end)
+    return events.order_by('start', 'id')
+
+
+def _feed_user_id(request, token):
+    # Checked once for both the ETag and the body.
+    if not hasattr(request, '_feed_user_id'):
+        request._feed_user_id = ical.user_id_for_token(token)
+    return request._feed_user_id
+
+
+def _feed_etag(request, token):
+    user_id = _feed_user_id(request, token)
+    return ical.feed_fingerprint(_feed_events(request, user_id)) if user_id is not None else None
+
+
+@replica_reads
+@condition(etag_func=_feed_etag)
+def calendar_feed(request, token):
+    """Subscribable per-user iCalendar feed.
+
+    Authenticated by the signed token in the URL since calendar clients
+    cannot send JWTs. Answers conditional requests with 304 when nothing in
+    the window changed; ``past`` and ``future`` set the window in days.
+    """
+    user_id = _feed_user_id(request, token)
+    if user_id is None:
+        raise Http404('Unknown calendar feed')
+    response = StreamingHttpResponse(
+        ical.calendar_stream(_feed_events(request, user_id)), content_type='text/calendar; charset=utf-8'
+    )
+    response['Cache-Control'] = 'private, max-age=300'
+    return response
+
+
+class CalendarFeedURL(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        url = reverse('calendar-feed', args=[ical.feed_token(request.user)])
+        return Response({'url': request.build_absolute_uri(url)})
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
 def export_ical(request):
-    cal = Calendar()
-    events = Event.objects.filter(user=request.user)
-    for event in events:
-        ical_event = ICalEvent()
-        ical_event.add('summary', event.title)
-        ical_event.add('dtstart', event.start)
-        ical_event.add('dtend', event.end)
-        cal.add_component(ical_event)
-    
-    response = HttpResponse(cal.to_ical(), content_type='text/calendar')
+    """Download all of the caller's events as iCalendar; ``past`` and
+    ``future`` (days) limit it to a window"""
+    response = StreamingHttpResponse(
+        ical.calendar_stream(_feed_events(request, request.user.pk, window=False)),
+        content_type='text/calendar; charset=utf-8',
+    )
     response['Content-Disposition'] = 'attachment; filename="farm_events.ics"'
-    return response
\ No newline at end of file
+    return response
@@ -74,7 +74,7 @@ const Dashboard = () => {
           profile: responses[0].status === 'fulfilled' ? responses[0].value.data : null,
           stats: responses[1].status === 'fulfilled' ? responses[1].value.data : null,
           recentOrders: responses[2].status === 'fulfilled' ? responses[2].value.data : [],
-          products: responses[3].status === 'fulfilled' ? responses[3].value.data : [],
+          products: responses[3].status === 'fulfilled' ? responses[3].value.data.results : [],
           notifications: responses[4].status === 'fulfilled' ? responses[4].value.data : [],
           events: responses[5].status === 'fulfilled' 
             ? responses[5].value.data.map(event => ({
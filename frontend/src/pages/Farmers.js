@@ -19,7 +19,7 @@ const Farmers = () => {
           api.get('/products/')
         ]);
         setFarmers(farmersRes.data);
-        setProducts(productsRes.data);
+        setProducts(productsRes.data.results);
       } catch (error) {
         console.error('Error fetching data:', error);
         toast.error('Failed to load data');
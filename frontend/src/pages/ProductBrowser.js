@@ -14,7 +14,7 @@ function ProductBrowser() {
       params.append('max_price', filters.maxPrice);
       
       const response = await axios.get(`/api/products/?${params.toString()}`);
-      setProducts(response.data);
+      setProducts(response.data.results);
     };
     fetchProducts();
   }, [filters]);
@@ -38,7 +38,7 @@ const Products = () => {
     const fetchProducts = async () => {
       try {
         const response = await api.get('/products/');
-        setProducts(response.data);
+        setProducts(response.data.results);
       } catch (error) {
         console.error('Error fetching products:', error);
       } finally {